@@ -2,7 +2,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.utils.html import format_html
-from .models import User
+from .models import User, OutboundEmail
 
 @admin.register(User)
 class CustomUserAdmin(BaseUserAdmin):
@@ -137,4 +137,13 @@ class CustomUserAdmin(BaseUserAdmin):
         """Bulk enable 2FA"""
         updated = queryset.update(two_fa_enabled=True)
         self.message_user(request, f'{updated} user(s) 2FA enabled successfully.')
-    enable_2fa.short_description = "Enable 2FA for selected users"
\ No newline at end of file
+    enable_2fa.short_description = "Enable 2FA for selected users"
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    """Outbox inspection: what is queued, sent or has given up"""
+    list_display = ['to', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at', 'created_at']
+    list_filter = ['status']
+    search_fields = ['to', 'subject']
+    readonly_fields = ['created_at', 'sent_at', 'last_error']
@@ -0,0 +1,125 @@
+"""
+JWT authentication without a users-table query per request.
+
+Resolved users are kept in a small per-process LRU keyed by (user id,
+version token). The version token lives in the shared cache and is
+replaced whenever the user row changes (see signals.py), so a password
+change, deactivation or deletion in any worker is seen by every other
+worker on its next request. Entries also expire after AUTH_USER_CACHE_TTL
+seconds to bound staleness from queryset.update() calls, which bypass
+signals.
+"""
+import copy
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+def user_version_key(user_id):
+    return f"accounts:ver:user:{user_id}"
+
+
+def bump_user_version(user_id):
+    """Invalidate every worker's cached copy of the user once the write commits."""
+    def bump():
+        cache.set(user_version_key(user_id), uuid.uuid4().hex, timeout=None)
+
+    transaction.on_commit(bump)
+
+
+def _get_version(user_id):
+    key = user_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(key) or uuid.uuid4().hex
+    return version
+
+
+class _UserLRU:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, user = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return user
+
+    def put(self, key, user):
+        with self.lock:
+            # Only the current version of a user is worth keeping
+            for stale in [k for k in self.entries if k[0] == key[0]]:
+                del self.entries[stale]
+            self.entries[key] = (time.monotonic() + self.ttl, user)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+_users = None
+
+
+def _get_lru():
+    global _users
+    if _users is None:
+        _users = _UserLRU(
+            max_size=getattr(settings, 'AUTH_USER_CACHE_SIZE', 1024),
+            ttl=getattr(settings, 'AUTH_USER_CACHE_TTL', 60),
+        )
+    return _users
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that serves the user from the version-keyed LRU."""
+
+    def get_user(self, validated_token):
+        if not getattr(settings, 'AUTH_USER_CACHE_ENABLED', True):
+            return super().get_user(validated_token)
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        lru = _get_lru()
+        key = (str(user_id), _get_version(user_id))
+        user = lru.get(key)
+        if user is None:
+            try:
+                user = self.user_model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            lru.put(key, user)
+
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(
+                api_settings.REVOKE_TOKEN_CLAIM
+            ) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(
+                    _("The user's password has been changed."), code="password_changed"
+                )
+
+        # Views may modify request.user; never hand out the shared instance
+        return copy.copy(user)
@@ -0,0 +1,117 @@
+"""
+Outbound email queue.
+
+Request handlers only insert OutboundEmail rows. The send_queued_email
+management command drains them in batches over one SMTP connection per
+batch, retrying failures with exponential backoff.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+MAX_ATTEMPTS = 6
+BASE_RETRY_SECONDS = 30
+MAX_RETRY_SECONDS = 3600
+# A claimed batch is hidden from other senders for this long; if the sender
+# dies mid-batch the rows become due again afterwards
+LEASE_SECONDS = 300
+
+
+def queue_email(to, subject, body, from_email=None):
+    return OutboundEmail.objects.create(
+        to=to,
+        subject=subject,
+        body=body,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL
+    )
+
+
+def queue_verification_email(user, token):
+    frontend_url = getattr(settings, 'FRONTEND_URL', 'https://tunzadent.vercel.app')
+    verification_link = f"{frontend_url}/verify-email/{token}"
+    
+    message = f'''
+Hello {user.first_name or user.username},
+
+Thank you for registering with Tunzadent Caries Detection System.
+
+Please verify your email address by clicking the link below:
+{verification_link}
+
+This link will expire in 24 hours.
+
+After verifying your email, you'll be required to set up 2FA for security.
+
+Best regards,
+Tunzadent Team
+        '''
+    return queue_email(user.email, 'Verify your Tunzadent account', message)
+
+
+def _claim_batch(batch_size):
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        OutboundEmail.objects.filter(id__in=[m.id for m in batch]).update(
+            next_attempt_at=now + timedelta(seconds=LEASE_SECONDS)
+        )
+    return batch
+
+
+def _record_failure(message, error):
+    message.attempts += 1
+    message.last_error = str(error)[:1000]
+    if message.attempts >= MAX_ATTEMPTS:
+        message.status = 'failed'
+    else:
+        delay = min(BASE_RETRY_SECONDS * 2 ** (message.attempts - 1), MAX_RETRY_SECONDS)
+        message.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+    message.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+
+def send_queued_emails(batch_size=50):
+    """Send one batch of due emails. Returns (sent, failed) counts."""
+    batch = _claim_batch(batch_size)
+    if not batch:
+        return 0, 0
+
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        for message in batch:
+            _record_failure(message, e)
+        return 0, len(batch)
+
+    sent = failed = 0
+    try:
+        for message in batch:
+            try:
+                EmailMessage(
+                    subject=message.subject,
+                    body=message.body,
+                    from_email=message.from_email or settings.DEFAULT_FROM_EMAIL,
+                    to=[message.to],
+                    connection=connection
+                ).send()
+            except Exception as e:
+                _record_failure(message, e)
+                failed += 1
+                continue
+            message.status = 'sent'
+            message.attempts += 1
+            message.sent_at = timezone.now()
+            message.save(update_fields=['status', 'attempts', 'sent_at'])
+            sent += 1
+    finally:
+        connection.close()
+    return sent, failed
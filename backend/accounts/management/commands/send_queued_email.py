@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from accounts.emails import send_queued_emails
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued outbound emails (use --loop to run as a worker)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new mail')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between polls when idle')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            sent, failed = send_queued_emails(options['batch_size'])
+            if sent or failed:
+                self.stdout.write(f"Sent {sent} email(s), {failed} failed")
+            if not options['loop']:
+                return
+            # Drain back-to-back while there is a backlog, otherwise wait
+            if not (sent or failed):
+                time.sleep(options['interval'])
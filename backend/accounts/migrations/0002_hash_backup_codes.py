@@ -0,0 +1,38 @@
+import re
+
+from django.db import migrations
+
+from accounts import backup_codes
+
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def hash_backup_codes(apps, schema_editor):
+    """
+    Convert legacy backup codes to HMAC digests.
+
+    Plaintext codes (from generate_backup_codes) are hashed so they keep
+    working. PBKDF2 hashes (from regenerate_backup_codes) could never be
+    matched and are dropped.
+    """
+    User = apps.get_model('accounts', 'User')
+    for user in User.objects.exclude(backup_codes=[]).only('id', 'backup_codes').iterator():
+        digests = set()
+        for code in user.backup_codes or []:
+            if DIGEST_RE.match(code):
+                digests.add(code)
+            elif '$' not in code:
+                digests.add(backup_codes.digest(user.id, code))
+        user.backup_codes = sorted(digests)
+        user.save(update_fields=['backup_codes'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(hash_backup_codes, migrations.RunPython.noop),
+    ]
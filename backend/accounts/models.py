@@ -1,7 +1,9 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 import pyotp
 import secrets
+from . import backup_codes as backup_code_store
 
 class User(AbstractUser):
     email = models.EmailField(unique=True)
@@ -62,20 +64,59 @@ class User(AbstractUser):
         )
     
     def generate_backup_codes(self):
-        """Generate backup codes for 2FA recovery"""
-        codes = [secrets.token_hex(4).upper() for _ in range(10)]
-        self.backup_codes = codes
-        self.save()
+        """
+        Generate backup codes for 2FA recovery.
+        Only HMAC digests are stored; the plaintext codes are returned once.
+        """
+        codes = backup_code_store.generate_codes()
+        self.backup_codes = sorted({backup_code_store.digest(self.id, code) for code in codes})
+        self.save(update_fields=['backup_codes'])
         return codes
     
     def verify_backup_code(self, code):
-        """Verify and consume backup code"""
-        if code.upper() in self.backup_codes:
-            self.backup_codes.remove(code.upper())
-            self.save()
-            return True
-        return False
+        """Verify and consume backup code (one keyed hash + set lookup)"""
+        code_digest = backup_code_store.digest(self.id, code)
+        if code_digest not in set(self.backup_codes or []):
+            return False
+        # Re-read under a row lock so a code can only be consumed once
+        with transaction.atomic():
+            stored = type(self).objects.select_for_update().values_list(
+                'backup_codes', flat=True
+            ).get(pk=self.pk)
+            remaining = set(stored or [])
+            if code_digest not in remaining:
+                return False
+            remaining.discard(code_digest)
+            self.backup_codes = sorted(remaining)
+            self.save(update_fields=['backup_codes'])
+        return True
     
     def can_login(self):
         """Check if user can login (email verified + 2FA setup)"""
-        return self.email_verified and self.two_fa_setup_complete
\ No newline at end of file
+        return self.email_verified and self.two_fa_setup_complete
+
+
+class OutboundEmail(models.Model):
+    """Outbox row; delivered by the send_queued_email worker, never inline"""
+    to = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254, blank=True)
+    status = models.CharField(max_length=10, choices=[
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed')
+    ], default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'outbound_email'
+        ordering = ['created_at']
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+    
+    def __str__(self):
+        return f"{self.subject} -> {self.to} ({self.status})"
@@ -0,0 +1,13 @@
+"""
+Drop cached authentication state when a user changes or is deleted.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import bump_user_version
+from .models import User
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    bump_user_version(instance.pk)
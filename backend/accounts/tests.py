@@ -1,3 +1,472 @@
-from django.test import TestCase
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import pyotp
+from django.core import mail
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import authentication, backup_codes, emails, throttling
+from .emails import queue_email, send_queued_emails
+from .models import OutboundEmail, User
+from .tokens import issue_challenge, resolve_challenge
+
+PASSWORD = 'Str0ng!Passw0rd'
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def make_user(username='dentist', **fields):
+    """A verified user with 2FA set up, ready to log in"""
+    return User.objects.create_user(
+        username=username,
+        email=f"{username}@example.com",
+        password=PASSWORD,
+        email_verified=True,
+        two_fa_secret=pyotp.random_base32(),
+        two_fa_enabled=True,
+        two_fa_setup_complete=True,
+        **fields
+    )
+
+
+# ============================================
+# Outbound email queue
+# ============================================
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class EmailQueueTests(TestCase):
+    def setUp(self):
+        self.message = queue_email('dentist@example.com', 'Subject', 'Body')
+
+    def test_delivers_queued_email(self):
+        self.assertEqual(send_queued_emails(), (1, 0))
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['dentist@example.com'])
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, 'sent')
+        self.assertEqual(self.message.attempts, 1)
+        self.assertIsNotNone(self.message.sent_at)
+
+    def test_sent_email_is_not_resent(self):
+        send_queued_emails()
+        self.assertEqual(send_queued_emails(), (0, 0))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_failure_is_retried_with_backoff(self):
+        with mock.patch.object(emails.EmailMessage, 'send', side_effect=OSError('connection reset')):
+            before = timezone.now()
+            self.assertEqual(send_queued_emails(), (0, 1))
+
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, 'pending')
+        self.assertEqual(self.message.attempts, 1)
+        self.assertIn('connection reset', self.message.last_error)
+        self.assertAlmostEqual(
+            (self.message.next_attempt_at - before).total_seconds(),
+            emails.BASE_RETRY_SECONDS, delta=5
+        )
+
+        # Not due yet
+        self.assertEqual(send_queued_emails(), (0, 0))
+
+        # Second failure waits twice as long
+        OutboundEmail.objects.filter(id=self.message.id).update(next_attempt_at=timezone.now())
+        with mock.patch.object(emails.EmailMessage, 'send', side_effect=OSError('connection reset')):
+            before = timezone.now()
+            send_queued_emails()
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.attempts, 2)
+        self.assertAlmostEqual(
+            (self.message.next_attempt_at - before).total_seconds(),
+            emails.BASE_RETRY_SECONDS * 2, delta=5
+        )
+
+        # Delivered once the backend recovers
+        OutboundEmail.objects.filter(id=self.message.id).update(next_attempt_at=timezone.now())
+        self.assertEqual(send_queued_emails(), (1, 0))
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, 'sent')
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_gives_up_after_max_attempts(self):
+        OutboundEmail.objects.filter(id=self.message.id).update(attempts=emails.MAX_ATTEMPTS - 1)
+        with mock.patch.object(emails.EmailMessage, 'send', side_effect=OSError('mailbox unavailable')):
+            self.assertEqual(send_queued_emails(), (0, 1))
+
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, 'failed')
+        self.assertEqual(self.message.attempts, emails.MAX_ATTEMPTS)
+
+        OutboundEmail.objects.filter(id=self.message.id).update(next_attempt_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(send_queued_emails(), (0, 0))
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_connection_failure_counts_against_whole_batch(self):
+        queue_email('nurse@example.com', 'Subject', 'Body')
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.open', side_effect=OSError('refused')):
+            self.assertEqual(send_queued_emails(), (0, 2))
+        self.assertFalse(OutboundEmail.objects.filter(attempts=0).exists())
+
+    def test_claimed_batch_is_leased_to_one_worker(self):
+        first = emails._claim_batch(10)
+        self.assertEqual([m.id for m in first], [self.message.id])
+
+        # A second worker polling during the lease gets nothing
+        self.assertEqual(emails._claim_batch(10), [])
+        self.assertEqual(send_queued_emails(), (0, 0))
+        self.assertEqual(len(mail.outbox), 0)
+
+        # If the first worker dies, the row is due again after the lease
+        OutboundEmail.objects.filter(id=self.message.id).update(
+            next_attempt_at=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertEqual(send_queued_emails(), (1, 0))
+
+
+# ============================================
+# 2FA challenge tokens
+# ============================================
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ChallengeTokenTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user()
+        self.client = APIClient()
+
+    def login(self, **data):
+        return self.client.post('/api/accounts/login/', data, format='json')
+
+    def test_password_step_returns_challenge_for_second_step(self):
+        response = self.login(username='dentist', password=PASSWORD)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['requires_2fa'])
+
+        response = self.login(
+            challenge_token=response.data['challenge_token'],
+            two_fa_token=pyotp.TOTP(self.user.two_fa_secret).now()
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.data)
+
+    def test_expired_challenge_is_rejected(self):
+        token = issue_challenge(self.user)
+        later = time.time() + 301
+        with override_settings(TWO_FA_CHALLENGE_MAX_AGE=300), \
+                mock.patch('django.core.signing.time.time', return_value=later):
+            self.assertIsNone(resolve_challenge(token))
+            response = self.login(
+                challenge_token=token,
+                two_fa_token=pyotp.TOTP(self.user.two_fa_secret).now()
+            )
+        self.assertEqual(response.status_code, 401)
+
+    def test_tampered_challenge_is_rejected(self):
+        token = issue_challenge(self.user)
+        self.assertIsNone(resolve_challenge(token[:-2] + ('A' if token[-2] != 'A' else 'B') + token[-1]))
+        self.assertIsNone(resolve_challenge('not-a-token'))
+
+    def test_challenge_cannot_be_replayed_after_password_change(self):
+        token = issue_challenge(self.user)
+        self.assertEqual(resolve_challenge(token), self.user)
+
+        self.user.set_password('An0ther!Passw0rd')
+        self.user.save()
+        self.assertIsNone(resolve_challenge(token))
+        response = self.login(
+            challenge_token=token,
+            two_fa_token=pyotp.TOTP(self.user.two_fa_secret).now()
+        )
+        self.assertEqual(response.status_code, 401)
+
+    def test_challenge_is_revoked_when_user_is_deactivated(self):
+        token = issue_challenge(self.user)
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(resolve_challenge(token))
+
+
+# ============================================
+# 2FA backup codes
+# ============================================
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class BackupCodeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user()
+        self.codes = self.user.generate_backup_codes()
+
+    def test_only_digests_are_stored(self):
+        self.assertEqual(len(self.codes), backup_codes.CODE_COUNT)
+        self.user.refresh_from_db()
+        self.assertEqual(len(self.user.backup_codes), backup_codes.CODE_COUNT)
+        stored = ' '.join(self.user.backup_codes)
+        for code in self.codes:
+            self.assertNotIn(code, stored)
+            self.assertNotIn(backup_codes.normalize(code), stored)
+            self.assertIn(backup_codes.digest(self.user.id, code), self.user.backup_codes)
+
+    def test_code_is_single_use(self):
+        code = self.codes[0]
+        self.assertTrue(self.user.verify_backup_code(code))
+        self.assertFalse(self.user.verify_backup_code(code))
+
+        # Also gone for a fresh copy of the row, e.g. in another worker
+        self.assertFalse(User.objects.get(id=self.user.id).verify_backup_code(code))
+        self.assertEqual(len(User.objects.get(id=self.user.id).backup_codes), backup_codes.CODE_COUNT - 1)
+
+    def test_stale_copy_cannot_reuse_consumed_code(self):
+        code = self.codes[0]
+        stale = User.objects.get(id=self.user.id)
+        self.assertTrue(self.user.verify_backup_code(code))
+        self.assertFalse(stale.verify_backup_code(code))
+
+    def test_code_is_normalized(self):
+        code = self.codes[0]
+        self.assertTrue(self.user.verify_backup_code(f" {code.lower().replace('-', ' ')} "))
+
+    def test_digest_is_bound_to_user(self):
+        other = make_user('hygienist')
+        other.backup_codes = list(self.user.backup_codes)
+        other.save()
+        self.assertFalse(other.verify_backup_code(self.codes[0]))
+
+    def test_login_with_backup_code_once(self):
+        client = APIClient()
+        token = issue_challenge(self.user)
+        response = client.post('/api/accounts/login/', {
+            'challenge_token': token, 'two_fa_token': self.codes[1]
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.data)
+
+        response = client.post('/api/accounts/login/', {
+            'challenge_token': token, 'two_fa_token': self.codes[1]
+        }, format='json')
+        self.assertEqual(response.status_code, 401)
+
+
+# ============================================
+# Cached JWT authentication
+# ============================================
+
+@override_settings(CACHES=LOCMEM_CACHE, AUTH_USER_CACHE_ENABLED=True, AUTH_USER_CACHE_TTL=60)
+class AuthUserCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        # Fresh per-process LRU so entries from other tests don't leak in
+        authentication._users = None
+        self.user = make_user()
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}"
+        )
+
+    def profile(self):
+        return self.client.get('/api/accounts/profile/')
+
+    def test_user_is_served_from_cache(self):
+        self.assertEqual(self.profile().status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.profile().status_code, 200)
+
+    def test_two_fa_change_invalidates_cached_user(self):
+        self.assertTrue(self.profile().data['two_fa_enabled'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.two_fa_enabled = False
+            self.user.save()
+        self.assertFalse(self.profile().data['two_fa_enabled'])
+
+    def test_password_change_invalidates_cached_user(self):
+        self.assertEqual(self.profile().status_code, 200)
+
+        new_password = 'An0ther!Passw0rd'
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/accounts/change-password/', {
+                'old_password': PASSWORD, 'new_password': new_password
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        # A stale cached user would still carry the old hash
+        response = self.client.post('/api/accounts/change-password/', {
+            'old_password': new_password, 'new_password': 'Th1rd!Passw0rd'
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_deactivation_is_seen_on_next_request(self):
+        self.assertEqual(self.profile().status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.profile().status_code, 401)
+
+    def test_queryset_update_is_seen_after_ttl(self):
+        self.assertTrue(self.profile().data['two_fa_enabled'])
+
+        # update() bypasses post_save, so only the TTL bounds staleness
+        User.objects.filter(id=self.user.id).update(two_fa_enabled=False)
+        self.assertTrue(self.profile().data['two_fa_enabled'])
+
+        later = time.monotonic() + 61
+        with mock.patch('accounts.authentication.time.monotonic', return_value=later):
+            self.assertFalse(self.profile().data['two_fa_enabled'])
+
+
+# ============================================
+# Login brute-force throttling
+# ============================================
+
+@override_settings(
+    CACHES=LOCMEM_CACHE,
+    AUTH_THROTTLE_ENABLED=True,
+    AUTH_THROTTLE_WINDOW=300,
+    AUTH_THROTTLE_ACCOUNT_LIMIT=5,
+    AUTH_THROTTLE_IP_LIMIT=20,
+    AUTH_LOCKOUT_BASE=60,
+)
+class LoginThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user()
+        self.client = APIClient()
+        patcher = mock.patch.object(throttling.logger, 'warning')
+        self.lockout_log = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def login(self, **data):
+        return self.client.post('/api/accounts/login/', data, format='json')
+
+    def wrong_password(self, username='dentist'):
+        response = self.login(username=username, password='wrong')
+        self.assertEqual(response.status_code, 401)
+
+    def test_account_locked_after_limit(self):
+        for _ in range(5):
+            self.wrong_password()
+
+        # Rejected before the password is checked, even when it is right
+        response = self.login(username='dentist', password=PASSWORD)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertLessEqual(int(response['Retry-After']), 60)
+        self.lockout_log.assert_called_once()
+
+    def test_password_and_challenge_steps_share_one_counter(self):
+        for _ in range(3):
+            self.wrong_password()
+        token = self.login(username='dentist', password=PASSWORD).data['challenge_token']
+        for _ in range(2):
+            response = self.login(challenge_token=token, two_fa_token='bad-code')
+            self.assertEqual(response.status_code, 401)
+
+        self.assertEqual(self.login(username='dentist', password=PASSWORD).status_code, 429)
+        response = self.login(
+            challenge_token=token,
+            two_fa_token=pyotp.TOTP(self.user.two_fa_secret).now()
+        )
+        self.assertEqual(response.status_code, 429)
+
+    def test_lockout_does_not_affect_other_accounts(self):
+        make_user('hygienist')
+        for _ in range(5):
+            self.wrong_password()
+        response = self.login(username='hygienist', password=PASSWORD)
+        self.assertEqual(response.status_code, 200)
+
+    def test_successful_login_resets_account_counter(self):
+        for _ in range(4):
+            self.wrong_password()
+        token = self.login(username='dentist', password=PASSWORD).data['challenge_token']
+        response = self.login(
+            challenge_token=token,
+            two_fa_token=pyotp.TOTP(self.user.two_fa_secret).now()
+        )
+        self.assertEqual(response.status_code, 200)
+
+        for _ in range(4):
+            self.wrong_password()
+        self.assertEqual(self.login(username='dentist', password=PASSWORD).status_code, 200)
+
+    @override_settings(AUTH_THROTTLE_IP_LIMIT=3, AUTH_THROTTLE_ACCOUNT_LIMIT=100)
+    def test_forged_forwarded_for_does_not_escape_ip_lockout(self):
+        for i in range(3):
+            response = self.client.post('/api/accounts/login/', {
+                'username': f"guess{i}", 'password': 'wrong'
+            }, format='json', HTTP_X_FORWARDED_FOR=f"203.0.113.{i}")
+            self.assertEqual(response.status_code, 401)
+
+        response = self.client.post('/api/accounts/login/', {
+            'username': 'dentist', 'password': PASSWORD
+        }, format='json', HTTP_X_FORWARDED_FOR='198.51.100.7')
+        self.assertEqual(response.status_code, 429)
+
+    def test_unknown_username_is_throttled(self):
+        for _ in range(5):
+            self.wrong_password('nobody')
+        self.assertEqual(self.login(username='nobody', password='wrong').status_code, 429)
+
+
+@override_settings(
+    AUTH_THROTTLE_ENABLED=True,
+    AUTH_THROTTLE_WINDOW=300,
+    AUTH_THROTTLE_ACCOUNT_LIMIT=5,
+    AUTH_THROTTLE_IP_LIMIT=20,
+    AUTH_LOCKOUT_BASE=60,
+    AUTH_LOCKOUT_MAX=3600,
+)
+class LockoutEscalationTests(TestCase):
+    """Strikes must outlive the cache's default TIMEOUT on backends whose incr() is get + set"""
+
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        file_cache = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': location,
+            'TIMEOUT': 300,
+        }})
+        file_cache.enable()
+        self.addCleanup(file_cache.disable)
+        patcher = mock.patch.object(throttling.logger, 'warning')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        make_user()
+        self.client = APIClient()
+        self.now = time.time()
+
+    def fail_until_locked(self):
+        with mock.patch('accounts.throttling.time.time', return_value=self.now):
+            for _ in range(5):
+                self.client.post('/api/accounts/login/', {'username': 'dentist', 'password': 'wrong'}, format='json')
+            return self.client.post('/api/accounts/login/', {'username': 'dentist', 'password': PASSWORD}, format='json')
+
+    def test_repeat_lockout_escalates_after_default_timeout(self):
+        response = self.fail_until_locked()
+        self.assertEqual(response.status_code, 429)
+        self.assertLessEqual(int(response['Retry-After']), 60)
+
+        # Past the first lockout and the cache's 300s default TIMEOUT
+        self.now += 301
+        response = self.fail_until_locked()
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 60)
+        self.assertLessEqual(int(response['Retry-After']), 120)
+
+    def test_metrics_outlive_default_timeout(self):
+        self.fail_until_locked()
+        self.now += 301
+        with mock.patch('accounts.throttling.time.time', return_value=self.now):
+            metrics = throttling.throttle_metrics()['login']
+        self.assertEqual(metrics['attempts'], 6)
+        self.assertEqual(metrics['lockouts'], 1)
@@ -0,0 +1,183 @@
+"""
+Brute-force protection for the unauthenticated login, 2FA and email
+verification endpoints.
+
+Failed attempts are counted per client IP and per account in sliding
+windows kept in the cache, so every worker shares them. Crossing a limit
+locks that IP or account out for AUTH_LOCKOUT_BASE seconds, doubling with
+each repeated lockout up to AUTH_LOCKOUT_MAX. Locked-out requests are
+rejected with 429 before the view runs, i.e. before any password hashing.
+
+Counters of attempts, failures, rejections and lockouts per endpoint are
+kept in the cache too and served by the throttle_metrics view.
+"""
+import hashlib
+import logging
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import BaseThrottle
+
+from .models import User
+from .tokens import challenge_user_id
+
+logger = logging.getLogger('tunzadent.auth_throttle')
+
+KEY_PREFIX = 'accounts:throttle'
+METRIC_EVENTS = ('attempts', 'failures', 'rejected', 'lockouts')
+# Consecutive lockouts are remembered this long for the exponential backoff
+STRIKE_MEMORY = 24 * 3600
+_scopes = set()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _incr(key, timeout):
+    # add() is a no-op if the key exists, so concurrent first hits don't reset it
+    cache.add(key, 0, timeout=timeout)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr()
+        cache.set(key, 1, timeout=timeout)
+        return 1
+    # File and DB caches implement incr() as get + set, which rewrites the
+    # key with the default TIMEOUT; put the intended expiry back
+    cache.touch(key, timeout=timeout)
+    return count
+
+
+def _window_count(key, window, now):
+    """Failures in the last `window` seconds, weighting the previous bucket."""
+    bucket = int(now // window)
+    current_key, previous_key = f"{key}:{bucket}", f"{key}:{bucket - 1}"
+    counts = cache.get_many([current_key, previous_key])
+    overlap = 1 - (now % window) / window
+    return counts.get(current_key, 0) + counts.get(previous_key, 0) * overlap
+
+
+def _identities(request):
+    """
+    (kind, identifier) pairs the request is throttled under. The password
+    step (username) and the challenge-token step both count against the
+    user id, so an account has one counter and one lockout across steps.
+    """
+    identities = [('ip', BaseThrottle().get_ident(request))]
+    data = request.data if hasattr(request.data, 'get') else {}
+    account = None
+    username = data.get('username')
+    if data.get('challenge_token'):
+        user_id = challenge_user_id(data.get('challenge_token'))
+        account = f"#{user_id}" if user_id is not None else None
+    elif username:
+        user_id = User.objects.filter(username=str(username)).values_list('id', flat=True).first()
+        # Unknown usernames are still throttled, under the name itself
+        account = f"#{user_id}" if user_id is not None else username
+    if account:
+        # Hash so arbitrary user input is a safe cache key
+        digest = hashlib.sha256(str(account).strip().lower().encode()).hexdigest()[:32]
+        identities.append(('account', digest))
+    return identities
+
+
+def _limit(kind):
+    if kind == 'ip':
+        return _setting('AUTH_THROTTLE_IP_LIMIT', 20)
+    return _setting('AUTH_THROTTLE_ACCOUNT_LIMIT', 5)
+
+
+def _record_metric(scope, event):
+    _incr(f"{KEY_PREFIX}:metric:{scope}:{event}", timeout=None)
+
+
+def _lockout_remaining(identities, now):
+    locks = cache.get_many([f"{KEY_PREFIX}:lock:{kind}:{ident}" for kind, ident in identities])
+    until = max(locks.values(), default=0)
+    return until - now if until > now else 0
+
+
+def _record_failure(scope, identities, now):
+    window = _setting('AUTH_THROTTLE_WINDOW', 300)
+    for kind, ident in identities:
+        key = f"{KEY_PREFIX}:fail:{kind}:{ident}"
+        _incr(f"{key}:{int(now // window)}", timeout=window * 2)
+        if _window_count(key, window, now) < _limit(kind):
+            continue
+
+        strikes = _incr(f"{KEY_PREFIX}:strikes:{kind}:{ident}", timeout=STRIKE_MEMORY)
+        duration = min(
+            _setting('AUTH_LOCKOUT_BASE', 60) * 2 ** (strikes - 1),
+            _setting('AUTH_LOCKOUT_MAX', 3600)
+        )
+        cache.set(f"{KEY_PREFIX}:lock:{kind}:{ident}", now + duration, timeout=math.ceil(duration))
+        # Start the next window clean so the lockout isn't re-triggered immediately
+        cache.delete_many([f"{key}:{int(now // window)}", f"{key}:{int(now // window) - 1}"])
+        _record_metric(scope, 'lockouts')
+        logger.warning(f"Auth lockout on {scope}: {kind} {ident} for {duration}s (strike {strikes})")
+
+
+def _clear_account(identities):
+    window = _setting('AUTH_THROTTLE_WINDOW', 300)
+    bucket = int(time.time() // window)
+    keys = []
+    for kind, ident in identities:
+        if kind == 'account':
+            key = f"{KEY_PREFIX}:fail:{kind}:{ident}"
+            keys += [f"{key}:{bucket}", f"{key}:{bucket - 1}",
+                     f"{KEY_PREFIX}:strikes:{kind}:{ident}"]
+    if keys:
+        cache.delete_many(keys)
+
+
+def auth_throttle(scope):
+    """
+    Guard an AllowAny DRF function view against credential guessing.
+    400/401 responses count as failed attempts; a response carrying an
+    access token counts as a successful login and resets the account's
+    counters.
+    """
+    _scopes.add(scope)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not _setting('AUTH_THROTTLE_ENABLED', True):
+                return view(request, *args, **kwargs)
+
+            now = time.time()
+            identities = _identities(request)
+            _record_metric(scope, 'attempts')
+            remaining = _lockout_remaining(identities, now)
+            if remaining:
+                _record_metric(scope, 'rejected')
+                raise Throttled(wait=math.ceil(remaining),
+                                detail='Too many failed attempts. Please try again later.')
+
+            response = view(request, *args, **kwargs)
+            if response.status_code in (400, 401):
+                _record_metric(scope, 'failures')
+                _record_failure(scope, identities, now)
+            elif response.status_code == 200 and 'access' in getattr(response, 'data', {}):
+                _clear_account(identities)
+            return response
+        return wrapper
+    return decorator
+
+
+def throttle_metrics():
+    """Counters per throttled endpoint, e.g. {'login': {'attempts': 10, ...}}"""
+    keys = {
+        f"{KEY_PREFIX}:metric:{scope}:{event}": (scope, event)
+        for scope in sorted(_scopes) for event in METRIC_EVENTS
+    }
+    values = cache.get_many(list(keys))
+    metrics = {scope: dict.fromkeys(METRIC_EVENTS, 0) for scope in sorted(_scopes)}
+    for key, (scope, event) in keys.items():
+        metrics[scope][event] = values.get(key, 0)
+    return metrics
@@ -0,0 +1,52 @@
+"""
+Short-lived signed challenge tokens for the multi-step 2FA login.
+
+After the password is checked once, the client gets a challenge token and
+presents it to the later 2FA steps instead of the password, so each retry
+costs an HMAC check rather than a full PBKDF2 hash. The token embeds a
+fingerprint of the password hash, so changing the password revokes it.
+"""
+from django.conf import settings
+from django.core import signing
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .models import User
+
+CHALLENGE_SALT = 'accounts.two-factor-challenge'
+
+
+def _password_fingerprint(user):
+    return salted_hmac(CHALLENGE_SALT, user.password).hexdigest()[:16]
+
+
+def issue_challenge(user):
+    """Return a signed token proving `user` just passed the password check"""
+    return signing.dumps(
+        {'uid': user.id, 'pwd': _password_fingerprint(user)},
+        salt=CHALLENGE_SALT
+    )
+
+
+def resolve_challenge(token):
+    """Return the user a valid, unexpired challenge token was issued to, else None"""
+    try:
+        data = signing.loads(
+            token,
+            salt=CHALLENGE_SALT,
+            max_age=getattr(settings, 'TWO_FA_CHALLENGE_MAX_AGE', 300)
+        )
+    except signing.BadSignature:
+        return None
+
+    user = User.objects.filter(id=data.get('uid'), is_active=True).first()
+    if user is None or not constant_time_compare(data.get('pwd', ''), _password_fingerprint(user)):
+        return None
+    return user
+
+
+def challenge_user_id(token):
+    """User id a challenge token claims, if its signature is valid (no DB access)"""
+    try:
+        return signing.loads(token, salt=CHALLENGE_SALT).get('uid')
+    except (signing.BadSignature, AttributeError):
+        return None
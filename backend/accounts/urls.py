@@ -21,4 +21,7 @@ urlpatterns = [
     # Profile and Security Management
     path('profile/update/', views.update_profile, name='update_profile'),
     path('change-password/', views.change_password, name='change_password'),
+    
+    # Monitoring
+    path('throttle-metrics/', views.auth_throttle_metrics, name='auth_throttle_metrics'),
 ]
\ No newline at end of file
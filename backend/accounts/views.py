@@ -1,19 +1,18 @@
 from rest_framework import generics, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
-from django.contrib.auth.hashers import make_password
-from django.core.mail import send_mail 
 from .models import User
 from .serializers import UserRegistrationSerializer, UserSerializer
+from .tokens import issue_challenge, resolve_challenge
+from .emails import queue_verification_email
+from .throttling import auth_throttle, throttle_metrics
 import qrcode
 import io
 import base64
 import pyotp
-import random
-import string
 
 
 class RegisterView(generics.CreateAPIView):
@@ -34,6 +33,7 @@ class RegisterView(generics.CreateAPIView):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@auth_throttle('verify_email')
 def verify_email(request):
     """Verify email with token"""
     token = request.data.get('token')
@@ -71,16 +71,37 @@ def verify_email(request):
         )
 
 
+def _authenticate_step(request, check_user_id=False):
+    """
+    Resolve the user for a login/2FA step: a challenge_token from an earlier
+    step if given (cheap signature check), otherwise username + password.
+    """
+    challenge_token = request.data.get('challenge_token')
+    if challenge_token:
+        return resolve_challenge(challenge_token)
+
+    user = authenticate(
+        username=request.data.get('username'),
+        password=request.data.get('password')
+    )
+    if user and check_user_id and str(user.id) != str(request.data.get('user_id')):
+        return None
+    return user
+
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@auth_throttle('login')
 def login_view(request):
-    """Login with username, password, and 2FA token"""
-    username = request.data.get('username')
-    password = request.data.get('password')
+    """
+    Login with username, password, and 2FA token.
+    The 2FA step may send the challenge_token from the first response
+    instead of the password.
+    """
     two_fa_token = request.data.get('two_fa_token')
     
     # Authenticate user
-    user = authenticate(username=username, password=password)
+    user = _authenticate_step(request)
     
     if not user:
         return Response(
@@ -102,14 +123,16 @@ def login_view(request):
             'requires_2fa_setup': True,
             'message': 'Please set up 2FA to continue',
             'user_id': user.id,
-            'username': username
+            'username': user.username,
+            'challenge_token': issue_challenge(user)
         }, status=status.HTTP_200_OK)
     
     # Require 2FA token
     if not two_fa_token:
         return Response({
             'requires_2fa': True,
-            'message': 'Please provide your 2FA code'
+            'message': 'Please provide your 2FA code',
+            'challenge_token': issue_challenge(user)
         }, status=status.HTTP_200_OK)
     
     # Verify 2FA token
@@ -133,16 +156,13 @@ def login_view(request):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@auth_throttle('2fa_setup')
 def setup_2fa_initial(request):
     """Initial 2FA setup for new users (after email verification)"""
-    username = request.data.get('username')
-    password = request.data.get('password')
-    user_id = request.data.get('user_id')
-    
-    # Verify credentials
-    user = authenticate(username=username, password=password)
+    # Verify credentials (challenge_token, or username/password/user_id)
+    user = _authenticate_step(request, check_user_id=True)
     
-    if not user or user.id != int(user_id):
+    if not user:
         return Response(
             {'error': 'Invalid credentials'},
             status=status.HTTP_401_UNAUTHORIZED
@@ -184,17 +204,15 @@ def setup_2fa_initial(request):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@auth_throttle('2fa_complete')
 def complete_2fa_setup(request):
     """Complete 2FA setup and enable it"""
-    username = request.data.get('username')
-    password = request.data.get('password')
-    user_id = request.data.get('user_id')
     token = request.data.get('token')
     
-    # Verify credentials
-    user = authenticate(username=username, password=password)
+    # Verify credentials (challenge_token, or username/password/user_id)
+    user = _authenticate_step(request, check_user_id=True)
     
-    if not user or user.id != int(user_id):
+    if not user:
         return Response(
             {'error': 'Invalid credentials'},
             status=status.HTTP_401_UNAUTHORIZED
@@ -346,16 +364,8 @@ def regenerate_backup_codes(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    # Generate new backup codes (10 codes, 8 characters each)
-    backup_codes = []
-    for _ in range(10):
-        code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-        backup_codes.append(code)
-    
-    # Hash and store backup codes
-    hashed_codes = [make_password(code) for code in backup_codes]
-    user.backup_codes = hashed_codes
-    user.save()
+    # Generate new backup codes; only their HMAC digests are stored
+    backup_codes = user.generate_backup_codes()
     
     return Response({
         'backup_codes': backup_codes,
@@ -377,18 +387,9 @@ def resend_verification_email(request):
                 'message': 'Email already verified'
             })
         
-        # Generate new token and send email
+        # Generate new token and queue the email for the outbox worker
         token = user.generate_email_verification_token()
-        
-        verification_link = f"http://localhost:3000/verify-email/{token}"
-        
-        send_mail(
-            subject='Verify your Tunzadent account',
-            message=f'Click here to verify: {verification_link}',
-            from_email='noreply@tunzadent.com',
-            recipient_list=[user.email],
-            fail_silently=False,
-        )
+        queue_verification_email(user, token)
         
         return Response({
             'message': 'Verification email sent'
@@ -398,4 +399,11 @@ def resend_verification_email(request):
         return Response(
             {'error': 'Email not found'},
             status=status.HTTP_404_NOT_FOUND
-        )
\ No newline at end of file
+        )
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def auth_throttle_metrics(request):
+    """Brute-force throttle counters per endpoint (staff only)"""
+    return Response(throttle_metrics())
@@ -0,0 +1,324 @@
+"""
+Micro-benchmarks for the caries inference pipeline.
+
+Measures each stage CariesDetector.predict goes through - decode, transform,
+forward and heatmap - across batch sizes, source image sizes, thread counts
+and execution backends, and writes the results as JSON so runs from two
+commits can be diffed.
+
+Usage (from backend/):
+    python -m benchmarks.bench_inference --out bench.json
+    python -m benchmarks.bench_inference --batch-sizes 1,8 --threads 1,4 \\
+        --backends eager,inference_mode,jit --out after.json
+    python -m benchmarks.bench_inference --compare before.json after.json
+
+No Django settings or real weights are required: a synthetic checkpoint is
+generated unless --checkpoint is given.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from pathlib import Path
+
+import torch
+from PIL import Image
+
+from predictions.ml_inference import (
+    CariesClassifier,
+    build_transform,
+    generate_attention_heatmap,
+)
+from .synthetic import DEFAULT_CONFIG, make_checkpoint, make_radiograph
+
+BACKENDS = ('eager', 'inference_mode', 'jit')
+
+
+# ============================================
+# Timing helpers
+# ============================================
+
+def measure(fn, repeat=20, warmup=3):
+    """Run `fn` warmup + repeat times and return the timed samples in ms."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def summarize(samples, items=1):
+    ordered = sorted(samples)
+    mean = statistics.fmean(ordered)
+    return {
+        'mean_ms': round(mean, 3),
+        'p50_ms': round(ordered[len(ordered) // 2], 3),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        'min_ms': round(ordered[0], 3),
+        'stdev_ms': round(statistics.pstdev(ordered), 3),
+        'throughput_per_s': round(items * 1000 / mean, 2) if mean else None,
+        'samples': len(ordered),
+    }
+
+
+def grad_context(backend):
+    if backend == 'inference_mode':
+        return torch.inference_mode()
+    return torch.no_grad()
+
+
+def build_runner(model, backend, example):
+    """Return a callable running a plain forward on the chosen backend."""
+    if backend == 'jit':
+        with torch.no_grad():
+            traced = torch.jit.freeze(torch.jit.trace(model, example))
+
+        def run(x):
+            with torch.no_grad():
+                return traced(x)
+        return run
+
+    def run(x):
+        with grad_context(backend):
+            return model(x)
+    return run
+
+
+# ============================================
+# Stages
+# ============================================
+
+def bench_decode(image_sizes, args):
+    results = []
+    for width, height in image_sizes:
+        encoded = make_radiograph(width, height, seed=width * height)
+        samples = measure(
+            lambda: Image.open(io.BytesIO(encoded)).convert('RGB'),
+            args.repeat, args.warmup
+        )
+        results.append({
+            'stage': 'decode',
+            'image_size': f'{width}x{height}',
+            'bytes': len(encoded),
+            **summarize(samples),
+        })
+    return results
+
+
+def bench_transform(image_sizes, img_size, args):
+    transform = build_transform(img_size)
+    results = []
+    for width, height in image_sizes:
+        image = Image.open(io.BytesIO(make_radiograph(width, height))).convert('RGB')
+        samples = measure(lambda: transform(image), args.repeat, args.warmup)
+        results.append({
+            'stage': 'transform',
+            'image_size': f'{width}x{height}',
+            **summarize(samples),
+        })
+    return results
+
+
+def bench_forward(model, img_size, args):
+    results = []
+    for threads in args.threads:
+        torch.set_num_threads(threads)
+        for backend in args.backends:
+            for batch_size in args.batch_sizes:
+                x = torch.randn(batch_size, 3, img_size, img_size)
+                try:
+                    run = build_runner(model, backend, x)
+                except Exception as e:
+                    print(f"Skipping backend {backend}: {e}")
+                    break
+                samples = measure(lambda: run(x), args.repeat, args.warmup)
+                results.append({
+                    'stage': 'forward',
+                    'backend': backend,
+                    'threads': threads,
+                    'batch_size': batch_size,
+                    **summarize(samples, items=batch_size),
+                })
+    return results
+
+
+def bench_heatmap(model, img_size, args):
+    # generate_attention_heatmap only reads the first item, so batch size 1
+    results = []
+    device = torch.device('cpu')
+    x = torch.randn(1, 3, img_size, img_size)
+    for threads in args.threads:
+        torch.set_num_threads(threads)
+        for backend in args.backends:
+            if backend == 'jit':
+                continue
+            with grad_context(backend):
+                samples = measure(
+                    lambda: generate_attention_heatmap(model, x, device),
+                    args.repeat, args.warmup
+                )
+            results.append({
+                'stage': 'heatmap',
+                'backend': backend,
+                'threads': threads,
+                'batch_size': 1,
+                **summarize(samples),
+            })
+    return results
+
+
+# ============================================
+# Reporting
+# ============================================
+
+def result_key(row):
+    parts = [row['stage']]
+    for field in ('backend', 'threads', 'batch_size', 'image_size'):
+        if field in row:
+            parts.append(f"{field}={row[field]}")
+    return ' '.join(parts)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def compare(before_path, after_path):
+    """Print per-key mean latency change between two result files."""
+    before = {r['key']: r for r in json.loads(Path(before_path).read_text())['results']}
+    after = {r['key']: r for r in json.loads(Path(after_path).read_text())['results']}
+    print(f"{'benchmark':<60} {'before':>10} {'after':>10} {'change':>8}")
+    for key in sorted(before.keys() | after.keys()):
+        old = before.get(key, {}).get('mean_ms')
+        new = after.get(key, {}).get('mean_ms')
+        if old is None or new is None:
+            change = 'n/a'
+        else:
+            change = f"{(new - old) / old * 100:+.1f}%"
+        print(f"{key:<60} {str(old):>10} {str(new):>10} {change:>8}")
+
+
+def parse_sizes(value):
+    sizes = []
+    for item in value.split(','):
+        width, height = item.lower().split('x')
+        sizes.append((int(width), int(height)))
+    return sizes
+
+
+def parse_ints(value):
+    return [int(v) for v in value.split(',') if v]
+
+
+def parse_config(values):
+    config = {}
+    for item in values or []:
+        key, raw = item.split('=', 1)
+        if key not in DEFAULT_CONFIG:
+            raise SystemExit(f"Unknown config key: {key}")
+        config[key] = type(DEFAULT_CONFIG[key])(raw)
+    return config
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--out', help='Write JSON results to this file')
+    parser.add_argument('--checkpoint', help='Use an existing checkpoint instead of a synthetic one')
+    parser.add_argument('--config', action='append', metavar='KEY=VALUE',
+                        help='Override synthetic model config (e.g. depth=6)')
+    parser.add_argument('--batch-sizes', type=parse_ints, default=[1, 4, 8])
+    parser.add_argument('--image-sizes', type=parse_sizes,
+                        default=parse_sizes('512x256,1024x512,2048x1024'))
+    parser.add_argument('--threads', type=parse_ints,
+                        default=sorted({1, torch.get_num_threads()}))
+    parser.add_argument('--backends', type=lambda v: v.split(','),
+                        default=['eager', 'inference_mode'])
+    parser.add_argument('--stages', type=lambda v: v.split(','),
+                        default=['decode', 'transform', 'forward', 'heatmap'])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='Compare two result files and exit')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    unknown = set(args.backends) - set(BACKENDS)
+    if unknown:
+        raise SystemExit(f"Unknown backend(s): {', '.join(sorted(unknown))}")
+
+    default_threads = torch.get_num_threads()
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.checkpoint:
+            checkpoint_path = Path(args.checkpoint)
+        else:
+            checkpoint_path = make_checkpoint(Path(tmp) / 'synthetic.pth', parse_config(args.config))
+        model = CariesClassifier(str(checkpoint_path))
+        config = {**DEFAULT_CONFIG, **torch.load(checkpoint_path, map_location='cpu',
+                                                 weights_only=False).get('config', {})}
+
+    img_size = config['img_size']
+    results = []
+    try:
+        if 'decode' in args.stages:
+            results += bench_decode(args.image_sizes, args)
+        if 'transform' in args.stages:
+            results += bench_transform(args.image_sizes, img_size, args)
+        if 'forward' in args.stages:
+            results += bench_forward(model, img_size, args)
+        if 'heatmap' in args.stages:
+            results += bench_heatmap(model, img_size, args)
+    finally:
+        torch.set_num_threads(default_threads)
+
+    for row in results:
+        row['key'] = result_key(row)
+        print(f"{row['key']:<60} mean={row['mean_ms']:>9.3f}ms "
+              f"p95={row['p95_ms']:>9.3f}ms {row['throughput_per_s']:>9} /s")
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'git_revision': git_revision(),
+            'python': sys.version.split()[0],
+            'torch': torch.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'synthetic_checkpoint': not args.checkpoint,
+            'model_config': config,
+            'repeat': args.repeat,
+            'warmup': args.warmup,
+        },
+        'results': results,
+    }
+
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+        print(f"Results written to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
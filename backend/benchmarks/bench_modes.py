@@ -0,0 +1,258 @@
+"""
+Speed/accuracy trade-offs of the fast inference modes.
+
+Runs every image of an evaluation set through the full 224px, 12-block
+forward pass and through each fast mode, and reports per-mode latency,
+speed-up, agreement with the full pass and, when labels are known,
+accuracy. Cascade modes also report how often they escalated to the full
+pass, and tiled modes how many tiles each film took.
+
+Usage (from backend/):
+    python -m benchmarks.bench_modes --checkpoint ml_models/best_caries_classifier_v2.pth \\
+        --images /data/bitewings --out modes.json
+    python -m benchmarks.bench_modes --modes full,cascade:112,cascade:160,lowres:112
+    python -m benchmarks.bench_modes --modes full,tome:4,tome:8,tome:12,tome:16
+    python -m benchmarks.bench_modes --modes full,bf16
+    python -m benchmarks.bench_modes --modes full,tiles:448,tiles:672,tiles:448:mean
+
+--images takes a directory of radiographs; images under a `caries/` or
+`healthy/` subdirectory are labelled for accuracy. Without --images a
+synthetic set is generated, which is only useful for latency: agreement
+on random weights means nothing.
+"""
+import argparse
+import io
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import torch
+from PIL import Image
+
+from predictions import token_merging
+from predictions.ml_inference import (
+    TILE_MIN_SCALE,
+    TILE_SIZE,
+    CariesClassifier,
+    aggregate_tile_logits,
+    build_transform,
+    cascade_accepts,
+    cut_tiles,
+    tile_layout,
+)
+from .bench_inference import summarize
+from .synthetic import make_checkpoint, make_radiograph
+
+IMAGE_SUFFIXES = {'.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff'}
+LABELS = {'caries': 1, 'healthy': 0, 'no_caries': 0}
+
+
+def load_images(directory, limit=None):
+    """[(name, PIL image, label or None)] from a directory tree."""
+    items = []
+    for path in sorted(Path(directory).rglob('*')):
+        if path.suffix.lower() not in IMAGE_SUFFIXES:
+            continue
+        label = next((LABELS[p.name] for p in path.parents if p.name in LABELS), None)
+        items.append((str(path), Image.open(path).convert('RGB'), label))
+        if limit and len(items) >= limit:
+            break
+    return items
+
+
+def synthetic_images(count):
+    return [
+        (f'synthetic-{i}', Image.open(io.BytesIO(make_radiograph(1024, 512, seed=i))).convert('RGB'), None)
+        for i in range(count)
+    ]
+
+
+# ============================================
+# Modes
+# ============================================
+# Each mode maps a PIL image to (probabilities tensor [2], extra info dict)
+
+def full_mode(model):
+    transform = build_transform()
+
+    def run(image):
+        with torch.inference_mode():
+            return torch.softmax(model(transform(image).unsqueeze(0)), dim=1)[0], {}
+    return run
+
+
+def bf16_mode(model):
+    transform = build_transform()
+
+    def run(image):
+        with torch.inference_mode(), torch.autocast('cpu', dtype=torch.bfloat16):
+            logits = model(transform(image).unsqueeze(0))
+        return torch.softmax(logits.float(), dim=1)[0], {}
+    return run
+
+
+def tome_mode(model, schedule):
+    transform = build_transform()
+
+    def run(image):
+        with torch.inference_mode():
+            features, _ = model.forward_features(transform(image).unsqueeze(0), merge_schedule=schedule)
+            return torch.softmax(model.head(features), dim=1)[0], {}
+    return run
+
+
+def lowres_mode(model, size, depth=None):
+    transform = build_transform(size)
+
+    def run(image):
+        with torch.inference_mode():
+            features, _ = model.forward_features(transform(image).unsqueeze(0), depth=depth)
+            return torch.softmax(model.head(features), dim=1)[0], {}
+    return run
+
+
+def cascade_mode(model, size, depth, accept_caries, accept_healthy):
+    fast, full = lowres_mode(model, size, depth), full_mode(model)
+
+    def run(image):
+        probs, _ = fast(image)
+        if cascade_accepts(probs[0].item(), probs[1].item(), accept_caries, accept_healthy):
+            return probs, {'escalated': False}
+        return full(image)[0], {'escalated': True}
+    return run
+
+
+def tiles_mode(model, short_side, aggregation, overlap):
+    full = full_mode(model)
+
+    def run(image):
+        if min(image.size) < TILE_MIN_SCALE * TILE_SIZE:
+            return full(image)
+        size, boxes = tile_layout(*image.size, overlap=overlap, short_side=short_side)
+        with torch.inference_mode():
+            logits = model(cut_tiles(image, size, boxes))
+        return aggregate_tile_logits(logits, aggregation), {'tiles': len(boxes)}
+    return run
+
+
+def build_mode(spec, model, args):
+    """
+    'full', 'bf16', 'lowres:SIZE[:DEPTH]', 'cascade:SIZE[:DEPTH]', 'tome:R'
+    or 'tiles:SHORT_SIDE[:max|mean]'
+    """
+    name, *params = spec.split(':')
+    if name == 'tiles':
+        return tiles_mode(model, int(params[0]) if params else 448,
+                          params[1] if len(params) > 1 else 'max', args.tile_overlap)
+    if name == 'tome':
+        schedule = token_merging.parse_schedule(params[0] if params else '8', len(model.encoder))
+        return tome_mode(model, schedule)
+    size = int(params[0]) if params else 112
+    depth = int(params[1]) if len(params) > 1 else None
+    if name == 'full':
+        return full_mode(model)
+    if name == 'bf16':
+        return bf16_mode(model)
+    if name == 'lowres':
+        return lowres_mode(model, size, depth)
+    if name == 'cascade':
+        return cascade_mode(model, size, depth, args.accept_caries, args.accept_healthy)
+    raise SystemExit(f"Unknown mode: {spec}")
+
+
+# ============================================
+# Evaluation
+# ============================================
+
+def evaluate(run, images, reference, warmup=2):
+    for _, image, _ in images[:warmup]:
+        run(image)
+    samples, agree, correct, labelled, escalated, tiles = [], 0, 0, 0, 0, 0
+    for (name, image, label), ref_class in zip(images, reference):
+        start = time.perf_counter()
+        probs, info = run(image)
+        samples.append((time.perf_counter() - start) * 1000)
+        predicted = int(probs.argmax().item())
+        agree += predicted == ref_class
+        if label is not None:
+            labelled += 1
+            correct += predicted == label
+        escalated += bool(info.get('escalated'))
+        tiles += info.get('tiles', 1)
+    stats = summarize(samples)
+    stats['agreement'] = round(agree / len(images), 4)
+    stats['accuracy'] = round(correct / labelled, 4) if labelled else None
+    stats['escalation_rate'] = round(escalated / len(images), 4)
+    stats['tiles_per_image'] = round(tiles / len(images), 2)
+    return stats
+
+
+def print_table(rows):
+    print(f"{'mode':<22} {'mean ms':>9} {'p95 ms':>9} {'speed-up':>9} "
+          f"{'agree':>7} {'accuracy':>9} {'escalated':>10} {'tiles':>6}")
+    for row in rows:
+        accuracy = f"{row['accuracy']:.3f}" if row['accuracy'] is not None else 'n/a'
+        print(f"{row['mode']:<22} {row['mean_ms']:>9.2f} {row['p95_ms']:>9.2f} "
+              f"{row['speedup']:>8.2f}x {row['agreement']:>7.3f} {accuracy:>9} "
+              f"{row['escalation_rate']:>10.1%} {row['tiles_per_image']:>6.1f}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--checkpoint', help='Model checkpoint (default: synthetic)')
+    parser.add_argument('--images', help='Directory of radiographs (default: synthetic set)')
+    parser.add_argument('--limit', type=int, default=None, help='Use at most this many images')
+    parser.add_argument('--synthetic-count', type=int, default=32)
+    parser.add_argument('--modes', type=lambda v: v.split(','),
+                        default=['full', 'lowres:112', 'cascade:112', 'cascade:160'])
+    parser.add_argument('--accept-caries', type=float, default=0.90)
+    parser.add_argument('--accept-healthy', type=float, default=0.85)
+    parser.add_argument('--tile-overlap', type=float, default=0.25)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--out', help='Write JSON results to this file')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    if args.checkpoint:
+        model = CariesClassifier(args.checkpoint)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            model = CariesClassifier(str(make_checkpoint(Path(tmp) / 'synthetic.pth')))
+
+    images = load_images(args.images, args.limit) if args.images else synthetic_images(args.synthetic_count)
+    if not images:
+        raise SystemExit('No images found')
+
+    reference_run = full_mode(model)
+    reference = [int(reference_run(image)[0].argmax().item()) for _, image, _ in images]
+
+    rows = []
+    for spec in args.modes:
+        row = {'mode': spec, **evaluate(build_mode(spec, model, args), images, reference)}
+        rows.append(row)
+    baseline = next((r['mean_ms'] for r in rows if r['mode'] == 'full'), None)
+    for row in rows:
+        row['speedup'] = round(baseline / row['mean_ms'], 2) if baseline else 1.0
+
+    print(f"{len(images)} images, thresholds: caries >= {args.accept_caries}, "
+          f"healthy >= {args.accept_healthy}")
+    print_table(rows)
+    if args.out:
+        Path(args.out).write_text(json.dumps({
+            'images': len(images),
+            'checkpoint': args.checkpoint or 'synthetic',
+            'accept_caries': args.accept_caries,
+            'accept_healthy': args.accept_healthy,
+            'torch_threads': torch.get_num_threads(),
+            'results': rows,
+        }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,382 @@
+"""
+End-to-end HTTP load generator for the prediction endpoints.
+
+Two steps:
+
+1. seed - create verified users with known passwords and TOTP secrets,
+   patients and completed scans, and write them to a fixtures file.
+   Runs against whatever database the settings point at, so use
+   DB_ENGINE=sqlite for a throwaway local stand-in:
+
+       DB_ENGINE=sqlite python manage.py migrate
+       DB_ENGINE=sqlite python -m benchmarks.loadtest seed --users 10 \\
+           --checkpoint /tmp/synthetic.pth --out loadtest.json
+
+2. run - log every seeded user in (password + TOTP step), then drive an
+   open-loop mix of uploads and reads at fixed per-endpoint rates:
+
+       DB_ENGINE=sqlite MODEL_PATH=/tmp/synthetic.pth gunicorn tunzadent.wsgi -w 4
+       python -m benchmarks.loadtest run --fixtures loadtest.json \\
+           --rates upload=2,scan=10,stats=5 --duration 60 --out report.json
+
+Arrivals are scheduled up front (Poisson per endpoint) and latency is
+measured from the scheduled send time, so a saturated server shows up as
+growing latency instead of a silently reduced request rate.
+"""
+import argparse
+import json
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pyotp
+import requests
+
+from .synthetic import make_checkpoint, make_radiograph
+
+ENDPOINTS = ('upload', 'scan', 'patient_scans', 'stats')
+DEFAULT_RATES = 'upload=1,scan=5,patient_scans=0,stats=5'
+
+
+# ============================================
+# Seeding
+# ============================================
+
+def setup_django():
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tunzadent.settings')
+    import django
+    django.setup()
+
+
+def seed(args):
+    setup_django()
+    from django.core.files.base import ContentFile
+    from django.db import transaction
+    from accounts.models import User
+    from predictions.models import Patient, XRayImage, Prediction
+
+    if args.checkpoint:
+        make_checkpoint(args.checkpoint)
+        print(f"Synthetic checkpoint written to {args.checkpoint}")
+
+    rng = random.Random(args.seed)
+    fixtures = {'users': []}
+
+    for i in range(args.users):
+        username = f"{args.prefix}{i}"
+        password = secrets.token_urlsafe(12) + 'Aa1!'
+        with transaction.atomic():
+            user, _ = User.objects.get_or_create(
+                username=username,
+                defaults={'email': f"{username}@loadtest.invalid"}
+            )
+            user.set_password(password)
+            user.email_verified = True
+            user.two_fa_secret = pyotp.random_base32()
+            user.two_fa_enabled = True
+            user.two_fa_setup_complete = True
+            user.save()
+
+            patient_ids = []
+            scan_ids = []
+            for j in range(args.patients):
+                patient, _ = Patient.objects.get_or_create(
+                    patient_id=f"LT-{user.id}-{j}",
+                    defaults={
+                        'created_by': user,
+                        'first_name': 'Load',
+                        'last_name': f"Test{j}",
+                        'date_of_birth': '1990-01-01',
+                        'gender': 'O',
+                    }
+                )
+                patient_ids.append(patient.id)
+
+                for k in range(args.scans):
+                    xray = XRayImage(patient=patient, uploaded_by=user)
+                    xray.image.save(
+                        f"loadtest_{user.id}_{j}_{k}.png",
+                        ContentFile(make_radiograph(args.width, args.height, seed=rng.randrange(1 << 30))),
+                        save=False
+                    )
+                    xray.save()
+                    confidence = rng.uniform(0.5, 1.0)
+                    has_caries = rng.random() < 0.5
+                    Prediction.objects.create(
+                        xray=xray,
+                        status='completed',
+                        has_caries=has_caries,
+                        predicted_class=int(has_caries),
+                        confidence_score=confidence,
+                        confidence_has_caries=confidence if has_caries else 1 - confidence,
+                        confidence_no_caries=1 - confidence if has_caries else confidence,
+                        processing_time_ms=0.0,
+                        model_version='loadtest',
+                    )
+                    scan_ids.append(xray.id)
+
+        fixtures['users'].append({
+            'username': username,
+            'password': password,
+            'totp_secret': user.two_fa_secret,
+            'patient_ids': patient_ids,
+            'scan_ids': scan_ids,
+        })
+        print(f"Seeded {username}: {len(patient_ids)} patients, {len(scan_ids)} scans")
+
+    Path(args.out).write_text(json.dumps(fixtures, indent=2))
+    print(f"Fixtures written to {args.out}")
+
+
+# ============================================
+# Virtual users
+# ============================================
+
+class VirtualUser:
+    """A seeded account holding its own JWT and the scans it can read."""
+
+    def __init__(self, base_url, fixture):
+        self.base_url = base_url.rstrip('/')
+        self.fixture = fixture
+        self.scan_ids = list(fixture['scan_ids'])
+        self.access = None
+        self.lock = threading.Lock()
+
+    def login(self, session):
+        url = f"{self.base_url}/api/accounts/login/"
+        credentials = {
+            'username': self.fixture['username'],
+            'password': self.fixture['password'],
+        }
+        response = session.post(url, json=credentials, timeout=30)
+        response.raise_for_status()
+        if response.json().get('requires_2fa'):
+            # Second step carries the challenge token instead of the password
+            totp = pyotp.TOTP(self.fixture['totp_secret'])
+            response = session.post(url, json={
+                'challenge_token': response.json()['challenge_token'],
+                'two_fa_token': totp.now(),
+            }, timeout=30)
+            response.raise_for_status()
+        access = response.json().get('access')
+        if not access:
+            raise RuntimeError(f"Login failed for {self.fixture['username']}: {response.text[:200]}")
+        with self.lock:
+            self.access = access
+
+    def headers(self):
+        return {'Authorization': f"Bearer {self.access}"}
+
+
+class LoadRunner:
+    def __init__(self, args, users):
+        self.args = args
+        self.users = users
+        self.images = [
+            make_radiograph(args.width, args.height, seed=i) for i in range(8)
+        ]
+        self.local = threading.local()
+        self.samples = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.record_lock = threading.Lock()
+
+    def session(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def request(self, user, endpoint, rng):
+        base = user.base_url
+        if endpoint == 'upload':
+            files = {'image': ('loadtest.png', rng.choice(self.images), 'image/png')}
+            data = {'patient_id': rng.choice(user.fixture['patient_ids'])}
+            return self.session().post(
+                f"{base}/api/predictions/upload-predict/",
+                headers=user.headers(), files=files, data=data,
+                timeout=self.args.timeout
+            )
+        if endpoint == 'scan':
+            scan_id = rng.choice(user.scan_ids)
+            return self.session().get(
+                f"{base}/api/predictions/scans/{scan_id}/",
+                headers=user.headers(), timeout=self.args.timeout
+            )
+        if endpoint == 'patient_scans':
+            patient_id = rng.choice(user.fixture['patient_ids'])
+            return self.session().get(
+                f"{base}/api/predictions/patients/{patient_id}/scans/",
+                headers=user.headers(), timeout=self.args.timeout
+            )
+        return self.session().get(
+            f"{base}/api/predictions/stats/",
+            headers=user.headers(), timeout=self.args.timeout
+        )
+
+    def fire(self, endpoint, scheduled_at, seed):
+        rng = random.Random(seed)
+        user = rng.choice(self.users)
+        try:
+            response = self.request(user, endpoint, rng)
+            if response.status_code == 401:
+                user.login(self.session())
+                response = self.request(user, endpoint, rng)
+            outcome = response.status_code
+            if endpoint == 'upload' and response.status_code == 201:
+                with user.lock:
+                    user.scan_ids.append(response.json()['xray']['id'])
+        except requests.RequestException as e:
+            outcome = type(e).__name__
+        latency_ms = (time.perf_counter() - scheduled_at) * 1000
+        with self.record_lock:
+            self.samples[endpoint].append((latency_ms, outcome))
+            self.statuses[endpoint][str(outcome)] += 1
+
+    def schedule(self, rates, duration):
+        """Merge per-endpoint Poisson arrivals into one sorted timeline."""
+        rng = random.Random(self.args.seed)
+        arrivals = []
+        for endpoint, rate in rates.items():
+            t = 0.0
+            while rate > 0:
+                t += rng.expovariate(rate)
+                if t >= duration:
+                    break
+                arrivals.append((t, endpoint))
+        arrivals.sort()
+        return arrivals
+
+    def run(self, rates, duration):
+        arrivals = self.schedule(rates, duration)
+        print(f"Scheduling {len(arrivals)} requests over {duration}s "
+              f"with {self.args.workers} workers")
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.workers) as pool:
+            for i, (offset, endpoint) in enumerate(arrivals):
+                delay = start + offset - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self.fire, endpoint, start + offset, self.args.seed + i)
+        return time.perf_counter() - start
+
+
+# ============================================
+# Reporting
+# ============================================
+
+def percentile(ordered, pct):
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return round(ordered[index], 2)
+
+
+def build_report(runner, elapsed):
+    report = {}
+    for endpoint, samples in sorted(runner.samples.items()):
+        latencies = sorted(latency for latency, _ in samples)
+        errors = sum(
+            1 for _, outcome in samples
+            if not isinstance(outcome, int) or outcome >= 400
+        )
+        report[endpoint] = {
+            'requests': len(samples),
+            'errors': errors,
+            'error_rate': round(errors / len(samples), 4),
+            'throughput_rps': round(len(samples) / elapsed, 2),
+            'p50_ms': percentile(latencies, 50),
+            'p90_ms': percentile(latencies, 90),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'max_ms': round(latencies[-1], 2),
+            'status_codes': dict(runner.statuses[endpoint]),
+        }
+    return report
+
+
+def print_report(report):
+    print(f"\n{'endpoint':<15} {'reqs':>6} {'rps':>7} {'err%':>6} "
+          f"{'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for endpoint, row in report.items():
+        print(f"{endpoint:<15} {row['requests']:>6} {row['throughput_rps']:>7} "
+              f"{row['error_rate'] * 100:>5.1f}% {row['p50_ms']:>9} "
+              f"{row['p90_ms']:>9} {row['p99_ms']:>9} {row['max_ms']:>9}")
+
+
+def parse_rates(value):
+    rates = {}
+    for item in value.split(','):
+        endpoint, rate = item.split('=')
+        if endpoint not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint: {endpoint}")
+        rates[endpoint] = float(rate)
+    return rates
+
+
+def run(args):
+    fixtures = json.loads(Path(args.fixtures).read_text())
+    users = [VirtualUser(args.base_url, fixture) for fixture in fixtures['users']]
+    login_session = requests.Session()
+    for user in users:
+        user.login(login_session)
+    print(f"Logged in {len(users)} users")
+
+    runner = LoadRunner(args, users)
+    elapsed = runner.run(args.rates, args.duration)
+    report = build_report(runner, elapsed)
+    print_report(report)
+
+    if args.out:
+        Path(args.out).write_text(json.dumps({
+            'base_url': args.base_url,
+            'duration_s': round(elapsed, 2),
+            'rates': args.rates,
+            'workers': args.workers,
+            'endpoints': report,
+        }, indent=2))
+        print(f"Report written to {args.out}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--width', type=int, default=1024, help='Synthetic radiograph width')
+    parser.add_argument('--height', type=int, default=512, help='Synthetic radiograph height')
+    parser.add_argument('--seed', type=int, default=0)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = sub.add_parser('seed', help='Create load-test users, patients and scans')
+    seed_parser.add_argument('--users', type=int, default=5)
+    seed_parser.add_argument('--patients', type=int, default=3, help='Patients per user')
+    seed_parser.add_argument('--scans', type=int, default=3, help='Scans per patient')
+    seed_parser.add_argument('--prefix', default='loadtest_user')
+    seed_parser.add_argument('--checkpoint', help='Also write a synthetic checkpoint here')
+    seed_parser.add_argument('--out', default='loadtest.json')
+
+    run_parser = sub.add_parser('run', help='Drive traffic against a running server')
+    run_parser.add_argument('--fixtures', default='loadtest.json')
+    run_parser.add_argument('--base-url', default='http://localhost:8000')
+    run_parser.add_argument('--rates', type=parse_rates, default=parse_rates(DEFAULT_RATES),
+                            help='Requests per second per endpoint, e.g. upload=2,scan=10')
+    run_parser.add_argument('--duration', type=float, default=60, help='Seconds')
+    run_parser.add_argument('--workers', type=int, default=32, help='Concurrent connections')
+    run_parser.add_argument('--timeout', type=float, default=120)
+    run_parser.add_argument('--out', help='Write JSON report to this file')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == 'seed':
+        seed(args)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
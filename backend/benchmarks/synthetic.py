@@ -0,0 +1,74 @@
+"""
+Synthetic fixtures for benchmarking without the real model weights.
+
+The checkpoint in ml_models/ is a Git LFS pointer in most checkouts, so these
+helpers build a randomly initialised checkpoint with the same layout that
+CariesClassifier reads ('config' + 'model_state_dict') and generate fake
+radiographs of arbitrary size.
+"""
+import io
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+
+from predictions.ml_inference import CariesClassifier
+
+# Same keys (and defaults) CariesClassifier merges from checkpoint['config']
+DEFAULT_CONFIG = {
+    'img_size': 224,
+    'patch_size': 16,
+    'embed_dim': 768,
+    'depth': 12,
+    'num_heads': 12,
+    'mlp_ratio': 4.0,
+}
+
+
+def make_checkpoint(path, config=None, seed=0):
+    """
+    Write a randomly initialised checkpoint to `path` and return the path.
+    """
+    config = {**DEFAULT_CONFIG, **(config or {})}
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    torch.manual_seed(seed)
+    # Build the architecture from a config-only checkpoint, then save its
+    # (random) weights back out in the format the loader expects.
+    with tempfile.TemporaryDirectory() as tmp:
+        stub = Path(tmp) / 'config_only.pth'
+        torch.save({'config': config, 'model_state_dict': {}}, stub)
+        model = CariesClassifier(str(stub))
+
+    for name, param in model.named_parameters():
+        if name in ('cls_token', 'pos_embed'):
+            torch.nn.init.trunc_normal_(param, std=0.02)
+
+    torch.save({
+        'config': config,
+        'model_state_dict': model.state_dict(),
+        'synthetic': True,
+    }, path)
+    return path
+
+
+def make_radiograph(width=1024, height=512, seed=0, fmt='PNG'):
+    """
+    Return encoded bytes of a grayscale bitewing-like test image.
+
+    Smooth vertical bands stand in for teeth, with noise on top so the
+    encoder cannot compress it trivially.
+    """
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 6 * np.pi, width, dtype=np.float32)
+    bands = (np.sin(x)[None, :] + 1.0) * 80.0
+    gradient = np.linspace(40, 0, height, dtype=np.float32)[:, None]
+    noise = rng.normal(0, 12, size=(height, width)).astype(np.float32)
+    pixels = np.clip(bands + gradient + noise + 30, 0, 255).astype(np.uint8)
+
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format=fmt)
+    return buffer.getvalue()
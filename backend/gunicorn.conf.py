@@ -0,0 +1,33 @@
+"""
+Gunicorn settings: worker count, threads and CPU pinning come from the
+host's CPU topology (see tunzadent/cpu_plan.py).
+"""
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tunzadent.settings')
+
+from django.conf import settings  # noqa: E402
+
+from tunzadent import cpu_plan  # noqa: E402
+
+plan = cpu_plan.plan_from_settings()
+workers = plan.workers
+
+
+def on_starting(server):
+    server.log.info(plan.describe())
+    if getattr(settings, 'CPU_PLAN_MEASURE', False) and not plan.server_threads:
+        if os.path.exists(settings.MODEL_PATH):
+            server.log.info(cpu_plan.describe_measurement(cpu_plan.measure(plan, str(settings.MODEL_PATH))))
+        else:
+            server.log.info("  not measured: model not downloaded yet")
+
+
+def pre_fork(server, worker):
+    # Lowest slot no live worker holds, so a restarted worker takes over its predecessor's cores
+    taken = {getattr(w, 'cpu_slot', None) for w in server.WORKERS.values()}
+    worker.cpu_slot = next(slot for slot in range(len(taken) + 1) if slot not in taken)
+
+
+def post_fork(server, worker):
+    cpu_plan.apply(plan, worker.cpu_slot)
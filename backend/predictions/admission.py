@@ -0,0 +1,191 @@
+"""
+Admission control for model inference.
+
+Gunicorn runs several worker processes, so the concurrency limit is enforced
+with advisory file locks in a shared directory rather than in-process
+semaphores. The kernel drops a flock when its process dies, so a worker
+killed by a timeout can never leak a slot.
+
+Three kinds of slot files:
+- slot-N:       held while running inference (INFERENCE_CONCURRENCY of them)
+- wait-N:       held while queued for a slot (INFERENCE_QUEUE_SIZE of them)
+- user-ID-N:    per-user share, so one bulk upload can't hold every slot
+"""
+import math
+import os
+import tempfile
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from rest_framework.exceptions import Throttled
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: admission control is disabled
+    fcntl = None
+
+POLL_INTERVAL = 0.05
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _FileSlot:
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def try_acquire(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self.fd = fd
+        return True
+
+    def release(self):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+
+
+class InferenceAdmission:
+    """Bounded, fair-share inference concurrency shared by all workers on a host."""
+
+    def __init__(self, directory, limit, queue_size, queue_timeout, user_share):
+        self.directory = Path(directory)
+        self.limit = max(1, limit)
+        self.queue_size = max(0, queue_size)
+        self.queue_timeout = queue_timeout
+        self.per_user = max(1, int(self.limit * user_share))
+        self.enabled = fcntl is not None
+        # Recent inference duration, used to size Retry-After
+        self.avg_seconds = 1.0
+        if self.enabled:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _try_any(self, names):
+        for name in names:
+            slot = _FileSlot(self.directory / name)
+            if slot.try_acquire():
+                return slot
+        return None
+
+    def retry_after(self):
+        return max(1, math.ceil(self.avg_seconds * (1 + self.queue_size / self.limit)))
+
+    def acquire(self, user_id):
+        """
+        Return an ExitStack holding an inference slot for `user_id`.
+        Raises AdmissionRejected if the node is saturated.
+        """
+        stack = ExitStack()
+        if not self.enabled:
+            return stack
+
+        try:
+            user_slot = self._try_any(f"user-{user_id}-{i}" for i in range(self.per_user))
+            if user_slot is None:
+                raise AdmissionRejected('Too many concurrent analyses for this account', self.retry_after())
+            stack.callback(user_slot.release)
+
+            slot_names = [f"slot-{i}" for i in range(self.limit)]
+            slot = self._try_any(slot_names)
+            if slot is None:
+                waiter = self._try_any(f"wait-{i}" for i in range(self.queue_size))
+                if waiter is None:
+                    raise AdmissionRejected('Server is busy analysing other scans', self.retry_after())
+                try:
+                    deadline = time.monotonic() + self.queue_timeout
+                    while slot is None and time.monotonic() < deadline:
+                        time.sleep(POLL_INTERVAL)
+                        slot = self._try_any(slot_names)
+                finally:
+                    waiter.release()
+                if slot is None:
+                    raise AdmissionRejected('Server is busy analysing other scans', self.retry_after())
+            stack.callback(slot.release)
+        except BaseException:
+            stack.close()
+            raise
+
+        started = time.monotonic()
+        stack.callback(self._observe, started)
+        return stack
+
+    def try_acquire(self, user_id):
+        """
+        Like acquire(), but never queue: return None unless a slot is free
+        right now. For optional work a request can do without.
+        """
+        stack = ExitStack()
+        if not self.enabled:
+            return stack
+
+        user_slot = self._try_any(f"user-{user_id}-{i}" for i in range(self.per_user))
+        if user_slot is None:
+            return None
+        stack.callback(user_slot.release)
+        slot = self._try_any(f"slot-{i}" for i in range(self.limit))
+        if slot is None:
+            stack.close()
+            return None
+        stack.callback(slot.release)
+        stack.callback(self._observe, time.monotonic())
+        return stack
+
+    def wait(self, user_id):
+        """
+        Like acquire(), but wait out saturation instead of raising. For
+        background jobs, which should yield to live traffic rather than fail.
+        """
+        while True:
+            try:
+                return self.acquire(user_id)
+            except AdmissionRejected as e:
+                time.sleep(e.retry_after)
+
+    def _observe(self, started):
+        elapsed = time.monotonic() - started
+        self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * elapsed
+
+
+_admission = None
+
+
+def get_admission():
+    global _admission
+    if _admission is None:
+        _admission = InferenceAdmission(
+            directory=getattr(settings, 'INFERENCE_LOCK_DIR',
+                              Path(tempfile.gettempdir()) / 'tunzadent-inference'),
+            limit=getattr(settings, 'INFERENCE_CONCURRENCY', 2),
+            queue_size=getattr(settings, 'INFERENCE_QUEUE_SIZE', 4),
+            queue_timeout=getattr(settings, 'INFERENCE_QUEUE_TIMEOUT', 2.0),
+            user_share=getattr(settings, 'INFERENCE_USER_SHARE', 0.5),
+        )
+        if not _admission.enabled:
+            print("WARNING: fcntl unavailable, inference admission control disabled")
+    return _admission
+
+
+def inference_slot(user_id):
+    """
+    Take an inference slot for `user_id`; use as a context manager around
+    the forward pass. Saturation surfaces as 429 Too Many Requests with
+    Retry-After. Call it only once the request is known to be valid, so
+    malformed requests never hold or wait for a slot.
+    """
+    try:
+        return get_admission().acquire(user_id)
+    except AdmissionRejected as e:
+        raise Throttled(wait=e.retry_after, detail=e.reason)
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class PredictionsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'predictions'
+
+    def ready(self):
+        from django.conf import settings
+        from PIL import Image
+
+        from . import signals  # noqa: F401
+
+        # Decoding anywhere (inference, reports, re-scoring) refuses images
+        # far past the upload limit
+        Image.MAX_IMAGE_PIXELS = getattr(settings, 'UPLOAD_MAX_PIXELS', Image.MAX_IMAGE_PIXELS)
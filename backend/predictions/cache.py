@@ -0,0 +1,104 @@
+"""
+Cross-request response cache for the read endpoints.
+
+Cached entries are keyed by user, view arguments and the current version
+token of every object the response depends on. Writers never delete cached
+responses; signals (see signals.py) replace the version token after the
+transaction commits, so any entry built from older data simply stops being
+addressable. A reader that raced a write stores its result under the old
+token, which nobody looks up again.
+"""
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+KEY_PREFIX = 'predictions'
+
+
+def stats_version_key(user_id):
+    return f"{KEY_PREFIX}:ver:stats:{user_id}"
+
+
+def patient_version_key(patient_id):
+    return f"{KEY_PREFIX}:ver:patient:{patient_id}"
+
+
+def scan_version_key(scan_id):
+    return f"{KEY_PREFIX}:ver:scan:{scan_id}"
+
+
+def _get_versions(version_keys):
+    versions = cache.get_many(version_keys)
+    for key in version_keys:
+        if key not in versions:
+            # Unknown or evicted: start a fresh token so no old entry can match
+            cache.add(key, uuid.uuid4().hex, timeout=None)
+            versions[key] = cache.get(key) or uuid.uuid4().hex
+    return [versions[key] for key in version_keys]
+
+
+def bump_versions(version_keys):
+    """Invalidate every cached response depending on `version_keys`."""
+    version_keys = [key for key in version_keys if key]
+    if not version_keys:
+        return
+
+    def bump():
+        cache.set_many({key: uuid.uuid4().hex for key in version_keys}, timeout=None)
+
+    transaction.on_commit(bump)
+
+
+def invalidate_scans(scans):
+    """
+    Invalidate caches for an iterable of (scan_id, patient_id, user_id).
+    For bulk writes (update()/bulk_update()) that don't fire model signals.
+    """
+    keys = set()
+    for scan_id, patient_id, user_id in scans:
+        keys.update((
+            scan_version_key(scan_id),
+            patient_version_key(patient_id),
+            stats_version_key(user_id),
+        ))
+    bump_versions(sorted(keys))
+
+
+def cached_response(name, depends_on):
+    """
+    Cache successful responses of a DRF function view.
+
+    `depends_on(request, **kwargs)` returns the version keys the response is
+    built from. Only 200 responses are stored; errors and responses the
+    view marks Cache-Control: no-store (e.g. degraded ones) always recompute.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not getattr(settings, 'RESPONSE_CACHE_ENABLED', True):
+                return view(request, *args, **kwargs)
+
+            version_keys = depends_on(request, **kwargs)
+            versions = _get_versions(version_keys)
+            arguments = ':'.join(f"{k}={v}" for k, v in sorted(kwargs.items()))
+            # Host is part of the key because responses embed absolute image URLs
+            key = (f"{KEY_PREFIX}:{name}:u{request.user.id}:{request.get_host()}:"
+                   f"{arguments}:{':'.join(versions)}")
+
+            data = cache.get(key)
+            if data is not None:
+                response = Response(data)
+                response['X-Cache'] = 'HIT'
+                return response
+
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and 'no-store' not in response.get('Cache-Control', ''):
+                cache.set(key, response.data, getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300))
+            response['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,310 @@
+"""
+Patient deletion and orphaned-file reclamation.
+
+Deleting a Patient cascades through its XRayImage and Prediction rows, but
+the radiographs under MEDIA_ROOT/xrays/ and any cached report PDFs stay on
+disk. Deletion here gathers those files first, deletes the rows, and
+removes the files once the transaction commits. A rolled-back delete
+therefore never loses a file that is still referenced.
+
+Bulk deletions are queued as PatientDeletion rows and run by the
+run_patient_deletions worker, like outbound email (accounts/emails.py).
+Patients are deleted in small chunks, each in its own short transaction.
+A worker holds a lease on its job and renews it after every chunk. If the
+worker dies, the lease runs out and the next worker resumes the job with
+the patients that are left. Failed runs are retried with backoff.
+
+reap_media() catches files that were left behind anyway: deletes from
+before this module existed, crashes between commit and file removal, and
+uploads whose row was never created. It walks the media tree with
+os.scandir without listing it all at once, and checks names against the
+database a batch at a time. Files that no row references are deleted at a
+bounded rate. Files younger than a grace period are skipped, because an
+upload writes its file before its row commits.
+"""
+import logging
+import os
+import shutil
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Patient, PatientDeletion, Prediction, ReportJob, XRayImage
+from .reports import patient_report_key, report_dir, scan_report_key
+
+logger = logging.getLogger('tunzadent.cleanup')
+
+MEDIA_SUBDIR = 'xrays'
+# Patients deleted per transaction in a bulk job
+DELETE_CHUNK = 25
+MAX_ATTEMPTS = 5
+BASE_RETRY_SECONDS = 60
+LEASE_SECONDS = 300
+
+
+# ============================================
+# Patient deletion
+# ============================================
+
+def patient_files(patients):
+    """(media names, cached report paths) belonging to `patients`."""
+    names = list(
+        XRayImage.objects.filter(patient__in=patients)
+        .exclude(image='').values_list('image', flat=True)
+    )
+    directory = report_dir()
+    reports = [directory / f"{patient_report_key(p)}.pdf" for p in patients]
+    predictions = Prediction.objects.filter(xray__patient__in=patients).select_related('xray__patient')
+    reports += [directory / f"{scan_report_key(p)}.pdf" for p in predictions]
+    return names, reports
+
+
+def remove_files(names, reports=()):
+    """Delete stored media `names` and report files; returns how many were removed."""
+    removed = 0
+    for name in names:
+        try:
+            if default_storage.exists(name):
+                default_storage.delete(name)
+                removed += 1
+        except OSError as e:
+            logger.warning(f"Could not delete media file {name}: {e}")
+    for path in reports:
+        try:
+            Path(path).unlink()
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not delete report {path}: {e}")
+    return removed
+
+
+def delete_patients(patients):
+    """
+    Delete `patients` (a queryset or list) with their scans and predictions,
+    and remove their files after commit. Returns the number of patients deleted.
+    """
+    patients = list(patients)
+    if not patients:
+        return 0
+    with transaction.atomic():
+        names, reports = patient_files(patients)
+        Patient.objects.filter(id__in=[p.id for p in patients]).delete()
+        transaction.on_commit(lambda: remove_files(names, reports))
+    return len(patients)
+
+
+def queue_bulk_delete(user, patient_ids):
+    return PatientDeletion.objects.create(requested_by=user, patient_ids=list(patient_ids))
+
+
+def claim_bulk_delete():
+    """Lease the oldest due deletion job to this worker; None if there is none."""
+    now = timezone.now()
+    with transaction.atomic():
+        job = (
+            PatientDeletion.objects.select_for_update(skip_locked=True)
+            .filter(status__in=['queued', 'running'], lease_until__lte=now)
+            .order_by('created_at').first()
+        )
+        if job is None:
+            return None
+        job.status = 'running'
+        job.attempts += 1
+        job.lease_until = now + timedelta(seconds=LEASE_SECONDS)
+        job.save(update_fields=['status', 'attempts', 'lease_until'])
+    return job
+
+
+def run_bulk_delete(job):
+    """Delete the job's patients that are still there, a chunk at a time. Returns True on success."""
+    ids = job.patient_ids
+    try:
+        for start in range(0, len(ids), DELETE_CHUNK):
+            chunk = Patient.objects.filter(
+                id__in=ids[start:start + DELETE_CHUNK],
+                created_by_id=job.requested_by_id
+            )
+            job.deleted += delete_patients(chunk)
+            # Progress for status polls, and a renewed lease
+            job.lease_until = timezone.now() + timedelta(seconds=LEASE_SECONDS)
+            job.save(update_fields=['deleted', 'lease_until'])
+    except Exception as e:
+        logger.exception(f"Bulk patient deletion {job.id} failed (attempt {job.attempts})")
+        job.last_error = str(e)[:1000]
+        if job.attempts >= MAX_ATTEMPTS:
+            job.status = 'failed'
+            job.finished_at = timezone.now()
+        else:
+            job.status = 'queued'
+            delay = BASE_RETRY_SECONDS * 2 ** (job.attempts - 1)
+            job.lease_until = timezone.now() + timedelta(seconds=delay)
+        job.save(update_fields=['last_error', 'status', 'finished_at', 'lease_until'])
+        return False
+
+    job.status = 'completed'
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'finished_at'])
+    logger.info(f"Bulk patient deletion {job.id}: deleted {job.deleted} of {len(ids)} patients")
+    return True
+
+
+# ============================================
+# Orphan reaper
+# ============================================
+
+def iter_files(root):
+    """Yield os.DirEntry for every regular file under `root`, depth first, without listing the tree."""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry
+        except FileNotFoundError:
+            continue
+
+
+def _prune_empty_dirs(root):
+    """Remove empty date directories left under `root` (bottom-up)."""
+    # topdown=False yields children before parents, so pruning as we go
+    # empties parents in the same pass without holding the tree
+    for directory, _, _ in os.walk(root, topdown=False):
+        if directory != str(root):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+
+
+class _Throttle:
+    """Sleep off any lead over `rate` operations per second."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.count = 0
+        self.started = time.monotonic()
+
+    def tick(self):
+        self.count += 1
+        if self.rate:
+            ahead = self.count / self.rate - (time.monotonic() - self.started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+def reap_media(grace=3600, batch_size=500, max_rate=50.0, dry_run=False, log=logger.info):
+    """
+    Delete files under MEDIA_ROOT/xrays/ that no XRayImage references and
+    that are older than `grace` seconds. Returns counts of scanned, orphaned
+    and removed files and the bytes reclaimed.
+    """
+    media_root = Path(settings.MEDIA_ROOT)
+    root = media_root / MEDIA_SUBDIR
+    stats = {'scanned': 0, 'orphaned': 0, 'removed': 0, 'bytes': 0}
+    if not root.is_dir():
+        return stats
+    throttle = _Throttle(max_rate)
+    cutoff = time.time() - grace
+
+    def reap(batch):
+        referenced = set(
+            XRayImage.objects.filter(image__in=list(batch)).values_list('image', flat=True)
+        )
+        for name, (path, size) in batch.items():
+            if name in referenced:
+                continue
+            stats['orphaned'] += 1
+            stats['bytes'] += size
+            if dry_run:
+                log(f"  orphaned: {name} ({size} bytes)")
+                continue
+            try:
+                os.unlink(path)
+                stats['removed'] += 1
+            except FileNotFoundError:
+                pass
+            throttle.tick()
+
+    batch = {}
+    for entry in iter_files(root):
+        stats['scanned'] += 1
+        try:
+            info = entry.stat(follow_symlinks=False)
+        except FileNotFoundError:
+            continue
+        if info.st_mtime > cutoff:
+            continue
+        # Stored names are relative to MEDIA_ROOT with forward slashes
+        name = Path(entry.path).relative_to(media_root).as_posix()
+        batch[name] = (entry.path, info.st_size)
+        if len(batch) >= batch_size:
+            reap(batch)
+            batch = {}
+    if batch:
+        reap(batch)
+
+    if not dry_run:
+        _prune_empty_dirs(root)
+    return stats
+
+
+def reap_derivatives(report_max_age=7 * 86400, grace=3600, dry_run=False, log=logger.info):
+    """
+    Delete cached report PDFs not rewritten for `report_max_age` seconds
+    and their finished ReportJob rows, render temp files and abandoned
+    embedding-index generations older than `grace`. Returns counts of
+    removed files, directories and rows and bytes reclaimed.
+    """
+    stats = {'reports': 0, 'report_jobs': 0, 'index_generations': 0, 'bytes': 0}
+    now = time.time()
+
+    def remove(path, size, kind):
+        stats['bytes'] += size
+        stats[kind] += 1
+        if dry_run:
+            log(f"  stale: {path} ({size} bytes)")
+        elif path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink(missing_ok=True)
+
+    # Report keys digest what they show, so superseded PDFs are never read again
+    for entry in os.scandir(report_dir()):
+        if not entry.is_file(follow_symlinks=False):
+            continue
+        info = entry.stat(follow_symlinks=False)
+        max_age = report_max_age if entry.name.endswith('.pdf') else grace
+        if now - info.st_mtime > max_age:
+            remove(Path(entry.path), info.st_size, 'reports')
+
+    finished_jobs = ReportJob.objects.filter(
+        status__in=['completed', 'failed'],
+        finished_at__lt=timezone.now() - timedelta(seconds=report_max_age)
+    )
+    if dry_run:
+        stats['report_jobs'] = finished_jobs.count()
+    else:
+        stats['report_jobs'] = finished_jobs.delete()[0]
+
+    # Generations left by index builds that died before switching CURRENT
+    index = Path(getattr(settings, 'EMBEDDING_INDEX_DIR', ''))
+    current = index / 'CURRENT'
+    if index.is_dir() and current.exists():
+        live = current.read_text().strip()
+        for generation in index.glob('gen-*'):
+            if generation.name == live or now - generation.stat().st_mtime <= grace:
+                continue
+            size = sum(f.stat().st_size for f in generation.iterdir() if f.is_file())
+            remove(generation, size, 'index_generations')
+    return stats
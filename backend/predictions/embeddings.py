@@ -0,0 +1,258 @@
+"""
+Similar-case search over stored CLS embeddings.
+
+Every completed Prediction keeps its encoder CLS vector as float16 bytes.
+`build_embedding_index` packs them into a generation directory of .npy
+files (unit-normalised vectors, prediction ids, owner ids; sorted by
+owner so each dentist's rows are one contiguous slice) that every
+worker memory-maps read-only, so the index costs page cache rather than
+per-process heap. A CURRENT file names the live generation and is swapped
+atomically; workers notice and remap on their next query.
+
+Predictions newer than the last build are read straight from the database
+and scored alongside the index, so results are never stale for new scans.
+Only embeddings with the same embedding_version are compared. That is the
+weights' version without the inference-mode suffixes model_version carries
+(+tome, +tiled, +fast), so scans scored in different modes still match.
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from django.conf import settings
+from django.db.models import Max
+
+from .models import Prediction
+
+EMBEDDING_DTYPE = np.float16
+# Rows scored per step, bounding scratch memory during a query
+SCORE_CHUNK = 65536
+
+
+def index_dir():
+    path = Path(getattr(settings, 'EMBEDDING_INDEX_DIR',
+                        Path(tempfile.gettempdir()) / 'tunzadent-embeddings'))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def decode(blob):
+    return np.frombuffer(bytes(blob), dtype=EMBEDDING_DTYPE)
+
+
+def _normalise(vectors):
+    vectors = vectors.astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-6)
+
+
+def _keyset_pages(rows, batch_size):
+    """
+    Yield (id, embedding) of `rows` in id order, `batch_size` rows per query.
+    Without server-side cursors iterator() still buffers the whole result set.
+    """
+    last_id = 0
+    while True:
+        page = list(rows.filter(id__gt=last_id).order_by('id').values_list('id', 'embedding')[:batch_size])
+        yield from page
+        if len(page) < batch_size:
+            return
+        last_id = page[-1][0]
+
+
+def build_index(embedding_version, batch_size=5000):
+    """
+    Write a new index generation from every stored embedding of
+    `embedding_version` and make it current. Returns the number of rows.
+    """
+    root = index_dir()
+    candidates = Prediction.objects.filter(embedding_version=embedding_version, embedding__isnull=False)
+    # Fix the upper bound first so rows added mid-build are left to the tail query
+    max_id = candidates.aggregate(max_id=Max('id'))['max_id'] or 0
+    rows = candidates.filter(id__lte=max_id)
+    count = rows.count()
+    # Rows grouped by owner, so each dentist's vectors are one contiguous slice
+    owner_ids = list(
+        rows.order_by('xray__uploaded_by_id').values_list('xray__uploaded_by_id', flat=True).distinct()
+    )
+    generation = root / f"gen-{time.time_ns()}"
+    generation.mkdir()
+
+    ids = np.empty(count, dtype=np.int64)
+    owners = np.empty(count, dtype=np.int64)
+    vectors = None
+    written = 0
+    for owner_id in owner_ids:
+        for prediction_id, blob in _keyset_pages(rows.filter(xray__uploaded_by_id=owner_id), batch_size):
+            vector = decode(blob)
+            if vectors is None:
+                vectors = np.lib.format.open_memmap(
+                    generation / 'vectors.npy', mode='w+',
+                    dtype=EMBEDDING_DTYPE, shape=(count, vector.shape[0])
+                )
+            # Deleted mid-build rows shrink the count; mismatched dims are skipped
+            if written >= count or vector.shape[0] != vectors.shape[1]:
+                continue
+            vectors[written] = _normalise(vector)
+            ids[written] = prediction_id
+            owners[written] = owner_id
+            written += 1
+
+    if vectors is None:
+        np.save(generation / 'vectors.npy', np.zeros((0, 0), dtype=EMBEDDING_DTYPE))
+    else:
+        vectors.flush()
+        del vectors
+    np.save(generation / 'ids.npy', ids[:written])
+    np.save(generation / 'owners.npy', owners[:written])
+    with open(generation / 'meta.json', 'w') as f:
+        json.dump({
+            'embedding_version': embedding_version,
+            'count': written,
+            'max_prediction_id': max_id,
+            'built_at': time.time(),
+        }, f)
+
+    # Point CURRENT at the new generation, then drop older ones. Workers that
+    # still map an old generation keep reading it until they remap.
+    pointer = root / 'CURRENT.tmp'
+    pointer.write_text(generation.name)
+    os.replace(pointer, root / 'CURRENT')
+    for old in root.glob('gen-*'):
+        if old != generation:
+            shutil.rmtree(old, ignore_errors=True)
+    return written
+
+
+class EmbeddingIndex:
+    """Read-only view of the current index generation."""
+
+    def __init__(self, generation):
+        self.generation = generation.name
+        with open(generation / 'meta.json') as f:
+            self.meta = json.load(f)
+        self.ids = np.load(generation / 'ids.npy', mmap_mode='r')
+        self.owners = np.load(generation / 'owners.npy', mmap_mode='r')
+        # Copy-on-write mapping: torch needs a writable buffer but never writes
+        self.vectors = np.load(generation / 'vectors.npy', mmap_mode='c')
+
+    def score(self, query, owner_id):
+        """(prediction_ids, cosine similarities) of `owner_id`'s indexed rows."""
+        if not len(self.ids) or self.vectors.shape[1] != query.shape[0]:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        start = np.searchsorted(self.owners, owner_id, side='left')
+        end = np.searchsorted(self.owners, owner_id, side='right')
+        # torch's half-precision matrix-vector kernel is several times faster
+        # on CPU than converting the slice to float32 with NumPy
+        query = torch.from_numpy(query.astype(EMBEDDING_DTYPE))
+        scores = np.empty(end - start, dtype=np.float32)
+        for offset in range(start, end, SCORE_CHUNK):
+            chunk = torch.from_numpy(self.vectors[offset:min(offset + SCORE_CHUNK, end)])
+            scores[offset - start:offset - start + len(chunk)] = (chunk @ query).float().numpy()
+        return np.asarray(self.ids[start:end]), scores
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """The current EmbeddingIndex, remapped if a newer build exists; None if never built."""
+    global _index
+    try:
+        current = (index_dir() / 'CURRENT').read_text().strip()
+    except FileNotFoundError:
+        return None
+    with _index_lock:
+        if _index is None or _index.generation != current:
+            try:
+                _index = EmbeddingIndex(index_dir() / current)
+            except FileNotFoundError:
+                # Replaced again while loading; keep what we had
+                pass
+        return _index
+
+
+def similar_predictions(prediction, owner_id, limit=10, reviewed_only=True):
+    """
+    Return [(Prediction, similarity)] of `owner_id`'s scans most similar to
+    `prediction`, best first, excluding `prediction` itself.
+    """
+    query = _normalise(decode(prediction.embedding))
+    index = get_index()
+
+    ids, scores = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    max_indexed_id = 0
+    if index is not None and index.meta.get('embedding_version') == prediction.embedding_version:
+        ids, scores = index.score(query, owner_id)
+        max_indexed_id = index.meta['max_prediction_id']
+
+    # Scans added since the last build
+    tail = list(
+        Prediction.objects.filter(
+            id__gt=max_indexed_id,
+            embedding_version=prediction.embedding_version,
+            embedding__isnull=False,
+            xray__uploaded_by_id=owner_id,
+        ).values_list('id', 'embedding')
+    )
+    if tail:
+        tail_vectors = [decode(blob) for _, blob in tail]
+        tail_ids = np.array([pid for (pid, _), v in zip(tail, tail_vectors)
+                             if v.shape == query.shape], dtype=np.int64)
+        tail_vectors = [v for v in tail_vectors if v.shape == query.shape]
+        if tail_vectors:
+            ids = np.concatenate([ids, tail_ids])
+            scores = np.concatenate([scores, _normalise(np.stack(tail_vectors)) @ query])
+
+    keep = ids != prediction.id
+    if reviewed_only and len(ids):
+        # One query for the owner's reviewed ids, filtered in memory, rather
+        # than re-checking the flag page by page when few scans are reviewed
+        reviewed = np.fromiter(
+            Prediction.objects.filter(
+                xray__uploaded_by_id=owner_id, reviewed=True, status='completed'
+            ).values_list('id', flat=True),
+            dtype=np.int64
+        )
+        keep &= np.isin(ids, reviewed)
+    ids, scores = ids[keep], scores[keep]
+
+    # Index rows can be deleted or unreviewed since the build, so confirm
+    # candidates against the database a page at a time. The first page only
+    # needs a partial sort; a full sort is done only if it falls short.
+    results, matched = [], set()
+    page = max(limit * 4, 50)
+    if len(scores) > page:
+        head = np.argpartition(-scores, page)[:page]
+        order = head[np.argsort(-scores[head], kind='stable')]
+    else:
+        order = np.argsort(-scores, kind='stable')
+    start = 0
+    while start < len(order):
+        candidates = order[start:start + page]
+        queryset = Prediction.objects.filter(
+            id__in=ids[candidates].tolist(),
+            status='completed',
+            xray__uploaded_by_id=owner_id,
+        ).select_related('xray__patient').defer('embedding')
+        if reviewed_only:
+            queryset = queryset.filter(reviewed=True)
+        found = {p.id: p for p in queryset}
+        for position in candidates:
+            match = found.pop(int(ids[position]), None)
+            if match is not None and match.id not in matched:
+                matched.add(match.id)
+                results.append((match, float(scores[position])))
+                if len(results) == limit:
+                    return results
+        start += page
+        if start == len(order) and len(order) < len(scores):
+            order = np.argsort(-scores, kind='stable')
+    return results
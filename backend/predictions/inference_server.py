@@ -0,0 +1,292 @@
+"""
+Out-of-process inference server.
+
+With INFERENCE_SERVER_SOCKET set, web workers stop loading the model.
+`manage.py inference_server` runs one process that owns it, and
+CariesDetector forwards every encoder pass to that process. Workers keep
+preprocessing, heatmap rendering and everything else.
+
+Each worker connection owns one shared-memory buffer (a memfd, or an
+unlinked temp file where memfd is unavailable). Its file descriptor is
+passed to the server once, over the Unix socket, with SCM_RIGHTS. A
+request writes the input batch at the start of the buffer and sends a
+small JSON control message. The server reads the tensor in place, runs
+the forward, writes features, attention and logits after the input and
+replies with their shapes. Tensor data never goes through the socket.
+The buffer is freed when both ends have closed it, so a crashed worker
+cannot leak it.
+
+Forward passes are serialised in the server, so one set of intra-op
+threads can use every core without competing with other workers.
+"""
+import json
+import math
+import mmap
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+import torch
+
+HEADER = struct.Struct('!I')
+FLOAT_BYTES = 4
+# Grow buffers in steps of this much so similar batches reuse them
+BUFFER_STEP = 4 * 1024 * 1024
+
+
+class InferenceServerError(Exception):
+    pass
+
+
+# ============================================
+# Framing
+# ============================================
+
+def _send(sock, message, fds=()):
+    payload = json.dumps(message).encode()
+    data = HEADER.pack(len(payload)) + payload
+    if fds:
+        sent = socket.send_fds(sock, [data], list(fds))
+        data = data[sent:]
+    if data:
+        sock.sendall(data)
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError('connection closed')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _recv(sock):
+    """Return (message, fds), or (None, []) when the peer has closed."""
+    data, fds, _, _ = socket.recv_fds(sock, HEADER.size, 4)
+    if not data:
+        return None, []
+    data += _recv_exact(sock, HEADER.size - len(data))
+    (length,) = HEADER.unpack(data)
+    return json.loads(_recv_exact(sock, length)), fds
+
+
+def _shared_buffer(size):
+    """(fd, mmap) of a new anonymous shared-memory region of `size` bytes."""
+    if hasattr(os, 'memfd_create'):
+        fd = os.memfd_create('tunzadent-inference')
+    else:
+        fd, path = tempfile.mkstemp(prefix='tunzadent-inference-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+        os.unlink(path)
+    os.ftruncate(fd, size)
+    return fd, mmap.mmap(fd, size)
+
+
+def _view(buffer, offset, shape):
+    count = math.prod(shape)
+    return torch.frombuffer(buffer, dtype=torch.float32, count=count, offset=offset).view(shape)
+
+
+# ============================================
+# Server
+# ============================================
+
+class InferenceServer:
+    """Serve `detector`'s forward pass on a Unix socket."""
+
+    def __init__(self, detector, socket_path):
+        self.detector = detector
+        self.socket_path = socket_path
+        self._lock = threading.Lock()
+        model = detector._model
+        self.info = {
+            'embed_dim': model.cls_token.shape[-1],
+            'num_heads': model.encoder[0].attn.num_heads,
+            'patch_size': model.patch_embed.patch_size,
+            'depth': len(model.encoder),
+            'bf16': detector._bf16,
+        }
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o660)
+        listener.listen(64)
+        try:
+            while True:
+                conn, _ = listener.accept()
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        finally:
+            listener.close()
+            os.unlink(self.socket_path)
+
+    def _handle(self, conn):
+        buffer = None
+        try:
+            while True:
+                message, fds = _recv(conn)
+                if message is None:
+                    return
+                if fds:
+                    if buffer is not None:
+                        buffer.close()
+                    buffer = mmap.mmap(fds[0], message['buffer_size'])
+                    for fd in fds:
+                        os.close(fd)
+                try:
+                    if message['op'] == 'info':
+                        _send(conn, {'ok': True, **self.info})
+                    elif message['op'] == 'forward':
+                        _send(conn, {'ok': True, **self._forward(buffer, message)})
+                    else:
+                        _send(conn, {'ok': False, 'error': f"unknown op {message['op']!r}"})
+                except Exception as e:
+                    _send(conn, {'ok': False, 'error': str(e)})
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            conn.close()
+            if buffer is not None:
+                try:
+                    buffer.close()
+                except BufferError:
+                    # A tensor view is still alive; the mapping goes with it
+                    pass
+
+    def _forward(self, buffer, message):
+        if buffer is None:
+            raise InferenceServerError('no shared buffer')
+        images = _view(buffer, 0, message['shape'])
+        started = time.perf_counter()
+        with self._lock:
+            features, attention, logits = self.detector._forward(
+                images, return_attention=message.get('return_attention', False),
+                **message.get('options', {})
+            )
+        outputs = {'features': features, 'logits': logits}
+        if attention is not None:
+            outputs['attention'] = attention
+
+        offset = images.numel() * FLOAT_BYTES
+        needed = offset + sum(t.numel() for t in outputs.values()) * FLOAT_BYTES
+        if needed > len(buffer):
+            raise InferenceServerError(f"shared buffer too small: {len(buffer)} < {needed} bytes")
+        shapes = {}
+        for name, tensor in outputs.items():
+            _view(buffer, offset, tensor.shape).copy_(tensor)
+            shapes[name] = [offset, list(tensor.shape)]
+            offset += tensor.numel() * FLOAT_BYTES
+        return {'outputs': shapes, 'forward_ms': (time.perf_counter() - started) * 1000}
+
+
+# ============================================
+# Client
+# ============================================
+
+class InferenceClient:
+    """One web worker's connection to the inference server (thread-safe)."""
+
+    def __init__(self, socket_path, timeout=60.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock = None
+        self._buffer = None
+        self._buffer_fd = None
+        self.info = None
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self._close()
+        self._sock = sock
+        _send(sock, {'op': 'info'})
+        self.info = self._reply()
+        return self.info
+
+    def wait(self, timeout):
+        """Connect, retrying until the server is up or `timeout` seconds pass."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                with self._lock:
+                    return self.connect()
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.5)
+
+    def forward(self, images, return_attention=False, **options):
+        """Remote CariesDetector._forward: returns (features, attention, logits)."""
+        images = images.detach().to('cpu', torch.float32).contiguous()
+        with self._lock:
+            try:
+                return self._forward(images, return_attention, options)
+            except (ConnectionError, OSError):
+                # Server restarted: reconnect once (the buffer is sent again)
+                self.connect()
+                return self._forward(images, return_attention, options)
+
+    def _forward(self, images, return_attention, options):
+        if self._sock is None:
+            self.connect()
+        batch, _, height, width = images.shape
+        patches = (height // self.info['patch_size']) * (width // self.info['patch_size'])
+        outputs = batch * (self.info['embed_dim'] + 2)
+        if return_attention:
+            outputs += batch * self.info['num_heads'] * (1 + patches)
+        needed = (images.numel() + outputs) * FLOAT_BYTES
+
+        fds = ()
+        if self._buffer is None or len(self._buffer) < needed:
+            self._close_buffer()
+            size = -(-needed // BUFFER_STEP) * BUFFER_STEP
+            self._buffer_fd, self._buffer = _shared_buffer(size)
+            fds = (self._buffer_fd,)
+
+        _view(self._buffer, 0, images.shape).copy_(images)
+        _send(self._sock, {
+            'op': 'forward',
+            'shape': list(images.shape),
+            'return_attention': return_attention,
+            'options': {k: v for k, v in options.items() if v is not None},
+            'buffer_size': len(self._buffer),
+        }, fds)
+        reply = self._reply()
+        # Copy out: the buffer is reused by the next call
+        results = {name: _view(self._buffer, offset, shape).clone()
+                   for name, (offset, shape) in reply['outputs'].items()}
+        return results['features'], results.get('attention'), results['logits']
+
+    def _reply(self):
+        reply, _ = _recv(self._sock)
+        if reply is None:
+            raise ConnectionError('inference server closed the connection')
+        if not reply.get('ok'):
+            raise InferenceServerError(reply.get('error', 'inference server error'))
+        return reply
+
+    def _close_buffer(self):
+        if self._buffer is not None:
+            self._buffer.close()
+            os.close(self._buffer_fd)
+            self._buffer = self._buffer_fd = None
+
+    def _close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        # A new connection needs the buffer passed again
+        self._close_buffer()
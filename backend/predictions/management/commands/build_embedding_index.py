@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from predictions.embeddings import build_index
+from predictions.ml_inference import EMBEDDING_VERSION
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the memory-mapped similar-case index from stored embeddings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--embedding-version', '--model-version', dest='embedding_version',
+                            default=EMBEDDING_VERSION,
+                            help='Only index embeddings of this version (the weights, whatever the inference mode)')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = build_index(options['embedding_version'], batch_size=options['batch_size'])
+        self.stdout.write(
+            f"Indexed {count} embeddings for {options['embedding_version']} "
+            f"in {time.monotonic() - started:.1f}s"
+        )
@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tunzadent import cpu_plan
+
+
+class Command(BaseCommand):
+    help = 'Show the worker/thread plan for this host and optionally measure it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--measure', action='store_true',
+                            help='Measure single-request and saturated throughput under the plan')
+        parser.add_argument('--compare', action='store_true',
+                            help='Also measure PyTorch defaults (every worker uses every CPU, unpinned)')
+        parser.add_argument('--seconds', type=float, default=5.0, help='Length of each measurement')
+
+    def handle(self, *args, **options):
+        plan = cpu_plan.plan_from_settings()
+        self.stdout.write(plan.describe())
+        if not (options['measure'] or options['compare']):
+            return
+        model_path = str(settings.MODEL_PATH)
+        try:
+            results = cpu_plan.measure(plan, model_path, options['seconds'])
+        except FileNotFoundError:
+            raise CommandError(f"Model not found at {model_path}")
+        self.stdout.write(cpu_plan.describe_measurement(results))
+
+        if options['compare']:
+            default = cpu_plan.CpuPlan(
+                plan.workers, plan.running, len(plan.host['cpus']), len(plan.host['cpus']),
+                [], 0, plan.host, []
+            )
+            baseline = cpu_plan.measure(default, model_path, options['seconds'])
+            self.stdout.write('PyTorch defaults:')
+            self.stdout.write(cpu_plan.describe_measurement(baseline))
+            self.stdout.write(f"  saturated throughput: {results['saturated'][0] / baseline['saturated'][0]:.2f}x "
+                              f"with the plan")
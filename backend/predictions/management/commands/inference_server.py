@@ -0,0 +1,42 @@
+import signal
+import sys
+
+import torch
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from predictions.inference_server import InferenceServer
+from predictions.ml_inference import CariesDetector, use_local_model
+from tunzadent import cpu_plan
+
+
+class Command(BaseCommand):
+    help = 'Run the local inference server that owns the model (see INFERENCE_SERVER_SOCKET)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=None,
+                            help='Unix socket path (default: INFERENCE_SERVER_SOCKET)')
+        parser.add_argument('--threads', type=int, default=None,
+                            help='torch intra-op threads (default: every usable core, see cpu_plan)')
+
+    def handle(self, *args, **options):
+        socket_path = options['socket'] or getattr(settings, 'INFERENCE_SERVER_SOCKET', '')
+        if not socket_path:
+            raise CommandError('Set INFERENCE_SERVER_SOCKET or pass --socket')
+
+        # The only process running the model, so it gets every usable core
+        plan = cpu_plan.plan_from_settings()
+        cpu_plan.apply(plan, server=True)
+        if options['threads']:
+            torch.set_num_threads(options['threads'])
+        self.stdout.write(plan.describe())
+        use_local_model()
+        detector = CariesDetector()
+        if not detector.available:
+            raise CommandError('Model not loaded; check MODEL_PATH / HF_MODEL_REPO')
+
+        # Exit cleanly on SIGTERM so the socket file is removed
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        self.stdout.write(f"Inference server listening on {socket_path} "
+                          f"({torch.get_num_threads()} threads)")
+        InferenceServer(detector, socket_path).serve_forever()
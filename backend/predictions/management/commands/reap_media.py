@@ -0,0 +1,60 @@
+"""
+Reclaim radiographs no scan references, and stale derived files.
+
+Walks MEDIA_ROOT/xrays/ and deletes every file without an XRayImage row
+(see cleanup.reap_media), then expired report PDFs and abandoned
+embedding-index generations. Safe to run while the site is live: recent
+files are skipped and deletions are rate limited. Meant for a daily cron
+or scheduler job.
+"""
+from django.core.management.base import BaseCommand
+
+from predictions.cleanup import reap_derivatives, reap_media
+
+
+class Command(BaseCommand):
+    help = 'Delete orphaned media files and stale derived files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='List what would be deleted without deleting it')
+        parser.add_argument('--grace', type=int, default=3600,
+                            help='Skip files modified within this many seconds (uploads in flight)')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='File names checked against the database per query')
+        parser.add_argument('--max-rate', type=float, default=50.0,
+                            help='Upper bound on files deleted per second (0: unlimited)')
+        parser.add_argument('--report-max-age', type=float, default=7.0,
+                            help='Delete cached report PDFs older than this many days')
+        parser.add_argument('--media-only', action='store_true',
+                            help='Skip report and embedding-index cleanup')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        log = self.stdout.write
+        verb = 'Would delete' if dry_run else 'Deleted'
+
+        stats = reap_media(
+            grace=options['grace'],
+            batch_size=options['batch_size'],
+            max_rate=options['max_rate'],
+            dry_run=dry_run,
+            log=log,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Scanned {stats['scanned']} media files: {verb.lower()} {stats['orphaned']} orphaned "
+            f"({stats['bytes'] / 2**20:.1f} MB)"
+        ))
+
+        if options['media_only']:
+            return
+        stats = reap_derivatives(
+            report_max_age=options['report_max_age'] * 86400,
+            grace=options['grace'],
+            dry_run=dry_run,
+            log=log,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {stats['reports']} cached report files, {stats['report_jobs']} finished report jobs "
+            f"and {stats['index_generations']} abandoned index generations ({stats['bytes'] / 2**20:.1f} MB)"
+        ))
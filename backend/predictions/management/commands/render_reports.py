@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from predictions.reports import claim_report_job, run_report_job
+
+
+class Command(BaseCommand):
+    help = 'Render queued PDF reports (use --loop to run as a worker)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new jobs')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds between polls when idle')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            job = claim_report_job()
+            if job is not None:
+                if run_report_job(job):
+                    self.stdout.write(f"Rendered {job.kind} report {job.object_id}")
+                else:
+                    self.stderr.write(f"Report {job.key} failed ({job.status}): {job.last_error}")
+                # Drain back-to-back while there is a backlog
+                continue
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,204 @@
+"""
+Re-score stored scans with the current model.
+
+Walks finished (completed or failed) Prediction rows whose base model
+version (before any '+mode' suffix) differs from the target in id order,
+decodes their radiographs in a process pool, scores them in batched
+full-resolution forwards and writes the results back with bulk_update.
+Rows of uploads still in flight and dentist reviews are left untouched.
+Tiled results are skipped: a whole-film pass would replace them with a
+lower-resolution answer. --upgrade-fast also re-scores current-model rows
+answered by the cascade's low-resolution first pass.
+
+Progress is checkpointed to a JSON file after every chunk, so an
+interrupted run resumes where it stopped. Each batch holds one inference
+admission slot (see admission.py) like a live upload would, so live
+traffic keeps the remaining slots; --max-rate caps throughput further.
+"""
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import torch
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image
+
+from predictions.admission import get_admission
+from predictions.cache import invalidate_scans
+from predictions.ml_inference import MODEL_VERSION, CariesDetector, build_transform
+from predictions.models import Prediction
+
+RESULT_FIELDS = [
+    'has_caries', 'confidence_score', 'confidence_no_caries', 'confidence_has_caries',
+    'predicted_class', 'model_version', 'embedding', 'embedding_version',
+]
+# Admission control sees the re-scorer as one more "user"
+ADMISSION_ID = 'rescore'
+# Inference modes the batched full pass cannot reproduce
+TILED_SUFFIX = '+tiled'
+FAST_SUFFIX = '+fast'
+
+_transform = None
+
+
+def _decode(path):
+    """Process-pool worker: file path -> preprocessed tensor, or None if unreadable."""
+    global _transform
+    if _transform is None:
+        # One intra-op thread per decode process; the pool provides the parallelism
+        torch.set_num_threads(1)
+        _transform = build_transform()
+    try:
+        with Image.open(path) as image:
+            return _transform(image.convert('RGB'))
+    except (OSError, ValueError):
+        return None
+
+
+def pending_predictions(version, upgrade_fast=False):
+    """Finished predictions to re-score for `version`, in id order."""
+    base = version.split('+')[0]
+    # Rows still pending/processing belong to an upload in flight; leave them to it
+    finished = Prediction.objects.filter(status__in=['completed', 'failed'])
+    stale = finished.exclude(model_version=base).exclude(model_version__startswith=f"{base}+")
+    if upgrade_fast:
+        stale = stale | finished.filter(model_version__startswith=f"{base}{FAST_SUFFIX}")
+    return stale.exclude(model_version__contains=TILED_SUFFIX).order_by('id')
+
+
+class Command(BaseCommand):
+    help = 'Re-score historical scans with the current model (resumable)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model-version', default=MODEL_VERSION,
+                            help='Version recorded on re-scored rows; rows of the same base version are skipped')
+        parser.add_argument('--upgrade-fast', action='store_true',
+                            help='Also re-score current-model rows answered by the cascade first pass')
+        parser.add_argument('--chunk-size', type=int, default=256,
+                            help='Rows read, decoded and written per step')
+        parser.add_argument('--batch-size', type=int, default=16,
+                            help='Images per forward pass')
+        parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                            help='Decode processes')
+        parser.add_argument('--threads', type=int, default=None,
+                            help='torch intra-op threads for the forward pass')
+        parser.add_argument('--max-rate', type=float, default=None,
+                            help='Upper bound on scans per second')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Stop after this many rows (for trial runs)')
+        parser.add_argument('--checkpoint', default=None,
+                            help='Progress file (default: in the temp directory, per model version)')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore an existing checkpoint')
+
+    def handle(self, *args, **options):
+        detector = CariesDetector()
+        if not detector.available:
+            raise CommandError('Model not loaded; check MODEL_PATH / HF_MODEL_REPO')
+        if options['threads']:
+            torch.set_num_threads(options['threads'])
+
+        version = options['model_version']
+        checkpoint_path = Path(options['checkpoint'] or Path(tempfile.gettempdir()) /
+                               f"tunzadent-rescore-{version}.json")
+        state = {'model_version': version, 'last_id': 0, 'rescored': 0, 'failed': 0}
+        if checkpoint_path.exists() and not options['restart']:
+            with open(checkpoint_path) as f:
+                saved = json.load(f)
+            if saved.get('model_version') == version:
+                state = saved
+                self.stdout.write(f"Resuming after prediction {state['last_id']} "
+                                  f"({state['rescored']} done, {state['failed']} failed)")
+
+        pending = pending_predictions(version, options['upgrade_fast'])
+        self.stdout.write(f"{pending.filter(id__gt=state['last_id']).count()} predictions to re-score")
+
+        started = time.monotonic()
+        processed = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            while options['limit'] is None or processed < options['limit']:
+                size = options['chunk_size']
+                if options['limit'] is not None:
+                    size = min(size, options['limit'] - processed)
+                # Keyset pagination: cheap at any depth and stable while rows are added
+                chunk = list(
+                    pending.filter(id__gt=state['last_id'])
+                    .select_related('xray')
+                    .only('id', 'xray', 'xray__image', 'xray__patient_id', 'xray__uploaded_by_id')[:size]
+                )
+                if not chunk:
+                    break
+
+                tensors = list(pool.map(_decode, [p.xray.image.path for p in chunk],
+                                        chunksize=max(1, len(chunk) // (options['workers'] * 4))))
+                done = self._score_and_save(detector, chunk, tensors, options['batch_size'], version)
+
+                processed += len(chunk)
+                state['last_id'] = chunk[-1].id
+                state['rescored'] += done
+                state['failed'] += len(chunk) - done
+                self._save_checkpoint(checkpoint_path, state)
+                close_old_connections()
+
+                elapsed = time.monotonic() - started
+                self.stdout.write(f"  up to prediction {state['last_id']}: {state['rescored']} re-scored, "
+                                  f"{state['failed']} failed, {processed / elapsed:.1f} scans/s")
+
+                if options['max_rate']:
+                    # Sleep off any lead over the target rate
+                    ahead = processed / options['max_rate'] - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Re-scored {state['rescored']} predictions ({state['failed']} unreadable) to {version}"
+        ))
+
+    def _score_and_save(self, detector, chunk, tensors, batch_size, version):
+        readable = [(p, t) for p, t in zip(chunk, tensors) if t is not None]
+        for prediction, tensor in zip(chunk, tensors):
+            if tensor is None:
+                self.stderr.write(f"  skipping prediction {prediction.id}: cannot read {prediction.xray.image.name}")
+
+        updated = []
+        for start in range(0, len(readable), batch_size):
+            batch = readable[start:start + batch_size]
+            batch_started = time.monotonic()
+            with get_admission().wait(ADMISSION_ID):
+                results = detector.score_batch(torch.stack([t for _, t in batch]))
+            per_image_ms = (time.monotonic() - batch_started) * 1000 / len(batch)
+
+            now = timezone.now()
+            for (prediction, _), result in zip(batch, results):
+                for field in RESULT_FIELDS:
+                    setattr(prediction, field, result[field])
+                prediction.model_version = version
+                prediction.processing_time_ms = round(per_image_ms, 2)
+                prediction.status = 'completed'
+                prediction.error_message = ''
+                # bulk_update() skips auto_now; report cache keys depend on it
+                prediction.updated_at = now
+                updated.append(prediction)
+
+        with transaction.atomic():
+            Prediction.objects.bulk_update(
+                updated,
+                RESULT_FIELDS + ['processing_time_ms', 'status', 'error_message', 'updated_at'],
+                batch_size=500
+            )
+            invalidate_scans(
+                (p.xray.id, p.xray.patient_id, p.xray.uploaded_by_id) for p in updated
+            )
+        return len(updated)
+
+    @staticmethod
+    def _save_checkpoint(path, state):
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({**state, 'updated_at': timezone.now().isoformat()}, f)
+        os.replace(tmp_path, path)
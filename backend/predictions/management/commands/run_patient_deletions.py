@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from predictions.cleanup import claim_bulk_delete, run_bulk_delete
+
+
+class Command(BaseCommand):
+    help = 'Run queued bulk patient deletions (use --loop to run as a worker)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new jobs')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between polls when idle')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            job = claim_bulk_delete()
+            if job is not None:
+                if run_bulk_delete(job):
+                    self.stdout.write(f"Deletion {job.id}: deleted {job.deleted} patient(s)")
+                else:
+                    self.stderr.write(f"Deletion {job.id} failed ({job.status}): {job.last_error}")
+                # Drain back-to-back while there is a backlog
+                continue
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
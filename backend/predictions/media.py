@@ -0,0 +1,168 @@
+"""
+Radiograph delivery through short-lived signed URLs.
+
+API responses never expose a bare /media/ path. signed_media_url() adds an
+expiry and an HMAC of (file name, expiry), so a browser <img> can fetch the
+file without the JWT while nobody can guess or reuse URLs. Expiries are
+rounded up to a window boundary: every URL for a file issued within the same
+window is identical, so the browser cache still gets hits. They are valid for
+between one and two windows.
+
+serve_media() checks the signature and conditional headers (ETag,
+Last-Modified), then hands the transfer to the front proxy with
+X-Accel-Redirect (nginx) or X-Sendfile (Apache, lighttpd) when MEDIA_ACCEL
+is set. Otherwise it streams the file itself, honouring single byte ranges.
+Uploaded files never change under the same name, so responses are cacheable
+for a long time, but only privately: they are patient data.
+"""
+import mimetypes
+import os
+import re
+import stat
+import time
+from urllib.parse import quote, urlencode
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseForbidden,
+    StreamingHttpResponse,
+)
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_http_methods
+
+SIGNATURE_SALT = 'tunzadent.media'
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+STREAM_CHUNK = 64 * 1024
+
+
+def _signature(name, expires):
+    return salted_hmac(SIGNATURE_SALT, f"{name}:{expires}").hexdigest()[:32]
+
+
+def signed_media_url(file_field, request=None):
+    """URL for a stored file, signed until the end of the next window; absolute if `request` is given."""
+    if not file_field:
+        return None
+    window = getattr(settings, 'MEDIA_URL_TTL', 3600)
+    expires = (int(time.time()) // window + 2) * window
+    url = f"{file_field.url}?{urlencode({'expires': expires, 'signature': _signature(file_field.name, expires)})}"
+    return request.build_absolute_uri(url) if request else url
+
+
+def _valid_signature(name, expires, signature):
+    if not expires or not expires.isdigit() or not signature:
+        return False
+    if int(expires) < time.time():
+        return False
+    return constant_time_compare(signature, _signature(name, expires))
+
+
+def _requested_range(request, size, etag, last_modified):
+    """
+    The inclusive (start, end) of a satisfiable single-range request,
+    None to send the whole file, or False if the range is unsatisfiable.
+    """
+    header = request.META.get('HTTP_RANGE', '').strip()
+    if not header:
+        return None
+    # If-Range: only send a part if the client's copy is still current
+    if_range = request.META.get('HTTP_IF_RANGE', '').strip()
+    if if_range and if_range != etag and parse_http_date_safe(if_range) != last_modified:
+        return None
+    match = RANGE_PATTERN.match(header)
+    if not match or match.groups() == ('', ''):
+        # Multiple or malformed ranges: the whole file is a valid answer
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if start >= size:
+            return False
+        if end < start:
+            return None
+    else:
+        # Suffix range: the last N bytes
+        if int(last) == 0:
+            return False
+        start, end = max(0, size - int(last)), size - 1
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(STREAM_CHUNK, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def _set_cache_headers(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = f"private, max-age={getattr(settings, 'MEDIA_CACHE_MAX_AGE', 31536000)}, immutable"
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+@require_http_methods(['GET', 'HEAD'])
+def serve_media(request, path):
+    if not _valid_signature(path, request.GET.get('expires'), request.GET.get('signature')):
+        return HttpResponseForbidden('Invalid or expired media link')
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        info = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404('File not found')
+    if not stat.S_ISREG(info.st_mode):
+        raise Http404('File not found')
+
+    size = info.st_size
+    etag = f'"{size:x}-{info.st_mtime_ns:x}"'
+    last_modified = int(info.st_mtime)
+    # 304 Not Modified / 412 Precondition Failed without touching the file
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return _set_cache_headers(response, etag, last_modified)
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    accel = getattr(settings, 'MEDIA_ACCEL', '')
+    byte_range = None if accel else _requested_range(request, size, etag, last_modified)
+
+    if byte_range is False:
+        # An error, not a representation: keep it out of caches
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{size}"
+        response['Cache-Control'] = 'no-store'
+        return response
+
+    if accel == 'nginx':
+        # nginx serves the bytes (including ranges) from an internal location
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/') + quote(path)
+    elif accel == 'sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+    elif request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type)
+        response['Content-Length'] = size
+    elif byte_range:
+        start, end = byte_range
+        response = StreamingHttpResponse(_read_range(full_path, start, end - start + 1),
+                                         status=206, content_type=content_type)
+        response['Content-Range'] = f"bytes {start}-{end}/{size}"
+        response['Content-Length'] = end - start + 1
+    else:
+        # wsgi.file_wrapper lets gunicorn use sendfile(2)
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    return _set_cache_headers(response, etag, last_modified)
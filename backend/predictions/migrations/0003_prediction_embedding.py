@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 02:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictions', '0002_alter_patient_table_alter_prediction_table_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prediction',
+            name='embedding',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
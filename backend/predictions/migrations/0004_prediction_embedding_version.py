@@ -0,0 +1,38 @@
+import re
+
+from django.db import migrations, models
+
+# model_version suffix of a depth-truncated cascade pass, e.g. +fast112d6
+FAST_DEPTH = re.compile(r'\+fast\d+d(\d+)')
+
+
+def embedding_version(model_version):
+    """Strip inference-mode suffixes (+tomeN, +tiled, +fastN) except a truncated depth."""
+    version = model_version.split('+')[0]
+    depth = FAST_DEPTH.search(model_version)
+    return f"{version}+d{depth.group(1)}" if depth else version
+
+
+def backfill(apps, schema_editor):
+    Prediction = apps.get_model('predictions', 'Prediction')
+    with_embedding = Prediction.objects.filter(embedding__isnull=False)
+    for model_version in with_embedding.values_list('model_version', flat=True).distinct():
+        with_embedding.filter(model_version=model_version).update(
+            embedding_version=embedding_version(model_version)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictions', '0003_prediction_embedding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prediction',
+            name='embedding_version',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-19 03:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('predictions', '0004_prediction_embedding_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientDeletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('patient_ids', models.JSONField()),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('deleted', models.PositiveIntegerField(default=0)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('lease_until', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('requested_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='patient_deletions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'patient_deletion',
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'lease_until'], name='patient_del_status_4d9ffd_idx')],
+            },
+        ),
+    ]
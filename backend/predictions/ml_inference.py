@@ -1,15 +1,49 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from torchvision import transforms
 from PIL import Image
 import timm
 import time
+import math
 import numpy as np
 from matplotlib import cm
 import io
 import base64
+import logging
+from contextlib import nullcontext
 from pathlib import Path
 from django.conf import settings
+from tunzadent.tracing import span
+from . import token_merging
+from .inference_server import InferenceClient
+
+MODEL_VERSION = 'MAE-ViT-v2.0'
+# Stored CLS embeddings depend on the weights, not on the inference mode:
+# token merging, bf16, tiling and a low-resolution first pass all yield
+# vectors that similar-case search can compare. Only a depth-truncated
+# first pass does not, and its embeddings get a '+d<depth>' suffix.
+EMBEDDING_VERSION = MODEL_VERSION
+# Log the cascade escalation rate every this many predictions
+CASCADE_LOG_EVERY = 100
+# Tiled inference: model input size, and films whose short side is under this
+# many tiles are not worth tiling
+TILE_SIZE = 224
+TILE_MIN_SCALE = 1.5
+IMAGE_MEAN = [0.485, 0.456, 0.406]
+IMAGE_STD = [0.229, 0.224, 0.225]
+
+# Set by the inference server process, which must load the model itself
+# even though INFERENCE_SERVER_SOCKET is configured
+_serve_locally = False
+
+
+def use_local_model():
+    """Make CariesDetector load the model in this process (for the inference server)."""
+    global _serve_locally
+    _serve_locally = True
+
+logger = logging.getLogger('tunzadent.inference')
 
 # ============================================
 # Model Download Helper
@@ -119,6 +153,8 @@ class CariesClassifier(nn.Module):
         )
 
         self.attention_maps = []
+        # Interpolated position embeddings per non-native patch grid
+        self._pos_embed_cache = {}
 
         try:
             self.load_state_dict(checkpoint['model_state_dict'], strict=False)
@@ -129,76 +165,272 @@ class CariesClassifier(nn.Module):
         self.eval()
 
     def _forward_with_attention(self, block, x):
+        """
+        Run `block` and also return the CLS query's attention row.
+
+        The block output uses the fused scaled-dot-product kernel, same as
+        the plain path; only the 1 x N CLS row is materialised on the side
+        instead of the full N x N matrix. Returns attention of shape
+        (B, heads, 1, N).
+        """
         shortcut = x
         x = block.norm1(x)
         B, N, C = x.shape
-        qkv = block.attn.qkv(x).reshape(B, N, 3, block.attn.num_heads, C // block.attn.num_heads).permute(2, 0, 3, 1, 4)
+        attn = block.attn
+        qkv = attn.qkv(x).reshape(B, N, 3, attn.num_heads, C // attn.num_heads).permute(2, 0, 3, 1, 4)
         q, k, v = qkv.unbind(0)
-        attn = (q @ k.transpose(-2, -1)) * block.attn.scale
-        attn = attn.softmax(dim=-1)
-        attn_weights = attn.detach()
-        attn = block.attn.attn_drop(attn)
-        x = (attn @ v).transpose(1, 2).reshape(B, N, C)
-        x = block.attn.proj(x)
-        x = block.attn.proj_drop(x)
+        q, k = attn.q_norm(q), attn.k_norm(k)
+        x = F.scaled_dot_product_attention(q, k, v)
+        cls_attn = ((q[:, :, :1] * attn.scale) @ k.transpose(-2, -1)).float().softmax(dim=-1)
+        x = x.transpose(1, 2).reshape(B, N, C)
+        x = attn.proj(x)
+        x = attn.proj_drop(x)
         x = shortcut + block.drop_path1(block.ls1(x))
         x = x + block.drop_path2(block.ls2(block.mlp(block.norm2(x))))
-        return x, attn_weights
+        return x, cls_attn.detach()
 
     def forward(self, x, return_attention=False):
+        cls_output, attention = self.forward_features(x, return_attention=return_attention)
+        logits = self.head(cls_output)
+
+        if return_attention:
+            return logits, attention
+
+        return logits
+
+    def _forward_merging(self, block, x, size, source, r, return_attention):
+        """
+        Run `block` with token merging: proportional attention over tokens
+        of `size` patches, then merge r token pairs before the MLP. The CLS
+        attention row, if requested, is mapped back onto the original
+        patches through `source`. Returns (x, size, source, attention).
+        """
+        shortcut = x
+        x = block.norm1(x)
+        B, N, C = x.shape
+        attn = block.attn
+        qkv = attn.qkv(x).reshape(B, N, 3, attn.num_heads, C // attn.num_heads).permute(2, 0, 3, 1, 4)
+        q, k, v = qkv.unbind(0)
+        q, k = attn.q_norm(q), attn.k_norm(k)
+        # A token standing for s patches gets log(s) extra attention logit
+        bias = size.log().transpose(1, 2)[:, None].to(q.dtype)
+        x = F.scaled_dot_product_attention(q, k, v, attn_mask=bias)
+        cls_attn = None
+        if return_attention:
+            cls_attn = ((q[:, :, :1] * attn.scale) @ k.transpose(-2, -1) + bias).float().softmax(dim=-1)
+            # Spread each merged token's attention evenly over its patches
+            cls_attn = (cls_attn / size.transpose(1, 2)[:, None]) @ source[:, None]
+        x = x.transpose(1, 2).reshape(B, N, C)
+        x = attn.proj_drop(attn.proj(x))
+        x = shortcut + block.drop_path1(block.ls1(x))
+        if r:
+            merge = token_merging.bipartite_soft_matching(k.mean(dim=1), r)
+            x, size, source = token_merging.merge_tokens(merge, x, size, source)
+        x = x + block.drop_path2(block.ls2(block.mlp(block.norm2(x))))
+        return x, size, source, cls_attn
+
+    def forward_features(self, x, return_attention=False, depth=None, merge_schedule=None):
+        """
+        Encoder only: return the normalised CLS vector (B, embed_dim) that
+        feeds the head, and the last block's CLS attention if requested.
+
+        Inputs need not be img_size square: the position embeddings are
+        interpolated to the patch grid. `depth` runs only the first N blocks.
+        `merge_schedule` (tokens to merge per block, see token_merging.py)
+        shrinks the sequence as it goes; attention is still reported over
+        the full patch grid.
+        """
         if return_attention:
             self.attention_maps = []
 
+        grid = (x.shape[-2] // self.patch_embed.patch_size, x.shape[-1] // self.patch_embed.patch_size)
         x = self.patch_embed(x)
-        x = x + self.pos_embed[:, 1:, :]
+        x = x + self._patch_pos_embed(grid)
         cls_tokens = self.cls_token.expand(x.shape[0], -1, -1)
         x = torch.cat((cls_tokens, x), dim=1)
 
-        for block_idx, blk in enumerate(self.encoder):
-            if return_attention and block_idx == len(self.encoder) - 1:
+        blocks = self.encoder[:depth] if depth else self.encoder
+        if merge_schedule:
+            size = x.new_ones(x.shape[0], x.shape[1], 1)
+            source = None
+            if return_attention:
+                source = torch.eye(x.shape[1], dtype=x.dtype, device=x.device).expand(x.shape[0], -1, -1)
+            for block_idx, blk in enumerate(blocks):
+                last = block_idx == len(blocks) - 1
+                x, size, source, attn = self._forward_merging(
+                    blk, x, size, source, merge_schedule[block_idx], return_attention and last
+                )
+                if attn is not None:
+                    self.attention_maps.append(attn)
+            blocks = []
+
+        for block_idx, blk in enumerate(blocks):
+            if return_attention and block_idx == len(blocks) - 1:
                 x, attn = self._forward_with_attention(blk, x)
                 self.attention_maps.append(attn)
             else:
                 x = blk(x)
 
         x = self.encoder_norm(x)
-        cls_output = x[:, 0]
-        logits = self.head(cls_output)
-
-        if return_attention:
-            attention = self.attention_maps[-1] if self.attention_maps else None
-            return logits, attention
-
-        return logits
+        attention = None
+        if return_attention and self.attention_maps:
+            attention = self.attention_maps[-1]
+        return x[:, 0], attention
+
+    def _patch_pos_embed(self, grid):
+        """Patch position embeddings for a (rows, cols) patch grid."""
+        pos_embed = self.pos_embed[:, 1:, :]
+        side = int(math.sqrt(pos_embed.shape[1]))
+        if grid == (side, side):
+            return pos_embed
+        cached = self._pos_embed_cache.get(grid)
+        if cached is None or cached.device != pos_embed.device:
+            # Bicubic resampling of the learned 2-D table, as in timm's resample_abs_pos_embed
+            table = pos_embed.detach().reshape(1, side, side, -1).permute(0, 3, 1, 2)
+            table = F.interpolate(table, size=grid, mode='bicubic', align_corners=False)
+            cached = table.permute(0, 2, 3, 1).reshape(1, grid[0] * grid[1], -1)
+            self._pos_embed_cache[grid] = cached
+        return cached
 
 
 # ============================================
 # Helper Functions
 # ============================================
 
-def generate_attention_heatmap(model, image_tensor, device):
-    model.eval()
-    with torch.no_grad():
-        logits, attention = model(image_tensor, return_attention=True)
+def cpu_supports_bf16():
+    """Whether this CPU has native bf16 matrix instructions (AVX-512 BF16 or AMX)."""
+    try:
+        with open('/proc/cpuinfo') as f:
+            flags = f.read()
+        return 'avx512_bf16' in flags or 'amx_bf16' in flags
+    except OSError:
+        # Not Linux: fall back to oneDNN's own check
+        try:
+            return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+        except (AttributeError, RuntimeError):
+            return False
 
-    if attention is None:
-        return None
 
-    attention = attention[0]
-    attention = attention.mean(dim=0)
-    cls_attention = attention[0, 1:]
-    grid_size = int(np.sqrt(cls_attention.shape[0]))
-    attention_map = cls_attention.reshape(grid_size, grid_size).cpu().numpy()
+def cascade_accepts(conf_no_caries, conf_has_caries, accept_caries=0.90, accept_healthy=0.85):
+    """
+    Whether a first-pass result is confident enough to skip the full pass.
+    Defaults match the top tiers of generate_recommendations, so an accepted
+    fast result gets the same recommendation the full pass most likely would.
+    """
+    return conf_has_caries >= accept_caries or conf_no_caries >= accept_healthy
+
+
+def build_transform(img_size=224):
+    """Preprocessing applied to every radiograph before the forward pass."""
+    return transforms.Compose([
+        transforms.Resize((img_size, img_size)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=IMAGE_MEAN, std=IMAGE_STD)
+    ])
+
+
+def _tile_starts(length, tile, stride):
+    if length <= tile:
+        return [0]
+    # Regular steps, plus a last tile flush with the edge
+    return list(range(0, length - tile, stride)) + [length - tile]
+
+
+def tile_layout(width, height, tile=TILE_SIZE, overlap=0.25, short_side=448, max_tiles=24):
+    """
+    Plan tiled inference for a width x height film. The film is scaled so
+    its short side is `short_side` (never more than the original, never less
+    than one tile) and covered with tile x tile windows overlapping by the
+    `overlap` fraction. If that takes more than `max_tiles` tiles the scale
+    is lowered until it fits or the short side is down to one tile.
+    Returns ((scaled_width, scaled_height), [(x0, y0, x1, y1), ...]).
+    """
+    stride = max(1, int(round(tile * (1 - overlap))))
+    short = max(tile, min(short_side, width, height))
+    while True:
+        scale = short / min(width, height)
+        size = (max(tile, round(width * scale)), max(tile, round(height * scale)))
+        boxes = [(x, y, x + tile, y + tile)
+                 for y in _tile_starts(size[1], tile, stride)
+                 for x in _tile_starts(size[0], tile, stride)]
+        if len(boxes) <= max_tiles or short == tile:
+            return size, boxes
+        short = max(tile, int(short * 0.85))
+
+
+def cut_tiles(image, size, boxes):
+    """Resize a PIL film to `size` and stack its normalised tiles as one batch."""
+    film = transforms.functional.to_tensor(image.resize(size, Image.BILINEAR))
+    film = transforms.functional.normalize(film, IMAGE_MEAN, IMAGE_STD)
+    return torch.stack([film[:, y0:y1, x0:x1] for x0, y0, x1, y1 in boxes])
+
+
+def aggregate_tile_logits(logits, mode='max'):
+    """
+    Study-level class probabilities from per-tile logits (tiles, 2).
+    'max' takes the tile most likely to show caries, since a lesion is
+    usually visible in only one or two tiles; 'mean' softmaxes the mean
+    logits.
+    """
+    if mode == 'mean':
+        return torch.softmax(logits.mean(dim=0), dim=0)
+    probs = torch.softmax(logits, dim=1)
+    return probs[probs[:, 1].argmax()]
+
+
+def stitch_attention(attention, boxes, size):
+    """
+    Paste per-tile CLS attention (tiles, heads, 1, 1 + patches) onto a
+    film of `size` (width, height), averaging where tiles overlap. Each
+    tile's attention sums to one, so tiles stay comparable after stitching.
+    Returns a (height, width) array.
+    """
+    maps = attention.mean(dim=1)[:, 0, 1:]
+    grid = int(math.sqrt(maps.shape[-1]))
+    tile = boxes[0][2] - boxes[0][0]
+    maps = F.interpolate(maps.reshape(-1, 1, grid, grid).float().cpu(), size=(tile, tile),
+                         mode='bilinear', align_corners=False)[:, 0]
+    total = torch.zeros(size[1], size[0])
+    count = torch.zeros(size[1], size[0])
+    for tile_map, (x0, y0, x1, y1) in zip(maps, boxes):
+        total[y0:y1, x0:x1] += tile_map
+        count[y0:y1, x0:x1] += 1
+    return (total / count.clamp(min=1)).numpy()
+
+
+def render_heatmap(attention_map, size):
+    """Colour a 2-D attention array, resized to `size` (width, height), as a base64 PNG."""
     attention_map = (attention_map - attention_map.min()) / (attention_map.max() - attention_map.min() + 1e-8)
     attention_pil = Image.fromarray((attention_map * 255).astype(np.uint8))
-    attention_pil = attention_pil.resize((224, 224), Image.BILINEAR)
+    attention_pil = attention_pil.resize(size, Image.BILINEAR)
     attention_array = np.array(attention_pil) / 255.0
     colored_heatmap = cm.jet(attention_array)[:, :, :3]
     heatmap_pil = Image.fromarray((colored_heatmap * 255).astype(np.uint8))
     buffer = io.BytesIO()
     heatmap_pil.save(buffer, format='PNG')
-    heatmap_base64 = base64.b64encode(buffer.getvalue()).decode()
-    return heatmap_base64
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def generate_attention_heatmap(model, image_tensor, device, attention=None):
+    """
+    Render the last block's CLS attention as a base64 PNG heatmap.
+    Pass `attention` from an earlier return_attention forward to skip
+    running the model again.
+    """
+    if attention is None:
+        model.eval()
+        with torch.no_grad():
+            logits, attention = model(image_tensor, return_attention=True)
+
+    if attention is None:
+        return None
+
+    attention = attention[0]
+    attention = attention.mean(dim=0)
+    cls_attention = attention[0, 1:]
+    grid_size = int(np.sqrt(cls_attention.shape[0]))
+    attention_map = cls_attention.reshape(grid_size, grid_size).cpu().numpy()
+    return render_heatmap(attention_map, (224, 224))
 
 
 def generate_recommendations(prediction_data):
@@ -337,9 +569,15 @@ class CariesDetector:
 
     _instance = None
     _model = None
+    _client = None  # InferenceClient when the model lives in the inference server
     _device = None
     _transform = None
     _available = False  # Whether model loaded successfully
+    _cascade = False
+    _tiling = False
+    _bf16 = False
+    _merge_schedule = None
+    _full_version = MODEL_VERSION
 
     def __new__(cls):
         if cls._instance is None:
@@ -349,9 +587,18 @@ class CariesDetector:
 
     def _initialize(self):
         """Initialize model and transforms, downloading from HF if needed."""
+        socket_path = getattr(settings, 'INFERENCE_SERVER_SOCKET', '')
+        if socket_path and not _serve_locally:
+            self._device = torch.device('cpu')
+            self._client = InferenceClient(
+                socket_path, timeout=getattr(settings, 'INFERENCE_SERVER_TIMEOUT', 60.0)
+            )
+            self._connect_server(getattr(settings, 'INFERENCE_SERVER_WAIT', 30.0))
+            return
+
         self._device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
-        model_path = Path(settings.BASE_DIR) / 'ml_models' / 'best_caries_classifier_v2.pth'
+        model_path = Path(settings.MODEL_PATH)
 
         # Try to download if not present or is a git-lfs pointer stub
         available = download_model_if_needed(model_path)
@@ -373,20 +620,190 @@ class CariesDetector:
             self._available = False
             return
 
-        self._transform = transforms.Compose([
-            transforms.Resize((224, 224)),
-            transforms.ToTensor(),
-            transforms.Normalize(
-                mean=[0.485, 0.456, 0.406],
-                std=[0.229, 0.224, 0.225]
+        self._configure_precision()
+        self._configure(len(self._model.encoder))
+
+    def _connect_server(self, wait):
+        """Client mode: reach the inference server and configure from its model."""
+        try:
+            info = self._client.wait(wait)
+        except OSError as e:
+            if wait:
+                print(f"ERROR: inference server at {self._client.socket_path} unreachable: {e}")
+            self._available = False
+            return
+        # Preprocessing and heatmaps only; the server has the cores for the model
+        torch.set_num_threads(1)
+        self._configure(info['depth'])
+        self._available = True
+        print(f"Using inference server at {self._client.socket_path} "
+              f"({'bf16' if info['bf16'] else 'fp32'})")
+
+    def _configure(self, depth):
+        """Inference options from settings, for a model with `depth` blocks."""
+        self._transform = build_transform()
+
+        # Optional ToMe token merging on the full-resolution pass
+        self._merge_schedule = token_merging.parse_schedule(
+            getattr(settings, 'INFERENCE_TOKEN_MERGE', ''), depth
+        )
+        self._full_version = MODEL_VERSION
+        if self._merge_schedule:
+            self._full_version += f"+tome{sum(self._merge_schedule)}"
+            print(f"Token merging enabled: {self._merge_schedule}")
+
+        # Large films: overlapping tiles in one batch instead of one squashed square
+        self._tiling = getattr(settings, 'INFERENCE_TILING', False)
+        if self._tiling:
+            self._tile_options = {
+                'overlap': getattr(settings, 'TILE_OVERLAP', 0.25),
+                'short_side': getattr(settings, 'TILE_SHORT_SIDE', 448),
+                'max_tiles': getattr(settings, 'TILE_MAX', 24),
+            }
+            self._tile_aggregation = getattr(settings, 'TILE_AGGREGATION', 'max')
+            self._tiled_version = self._full_version + '+tiled'
+            print(f"Tiled inference enabled: {self._tile_options}, {self._tile_aggregation} aggregation")
+
+        # Two-stage cascade: a low-resolution pass answers confident cases,
+        # only uncertain films get the full-resolution pass
+        self._cascade = getattr(settings, 'INFERENCE_CASCADE', False)
+        if self._cascade:
+            self._fast_size = getattr(settings, 'CASCADE_FAST_SIZE', 112)
+            self._fast_depth = getattr(settings, 'CASCADE_FAST_DEPTH', 0) or None
+            self._fast_transform = build_transform(self._fast_size)
+            self._accept_caries = getattr(settings, 'CASCADE_ACCEPT_CARIES', 0.90)
+            self._accept_healthy = getattr(settings, 'CASCADE_ACCEPT_HEALTHY', 0.85)
+            self._fast_version = f"{MODEL_VERSION}+fast{self._fast_size}"
+            self._fast_embedding_version = EMBEDDING_VERSION
+            if self._fast_depth:
+                self._fast_version += f"d{self._fast_depth}"
+                self._fast_embedding_version += f"+d{self._fast_depth}"
+            self._cascade_counts = {'fast': 0, 'full': 0}
+            print(f"Inference cascade enabled: {self._fast_size}px first pass "
+                  f"(accept caries >= {self._accept_caries}, healthy >= {self._accept_healthy})")
+
+    @property
+    def available(self):
+        if not self._available and self._client is not None:
+            # The server may have come up since this worker started
+            self._connect_server(0)
+        return self._available
+
+    def _forward(self, images, return_attention=False, **kwargs):
+        """
+        Encoder and head under the configured precision. Outputs are always
+        returned as fp32 (features, attention, logits), so the softmax and
+        stored confidences are computed in full precision.
+        """
+        if self._client is not None:
+            return self._client.forward(images, return_attention=return_attention, **kwargs)
+        precision = torch.autocast('cpu', dtype=torch.bfloat16) if self._bf16 else nullcontext()
+        with torch.no_grad(), precision:
+            features, attention = self._model.forward_features(
+                images, return_attention=return_attention, **kwargs
             )
-        ])
+            logits = self._model.head(features)
+        if attention is not None:
+            attention = attention.float()
+        return features.float(), attention, logits.float()
+
+    def _configure_precision(self):
+        """
+        Pick fp32 or bf16 from INFERENCE_PRECISION ('auto', 'bf16', 'fp32').
+        'auto' uses bf16 only on CPUs with native bf16 matmul and only if a
+        startup probe shows it is actually faster.
+        """
+        mode = str(getattr(settings, 'INFERENCE_PRECISION', 'auto')).lower()
+        if mode == 'fp32' or self._device.type != 'cpu':
+            return
+        native = cpu_supports_bf16()
+        if mode == 'auto' and not native:
+            print("bf16 inference: no native CPU support, using fp32")
+            return
+
+        example = torch.randn(1, 3, 224, 224, device=self._device)
+        fp32_ms = self._time_forward(example)
+        self._bf16 = True
+        bf16_ms = self._time_forward(example)
+        print(f"bf16 inference: {bf16_ms:.0f} ms vs fp32 {fp32_ms:.0f} ms per image "
+              f"({fp32_ms / bf16_ms:.2f}x){'' if native else ', emulated'}")
+        if mode == 'auto' and bf16_ms >= fp32_ms:
+            print("bf16 inference: no gain, using fp32")
+            self._bf16 = False
+
+    def _time_forward(self, example, repeat=3):
+        self._forward(example)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            self._forward(example)
+        return (time.perf_counter() - start) * 1000 / repeat
+
+    def score_batch(self, images):
+        """
+        Classify a batch of preprocessed images (tensor of shape (B, 3, H, W),
+        as produced by build_transform) in one forward pass. Returns one dict
+        per image with the fields stored on a Prediction. No heatmaps.
+        """
+        features, _, logits = self._forward(images.to(self._device))
+        probs = torch.softmax(logits, dim=1).cpu()
+        embeddings = features.cpu().numpy().astype(np.float16)
+        results = []
+        for row, embedding in zip(probs.tolist(), embeddings):
+            predicted_class = int(row[1] > row[0])
+            results.append({
+                'has_caries': predicted_class == 1,
+                'confidence_score': max(row),
+                'confidence_no_caries': row[0],
+                'confidence_has_caries': row[1],
+                'predicted_class': predicted_class,
+                'model_version': MODEL_VERSION,
+                'embedding': embedding.tobytes(),
+                'embedding_version': EMBEDDING_VERSION,
+            })
+        return results
+
+    def _predict_tiled(self, image, size, boxes, return_attention):
+        """
+        Score all tiles of a film in one forward pass. Returns study-level
+        (features (1, D), probabilities (2,), heatmap or None, per-tile info).
+        """
+        with span('preprocess'):
+            tiles = cut_tiles(image, size, boxes).to(self._device)
+        with span('inference'):
+            features, attention, logits = self._forward(
+                tiles, return_attention=return_attention, merge_schedule=self._merge_schedule
+            )
+            probs = aggregate_tile_logits(logits, self._tile_aggregation)
+
+        heatmap = None
+        if return_attention and attention is not None:
+            with span('heatmap'):
+                heatmap = render_heatmap(stitch_attention(attention, boxes, size), size)
+
+        # Tile boxes in the uploaded film's pixel coordinates
+        scale_x, scale_y = image.size[0] / size[0], image.size[1] / size[1]
+        tile_caries = torch.softmax(logits, dim=1)[:, 1].tolist()
+        tiles_info = [
+            {'box': [round(x0 * scale_x), round(y0 * scale_y), round(x1 * scale_x), round(y1 * scale_y)],
+             'confidence_has_caries': p}
+            for (x0, y0, x1, y1), p in zip(boxes, tile_caries)
+        ]
+        # Study embedding: mean of the tile embeddings
+        return features.mean(dim=0, keepdim=True), probs, heatmap, tiles_info
+
+    def _record_stage(self, stage):
+        counts = self._cascade_counts
+        counts[stage] += 1
+        total = counts['fast'] + counts['full']
+        if total % CASCADE_LOG_EVERY == 0:
+            logger.info(f"Inference cascade: {total} predictions in this worker, "
+                        f"escalation rate {counts['full'] / total:.1%}")
 
     def predict(self, image_path, return_attention=False, return_recommendations=True):
         """
         Predict caries from X-ray image with optional attention and recommendations.
         """
-        if not self._available:
+        if not self.available:
             return {
                 'success': False,
                 'error': 'Model not loaded. Please check server configuration.'
@@ -395,18 +812,48 @@ class CariesDetector:
         start_time = time.time()
 
         try:
-            image = Image.open(image_path).convert('RGB')
-            img_tensor = self._transform(image).unsqueeze(0).to(self._device)
-
-            with torch.no_grad():
-                if return_attention:
-                    logits, attention = self._model(img_tensor, return_attention=True)
-                else:
-                    logits = self._model(img_tensor, return_attention=False)
-                    attention = None
-
-                probs = torch.softmax(logits, dim=1)[0]
-                predicted_class = logits.argmax(dim=1).item()
+            with span('preprocess'):
+                image = Image.open(image_path).convert('RGB')
+
+            stage, model_version = 'full', self._full_version
+            embedding_version = EMBEDDING_VERSION
+            escalate = True
+            heatmap, tiles_info = None, None
+            if self._tiling and min(image.size) >= TILE_MIN_SCALE * TILE_SIZE:
+                size, boxes = tile_layout(*image.size, **self._tile_options)
+                features, probs, heatmap, tiles_info = self._predict_tiled(
+                    image, size, boxes, return_attention
+                )
+                stage, model_version = 'tiled', self._tiled_version
+                escalate = False
+            elif self._cascade:
+                with span('preprocess'):
+                    img_tensor = self._fast_transform(image).unsqueeze(0).to(self._device)
+                with span('inference_fast'):
+                    features, attention, logits = self._forward(
+                        img_tensor, return_attention=return_attention, depth=self._fast_depth
+                    )
+                    probs = torch.softmax(logits, dim=1)[0]
+                escalate = not cascade_accepts(
+                    probs[0].item(), probs[1].item(), self._accept_caries, self._accept_healthy
+                )
+                if not escalate:
+                    stage, model_version = 'fast', self._fast_version
+                    embedding_version = self._fast_embedding_version
+
+            if escalate:
+                with span('preprocess'):
+                    img_tensor = self._transform(image).unsqueeze(0).to(self._device)
+                with span('inference'):
+                    features, attention, logits = self._forward(
+                        img_tensor, return_attention=return_attention,
+                        merge_schedule=self._merge_schedule
+                    )
+                    probs = torch.softmax(logits, dim=1)[0]
+
+            predicted_class = probs.argmax().item()
+            if self._cascade and stage != 'tiled':
+                self._record_stage(stage)
 
             conf_no_caries = probs[0].item()
             conf_has_caries = probs[1].item()
@@ -419,12 +866,23 @@ class CariesDetector:
                 'confidence_has_caries': conf_has_caries,
                 'predicted_class': predicted_class,
                 'processing_time_ms': round(processing_time, 2),
-                'model_version': 'MAE-ViT-v2.0',
+                'model_version': model_version,
+                'inference_stage': stage,
+                # CLS embedding for similar-case search (see embeddings.py)
+                'embedding': features[0].cpu().numpy().astype(np.float16).tobytes(),
+                'embedding_version': embedding_version,
                 'success': True
             }
 
-            if return_attention and attention is not None:
-                heatmap = generate_attention_heatmap(self._model, img_tensor, self._device)
+            if tiles_info is not None:
+                result['tiles'] = tiles_info
+                if heatmap is not None:
+                    result['attention_heatmap'] = heatmap
+            elif return_attention and attention is not None:
+                with span('heatmap'):
+                    heatmap = generate_attention_heatmap(
+                        self._model, img_tensor, self._device, attention=attention
+                    )
                 result['attention_heatmap'] = heatmap
 
             if return_recommendations:
@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 class Patient(models.Model):
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -57,6 +58,10 @@ class Prediction(models.Model):
         ('failed', 'Failed')
     ], default='pending')
     error_message = models.TextField(blank=True)
+    # Encoder CLS vector as float16 bytes, for similar-case search
+    embedding = models.BinaryField(null=True, blank=True, editable=False)
+    # Embeddings are only comparable within one version (see ml_inference.EMBEDDING_VERSION)
+    embedding_version = models.CharField(max_length=50, blank=True)
     
     # Dentist review
     reviewed = models.BooleanField(default=False)
@@ -79,4 +84,69 @@ class Prediction(models.Model):
         ordering = ['-created_at']
     
     def __str__(self):
-        return f"Prediction for {self.xray.patient.patient_id} - {'Caries' if self.has_caries else 'No Caries'}"
\ No newline at end of file
+        return f"Prediction for {self.xray.patient.patient_id} - {'Caries' if self.has_caries else 'No Caries'}"
+
+
+class PatientDeletion(models.Model):
+    """Bulk patient deletion job; run by the run_patient_deletions worker, never inline"""
+    requested_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='patient_deletions'
+    )
+    patient_ids = models.JSONField()
+    status = models.CharField(max_length=10, choices=[
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed')
+    ], default='queued')
+    deleted = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    # A claimed job is hidden from other workers until then; if its worker
+    # dies, the job becomes due again and resumes with what is left
+    lease_until = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'patient_deletion'
+        ordering = ['created_at']
+        indexes = [models.Index(fields=['status', 'lease_until'])]
+
+    def __str__(self):
+        return f"Deletion of {len(self.patient_ids)} patients ({self.status})"
+
+
+class ReportJob(models.Model):
+    """PDF report render; run by the render_reports worker, never in a web process"""
+    # One row per report content digest (reports.scan_report_key/patient_report_key),
+    # so the unique constraint decides which request queues a render
+    key = models.CharField(max_length=64, unique=True)
+    kind = models.CharField(max_length=10, choices=[
+        ('scan', 'Scan'),
+        ('patient', 'Patient')
+    ])
+    object_id = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=[
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed')
+    ], default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    # A claimed job is hidden from other workers until then; if its worker
+    # dies, the job becomes due again
+    lease_until = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'report_job'
+        ordering = ['created_at']
+        indexes = [models.Index(fields=['status', 'lease_until'])]
+
+    def __str__(self):
+        return f"{self.kind} report {self.object_id} ({self.status})"
@@ -0,0 +1,329 @@
+"""
+Clinical PDF reports, rendered by a background worker and cached on disk.
+
+A report's file name is a digest of everything it shows (prediction,
+model version, review state, patient details), so a cached PDF is reused
+until one of those changes and doubles as the HTTP ETag. Requests never
+render: they either stream the cached file or queue a ReportJob row and
+answer 202.
+
+The render_reports worker claims jobs with a lease, like outbound email
+(accounts/emails.py) and bulk patient deletion (cleanup.py). The report
+key is unique, so however many web workers are polled, one job is queued
+per report; if a render worker dies, the lease runs out and another one
+picks the job up. The scan report's attention heatmap needs a forward
+pass. That pass takes an inference admission slot (admission.py) like an
+upload does, waiting for one rather than competing with live requests.
+"""
+import base64
+import hashlib
+import io
+import logging
+import os
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.html import escape
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import cm
+from reportlab.platypus import (
+    Image as ReportImage,
+    Paragraph,
+    SimpleDocTemplate,
+    Spacer,
+    Table,
+    TableStyle,
+)
+
+from .admission import get_admission
+from .ml_inference import CariesDetector, generate_recommendations
+from .models import Patient, Prediction, ReportJob
+
+logger = logging.getLogger('tunzadent.reports')
+
+# Admission control sees report rendering as one more "user"
+ADMISSION_ID = 'reports'
+MAX_ATTEMPTS = 3
+BASE_RETRY_SECONDS = 10
+LEASE_SECONDS = 600
+
+
+def report_dir():
+    path = Path(getattr(settings, 'REPORT_CACHE_DIR',
+                        Path(tempfile.gettempdir()) / 'tunzadent-reports'))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _digest(*parts):
+    return hashlib.sha256('|'.join(str(p) for p in parts).encode()).hexdigest()[:32]
+
+
+def scan_report_key(prediction):
+    xray = prediction.xray
+    patient = xray.patient
+    return 'scan-' + _digest(
+        prediction.id, prediction.model_version, prediction.updated_at.isoformat(),
+        xray.id, xray.image.name, xray.notes, patient.updated_at.isoformat(),
+    )
+
+
+def patient_report_key(patient):
+    rows = list(
+        patient.xrays.order_by('id').values_list(
+            'id', 'prediction__id', 'prediction__model_version', 'prediction__updated_at'
+        )
+    )
+    return 'patient-' + _digest(patient.id, patient.updated_at.isoformat(), rows)
+
+
+def request_report(key, kind, object_id):
+    """
+    Return (path, None) if the report is cached, otherwise make sure a
+    ReportJob for `key` is queued and return (None, error_or_None).
+    """
+    path = report_dir() / f"{key}.pdf"
+    if path.exists():
+        return path, None
+
+    try:
+        job, created = ReportJob.objects.get_or_create(
+            key=key, defaults={'kind': kind, 'object_id': object_id}
+        )
+    except IntegrityError:
+        # Another worker queued it between our lookup and insert
+        return None, None
+    if created or job.status in ('queued', 'running'):
+        return None, None
+
+    # Failed, or completed but the PDF has since been reaped: queue it again.
+    # Only the request that flips the row reports the failure.
+    requeued = ReportJob.objects.filter(id=job.id, status=job.status).update(
+        status='queued', attempts=0, lease_until=timezone.now(), finished_at=None
+    )
+    if requeued and job.status == 'failed':
+        return None, job.last_error or 'Report rendering failed'
+    return None, None
+
+
+def claim_report_job():
+    """Lease the oldest due report job to this worker; None if there is none."""
+    now = timezone.now()
+    with transaction.atomic():
+        job = (
+            ReportJob.objects.select_for_update(skip_locked=True)
+            .filter(status__in=['queued', 'running'], lease_until__lte=now)
+            .order_by('created_at').first()
+        )
+        if job is None:
+            return None
+        job.status = 'running'
+        job.attempts += 1
+        job.lease_until = now + timedelta(seconds=LEASE_SECONDS)
+        job.save(update_fields=['status', 'attempts', 'lease_until'])
+    return job
+
+
+def run_report_job(job):
+    """Render the job's PDF into the report cache. Returns True on success."""
+    path = report_dir() / f"{job.key}.pdf"
+    try:
+        buffer = RENDERERS[job.kind](job.object_id)
+        # Write then rename so readers never see a half-written PDF
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(buffer)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.exception(f"Report rendering failed for {job.key} (attempt {job.attempts})")
+        job.last_error = str(e)[:1000]
+        # A deleted scan or patient won't come back; don't retry it
+        if job.attempts >= MAX_ATTEMPTS or isinstance(e, ObjectDoesNotExist):
+            job.status = 'failed'
+            job.finished_at = timezone.now()
+        else:
+            job.status = 'queued'
+            delay = BASE_RETRY_SECONDS * 2 ** (job.attempts - 1)
+            job.lease_until = timezone.now() + timedelta(seconds=delay)
+        job.save(update_fields=['last_error', 'status', 'finished_at', 'lease_until'])
+        return False
+
+    job.status = 'completed'
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'finished_at'])
+    return True
+
+
+# ============================================
+# Rendering
+# ============================================
+
+def _styles():
+    styles = getSampleStyleSheet()
+    return styles['Title'], styles['Heading2'], styles['BodyText']
+
+
+def _key_value_table(rows):
+    table = Table(rows, colWidths=[5 * cm, 11 * cm])
+    table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
+    ]))
+    return table
+
+
+def _review_status(prediction):
+    if not prediction.reviewed:
+        return 'Not yet reviewed'
+    verdict = 'Caries' if prediction.dentist_diagnosis else 'No caries'
+    reviewer = prediction.reviewed_by.get_full_name() if prediction.reviewed_by else 'Unknown'
+    reviewed_at = prediction.reviewed_at.strftime('%Y-%m-%d %H:%M') if prediction.reviewed_at else ''
+    return f"Reviewed by {reviewer} on {reviewed_at}: {verdict}"
+
+
+def _header(story, subtitle, patient):
+    title, heading, body = _styles()
+    story.append(Paragraph('Tunzadent', title))
+    story.append(Paragraph(subtitle, heading))
+    story.append(_key_value_table([
+        ['Patient', f"{patient.first_name} {patient.last_name}"],
+        ['Patient ID', patient.patient_id],
+        ['Date of birth', patient.date_of_birth.isoformat() if patient.date_of_birth else 'N/A'],
+        ['Gender', patient.get_gender_display()],
+        ['Report generated', timezone.now().strftime('%Y-%m-%d %H:%M UTC')],
+    ]))
+    story.append(Spacer(1, 0.5 * cm))
+
+
+def render_scan_report(prediction_id):
+    """Build the PDF for one scan and return its bytes."""
+    prediction = Prediction.objects.select_related(
+        'xray__patient', 'reviewed_by'
+    ).get(id=prediction_id)
+    xray = prediction.xray
+    _, heading, body = _styles()
+
+    story = []
+    _header(story, 'Caries Detection Report', xray.patient)
+
+    story.append(Paragraph('AI Prediction', heading))
+    story.append(_key_value_table([
+        ['Scan', f"#{xray.id} ({xray.image_type}) {xray.tooth_region}"],
+        ['Uploaded', xray.uploaded_at.strftime('%Y-%m-%d %H:%M')],
+        ['Result', 'Caries detected' if prediction.has_caries else 'No caries detected'],
+        ['Confidence', f"{prediction.confidence_score * 100:.1f}%"],
+        ['Model version', prediction.model_version],
+        ['Dentist review', _review_status(prediction)],
+    ]))
+    if prediction.dentist_notes:
+        story.append(Paragraph(f"<b>Dentist notes:</b> {escape(prediction.dentist_notes)}", body))
+    story.append(Spacer(1, 0.5 * cm))
+
+    # Radiograph next to the attention heatmap
+    images = [ReportImage(xray.image.path, width=7.5 * cm, height=7.5 * cm, kind='proportional')]
+    with get_admission().wait(ADMISSION_ID):
+        result = CariesDetector().predict(
+            xray.image.path, return_attention=True, return_recommendations=False
+        )
+    heatmap = result.get('attention_heatmap') if result.get('success') else None
+    if heatmap:
+        images.append(ReportImage(
+            io.BytesIO(base64.b64decode(heatmap)), width=7.5 * cm, height=7.5 * cm,
+            kind='proportional'
+        ))
+    story.append(Table([images]))
+    story.append(Spacer(1, 0.5 * cm))
+
+    recommendations = generate_recommendations({
+        'has_caries': prediction.has_caries,
+        'confidence_score': prediction.confidence_score,
+    })
+    story.append(Paragraph(f"Recommendations: {recommendations['severity']}", heading))
+    story.append(Paragraph(f"<b>Urgency:</b> {recommendations['urgency_level']}", body))
+    for title, items in (('Clinical actions', recommendations['clinical_actions']),
+                         ('Patient advice', recommendations['patient_advice'])):
+        story.append(Paragraph(f"<b>{title}</b>", body))
+        for item in items:
+            story.append(Paragraph(f"&bull; {item}", body))
+    story.append(Paragraph(f"<b>Follow-up:</b> {recommendations['follow_up']}", body))
+    story.append(Spacer(1, 0.5 * cm))
+    story.append(Paragraph(f"<i>{recommendations['disclaimer']}</i>", body))
+
+    buffer = io.BytesIO()
+    SimpleDocTemplate(buffer, pagesize=A4, title=f"Scan {xray.id} report").build(story)
+    return buffer.getvalue()
+
+
+def render_patient_report(patient_id):
+    """Build the scan-history PDF for one patient and return its bytes."""
+    patient = Patient.objects.get(id=patient_id)
+    _, heading, body = _styles()
+
+    story = []
+    _header(story, 'Patient Scan History', patient)
+
+    predictions = list(
+        Prediction.objects.filter(xray__patient=patient)
+        .select_related('xray', 'reviewed_by')
+        .order_by('-xray__uploaded_at')
+    )
+    completed = [p for p in predictions if p.status == 'completed']
+    with_caries = sum(1 for p in completed if p.has_caries)
+    story.append(Paragraph('Summary', heading))
+    story.append(_key_value_table([
+        ['Total scans', str(len(predictions))],
+        ['Caries detected', f"{with_caries} of {len(completed)} analysed"],
+        ['Reviewed by dentist', str(sum(1 for p in predictions if p.reviewed))],
+    ]))
+    story.append(Spacer(1, 0.5 * cm))
+
+    rows = [['Date', 'Scan', 'Result', 'Confidence', 'Severity', 'Review']]
+    for prediction in predictions:
+        if prediction.status == 'completed':
+            severity = generate_recommendations({
+                'has_caries': prediction.has_caries,
+                'confidence_score': prediction.confidence_score,
+            })['severity']
+            result = 'Caries' if prediction.has_caries else 'No caries'
+            confidence = f"{prediction.confidence_score * 100:.1f}%"
+        else:
+            severity, result, confidence = '-', prediction.status.title(), '-'
+        review = 'Pending'
+        if prediction.reviewed:
+            review = 'Caries' if prediction.dentist_diagnosis else 'No caries'
+        rows.append([
+            prediction.xray.uploaded_at.strftime('%Y-%m-%d'),
+            Paragraph(f"#{prediction.xray.id} {escape(prediction.xray.tooth_region)}", body),
+            result, confidence, Paragraph(severity, body), review,
+        ])
+
+    story.append(Paragraph('Scans', heading))
+    table = Table(rows, repeatRows=1,
+                  colWidths=[2.3 * cm, 2.8 * cm, 2.2 * cm, 2.2 * cm, 5 * cm, 2.2 * cm])
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2563eb')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('FONTSIZE', (0, 0), (-1, -1), 9),
+    ]))
+    story.append(table)
+
+    buffer = io.BytesIO()
+    SimpleDocTemplate(buffer, pagesize=A4, title=f"Patient {patient.patient_id} report").build(story)
+    return buffer.getvalue()
+
+
+RENDERERS = {
+    'scan': render_scan_report,
+    'patient': render_patient_report,
+}
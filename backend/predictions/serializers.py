@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from .media import signed_media_url
 from .models import Patient, XRayImage, Prediction
 
 class PatientSerializer(serializers.ModelSerializer):
@@ -35,4 +36,16 @@ class XRayImageSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'uploaded_at']
     
     def get_patient_name(self, obj):
-        return f"{obj.patient.first_name} {obj.patient.last_name}"
\ No newline at end of file
+        return f"{obj.patient.first_name} {obj.patient.last_name}"
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Media is only reachable through signed links (see media.py)
+        data['image'] = signed_media_url(instance.image, self.context.get('request'))
+        return data
+
+class PredictionReviewSerializer(serializers.Serializer):
+    """One dentist verdict in a bulk review request"""
+    prediction_id = serializers.IntegerField()
+    dentist_diagnosis = serializers.BooleanField()
+    dentist_notes = serializers.CharField(required=False, allow_blank=True, default='')
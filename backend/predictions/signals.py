@@ -0,0 +1,55 @@
+"""
+Invalidate cached read responses when scans, predictions or patients change.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import (
+    bump_versions,
+    patient_version_key,
+    scan_version_key,
+    stats_version_key,
+)
+from .models import Patient, Prediction, XRayImage
+
+
+@receiver([post_save, post_delete], sender=XRayImage)
+def xray_changed(sender, instance, **kwargs):
+    bump_versions([
+        scan_version_key(instance.id),
+        patient_version_key(instance.patient_id),
+        stats_version_key(instance.uploaded_by_id),
+    ])
+
+
+@receiver([post_save, post_delete], sender=Prediction)
+def prediction_changed(sender, instance, **kwargs):
+    keys = [scan_version_key(instance.xray_id)]
+    if Prediction.xray.is_cached(instance):
+        xray = instance.xray
+        keys += [patient_version_key(xray.patient_id), stats_version_key(xray.uploaded_by_id)]
+    else:
+        owner = XRayImage.objects.filter(id=instance.xray_id).values_list(
+            'patient_id', 'uploaded_by_id'
+        ).first()
+        # Missing owner means the X-ray is being deleted too; its own signal covers it
+        if owner:
+            keys += [patient_version_key(owner[0]), stats_version_key(owner[1])]
+    bump_versions(keys)
+
+
+@receiver(post_save, sender=Patient)
+def patient_saved(sender, instance, created, **kwargs):
+    keys = [patient_version_key(instance.id), stats_version_key(instance.created_by_id)]
+    if not created:
+        # Scan details embed the patient's name
+        keys += [
+            scan_version_key(scan_id)
+            for scan_id in instance.xrays.values_list('id', flat=True)
+        ]
+    bump_versions(keys)
+
+
+@receiver(post_delete, sender=Patient)
+def patient_deleted(sender, instance, **kwargs):
+    bump_versions([patient_version_key(instance.id), stats_version_key(instance.created_by_id)])
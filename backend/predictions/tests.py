@@ -1,3 +1,1022 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from unittest import mock
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+import numpy as np
+from PIL import Image as PILImage
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from tunzadent import cpu_plan
+from tunzadent.tracing import ServerTimingMiddleware, current_trace, span
+
+from . import admission, cleanup, embeddings, reports
+from .cache import invalidate_scans
+from .management.commands.rescore_predictions import pending_predictions
+from .media import signed_media_url
+from .ml_inference import EMBEDDING_VERSION, MODEL_VERSION
+from .models import Patient, PatientDeletion, Prediction, ReportJob, XRayImage
+
+CONTENT = bytes(range(256)) * 4
+
+
+def use_temp_setting(test, name):
+    """Point setting `name` at a fresh directory for the rest of `test`"""
+    path = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, path, ignore_errors=True)
+    settings_override = override_settings(**{name: path})
+    settings_override.enable()
+    test.addCleanup(settings_override.disable)
+    return path
+
+
+def use_temp_media(test):
+    return use_temp_setting(test, 'MEDIA_ROOT')
+
+
+def make_user(username):
+    return User.objects.create_user(username=username, email=f"{username}@example.com", password='x')
+
+
+def make_patient(user, patient_id='P-1'):
+    return Patient.objects.create(
+        created_by=user, patient_id=patient_id, first_name='A', last_name='B',
+        date_of_birth='1990-01-01'
+    )
+
+
+def make_scan(patient, status='completed', model_version=MODEL_VERSION, **fields):
+    """An X-ray with a stored image and its prediction"""
+    xray = XRayImage(patient=patient, uploaded_by=patient.created_by)
+    xray.image.save('scan.png', ContentFile(CONTENT), save=True)
+    prediction = Prediction.objects.create(
+        xray=xray, status=status, model_version=model_version,
+        has_caries=False, predicted_class=0, confidence_score=0.9,
+        confidence_no_caries=0.9, confidence_has_caries=0.1, processing_time_ms=1.0,
+        **fields
+    )
+    return xray, prediction
+
+
+# ============================================
+# Signed media delivery
+# ============================================
+
+@override_settings(MEDIA_URL_TTL=3600, MEDIA_ACCEL='')
+class SignedMediaTests(TestCase):
+    def setUp(self):
+        use_temp_media(self)
+        user = make_user('dentist')
+        self.xray = XRayImage(patient=make_patient(user), uploaded_by=user)
+        self.xray.image.save('scan.png', ContentFile(CONTENT), save=True)
+        self.url = signed_media_url(self.xray.image)
+
+    def fetch(self, url=None, **headers):
+        return self.client.get(url or self.url, **headers)
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def with_params(self, **params):
+        parsed = urlparse(self.url)
+        query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        query.update(params)
+        return f"{parsed.path}?" + '&'.join(f"{k}={v}" for k, v in query.items())
+
+    def test_valid_signature_serves_file(self):
+        response = self.fetch()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), CONTENT)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertTrue(response['Cache-Control'].startswith('private'))
+
+    def test_urls_are_stable_within_a_window(self):
+        self.assertEqual(signed_media_url(self.xray.image), self.url)
+
+    def test_missing_or_bad_signature_is_forbidden(self):
+        self.assertEqual(self.fetch(urlparse(self.url).path).status_code, 403)
+        self.assertEqual(self.fetch(self.with_params(signature='0' * 32)).status_code, 403)
+        # Signature is bound to the expiry
+        expires = int(parse_qs(urlparse(self.url).query)['expires'][0])
+        self.assertEqual(self.fetch(self.with_params(expires=expires + 3600)).status_code, 403)
+
+    def test_expired_link_is_forbidden(self):
+        later = time.time() + 3 * 3600
+        with mock.patch('predictions.media.time.time', return_value=later):
+            self.assertEqual(self.fetch().status_code, 403)
+
+    def test_byte_range(self):
+        response = self.fetch(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f"bytes 10-19/{len(CONTENT)}")
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(self.body(response), CONTENT[10:20])
+
+    def test_open_and_suffix_ranges(self):
+        response = self.fetch(HTTP_RANGE='bytes=1000-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.body(response), CONTENT[1000:])
+
+        response = self.fetch(HTTP_RANGE='bytes=-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.body(response), CONTENT[-5:])
+
+    def test_unsatisfiable_range(self):
+        response = self.fetch(HTTP_RANGE=f"bytes={len(CONTENT)}-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f"bytes */{len(CONTENT)}")
+        self.assertEqual(response['Cache-Control'], 'no-store')
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_malformed_range_sends_whole_file(self):
+        response = self.fetch(HTTP_RANGE='bytes=0-1,5-6')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), CONTENT)
+
+    def test_if_range(self):
+        etag = self.fetch()['ETag']
+        response = self.fetch(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+
+        # Client's copy is stale: send the whole file instead of a part
+        response = self.fetch(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), CONTENT)
+
+    def test_conditional_get(self):
+        etag = self.fetch()['ETag']
+        response = self.fetch(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    @override_settings(MEDIA_ACCEL='nginx', MEDIA_ACCEL_PREFIX='/protected-media/')
+    def test_nginx_accel_redirect(self):
+        response = self.fetch(HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], f"/protected-media/{self.xray.image.name}")
+        self.assertEqual(response.content, b'')
+
+
+# ============================================
+# Re-scoring selection
+# ============================================
+
+class RescoreSelectionTests(TestCase):
+    def setUp(self):
+        use_temp_media(self)
+        self.patient = make_patient(make_user('dentist'))
+
+    def selected(self, version=MODEL_VERSION, upgrade_fast=False):
+        return set(pending_predictions(version, upgrade_fast).values_list('model_version', flat=True))
+
+    def test_current_model_rows_are_skipped_in_every_mode(self):
+        for suffix in ('', '+tome48', '+fast112', '+fast112d6', '+tiled', '+tome48+tiled'):
+            make_scan(self.patient, model_version=MODEL_VERSION + suffix)
+        self.assertEqual(self.selected(), set())
+
+    def test_older_model_rows_are_selected(self):
+        for version in ('MAE-ViT-v1.0', 'MAE-ViT-v1.0+tome48', 'MAE-ViT-v1.0+fast112'):
+            make_scan(self.patient, model_version=version)
+        self.assertEqual(self.selected(), {'MAE-ViT-v1.0', 'MAE-ViT-v1.0+tome48', 'MAE-ViT-v1.0+fast112'})
+
+    def test_tiled_rows_are_never_replaced_by_a_whole_film_pass(self):
+        make_scan(self.patient, model_version='MAE-ViT-v1.0+tiled')
+        make_scan(self.patient, model_version='MAE-ViT-v1.0+tome48+tiled')
+        self.assertEqual(self.selected(), set())
+        self.assertEqual(self.selected(upgrade_fast=True), set())
+
+    def test_upgrade_fast_adds_current_first_pass_rows(self):
+        make_scan(self.patient, model_version=MODEL_VERSION + '+fast112')
+        make_scan(self.patient, model_version=MODEL_VERSION + '+tome48')
+        make_scan(self.patient, model_version='MAE-ViT-v1.0')
+        self.assertEqual(self.selected(upgrade_fast=True), {MODEL_VERSION + '+fast112', 'MAE-ViT-v1.0'})
+
+    def test_version_prefix_is_not_a_match(self):
+        # v2.0 must not count as current for a v2.0.1 target
+        make_scan(self.patient, model_version='MAE-ViT-v2.0')
+        self.assertEqual(self.selected('MAE-ViT-v2.0.1'), {'MAE-ViT-v2.0'})
+
+    def test_unfinished_rows_are_left_to_their_upload(self):
+        make_scan(self.patient, status='processing', model_version='MAE-ViT-v1.0')
+        make_scan(self.patient, status='failed', model_version='MAE-ViT-v1.0+fast112')
+        self.assertEqual(self.selected(), {'MAE-ViT-v1.0+fast112'})
+
+    def test_selection_is_in_id_order(self):
+        ids = [make_scan(self.patient, model_version='MAE-ViT-v1.0')[1].id for _ in range(3)]
+        self.assertEqual(list(pending_predictions(MODEL_VERSION).values_list('id', flat=True)), ids)
+
+
+# ============================================
+# Similar-case embedding index
+# ============================================
+
+def embedding(*values):
+    return np.array(values, dtype=embeddings.EMBEDDING_DTYPE).tobytes()
+
+
+class EmbeddingIndexTests(TestCase):
+    def setUp(self):
+        use_temp_media(self)
+        use_temp_setting(self, 'EMBEDDING_INDEX_DIR')
+        embeddings._index = None
+        self.addCleanup(setattr, embeddings, '_index', None)
+
+        self.dentist = make_user('dentist')
+        self.other = make_user('other')
+        self.patient = make_patient(self.dentist)
+        self.other_patient = make_patient(self.other, 'P-2')
+
+    def scan(self, vector, patient=None, **fields):
+        fields.setdefault('embedding_version', EMBEDDING_VERSION)
+        return make_scan(patient or self.patient, embedding=embedding(*vector), **fields)[1]
+
+    def test_build_groups_rows_by_owner_in_keyset_pages(self):
+        # Interleave owners so id order differs from owner order
+        created = []
+        for i in range(5):
+            created.append(self.scan((1, i, 0, 0)))
+            created.append(self.scan((0, 1, i, 0), patient=self.other_patient))
+        self.scan((1, 0, 0, 0), embedding_version='old-weights')
+
+        # max, count and owners, then 3 pages of up to 2 rows per owner
+        with self.assertNumQueries(9):
+            count = embeddings.build_index(EMBEDDING_VERSION, batch_size=2)
+        self.assertEqual(count, 10)
+
+        index = embeddings.get_index()
+        self.assertEqual(list(index.owners), sorted(index.owners))
+        mine = [p.id for p in created if p.xray.uploaded_by_id == self.dentist.id]
+        start = int(np.searchsorted(index.owners, self.dentist.id))
+        self.assertEqual(list(index.ids[start:start + 5]), mine)
+        norms = np.linalg.norm(np.asarray(index.vectors, dtype=np.float32), axis=1)
+        np.testing.assert_allclose(norms, 1, atol=1e-2)
+        self.assertEqual(index.meta['max_prediction_id'], max(p.id for p in created))
+
+    def test_rows_added_after_build_are_searched_from_the_tail(self):
+        query = self.scan((1, 0, 0, 0))
+        indexed = self.scan((1, 0.1, 0, 0), reviewed=True)
+        embeddings.build_index(EMBEDDING_VERSION)
+        added = self.scan((1, 0.05, 0, 0), reviewed=True)
+
+        results = embeddings.similar_predictions(query, self.dentist.id, limit=5)
+        self.assertEqual([p.id for p, _ in results], [added.id, indexed.id])
+
+    def test_only_the_owners_scans_are_returned(self):
+        query = self.scan((1, 0, 0, 0))
+        self.scan((1, 0, 0, 0), patient=self.other_patient, reviewed=True)
+        mine = self.scan((0.5, 0.5, 0, 0), reviewed=True)
+        embeddings.build_index(EMBEDDING_VERSION)
+
+        results = embeddings.similar_predictions(query, self.dentist.id)
+        self.assertEqual([p.id for p, _ in results], [mine.id])
+
+    def test_reviewed_filter_costs_one_query_however_few_are_reviewed(self):
+        query = self.scan((1, 0, 0, 0))
+        # The closest scans are unreviewed; the only reviewed one ranks last
+        for i in range(120):
+            self.scan((1, 0.01 * i, 0, 0))
+        reviewed = self.scan((0, 0, 1, 0), reviewed=True)
+        embeddings.build_index(EMBEDDING_VERSION)
+
+        # tail, reviewed ids, one page of candidates
+        with self.assertNumQueries(3):
+            results = embeddings.similar_predictions(query, self.dentist.id, limit=5)
+        self.assertEqual([p.id for p, _ in results], [reviewed.id])
+
+        results = embeddings.similar_predictions(query, self.dentist.id, limit=5, reviewed_only=False)
+        self.assertEqual(len(results), 5)
+        self.assertNotIn(reviewed.id, [p.id for p, _ in results])
+
+    def test_scan_unreviewed_after_build_is_dropped(self):
+        query = self.scan((1, 0, 0, 0))
+        first = self.scan((1, 0.1, 0, 0), reviewed=True)
+        second = self.scan((1, 0.2, 0, 0), reviewed=True)
+        embeddings.build_index(EMBEDDING_VERSION)
+        Prediction.objects.filter(id=first.id).update(reviewed=False)
+
+        results = embeddings.similar_predictions(query, self.dentist.id)
+        self.assertEqual([p.id for p, _ in results], [second.id])
+
+
+# ============================================
+# PDF report jobs
+# ============================================
+
+class ReportJobTests(TestCase):
+    def setUp(self):
+        use_temp_media(self)
+        use_temp_setting(self, 'REPORT_CACHE_DIR')
+        self.dentist = make_user('dentist')
+        self.patient = make_patient(self.dentist)
+        make_scan(self.patient)
+        self.key = reports.patient_report_key(self.patient)
+
+    def request(self):
+        return reports.request_report(self.key, 'patient', self.patient.id)
+
+    def test_report_is_queued_once(self):
+        self.assertEqual(self.request(), (None, None))
+        self.assertEqual(self.request(), (None, None))
+        self.assertEqual(ReportJob.objects.filter(key=self.key).count(), 1)
+
+    def test_worker_renders_queued_report(self):
+        client = APIClient()
+        client.force_authenticate(self.dentist)
+        url = f"/api/predictions/patients/{self.patient.id}/report/"
+
+        response = client.get(url)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(client.get(url).status_code, 202)
+
+        call_command('render_reports', stdout=io.StringIO())
+        self.assertEqual(ReportJob.objects.get(key=self.key).status, 'completed')
+
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_claimed_job_is_leased_to_one_worker(self):
+        self.request()
+        job = reports.claim_report_job()
+        self.assertEqual(job.status, 'running')
+        self.assertIsNone(reports.claim_report_job())
+
+        # A worker that died mid-render: the job is due again after the lease
+        ReportJob.objects.filter(id=job.id).update(lease_until=timezone.now())
+        self.assertEqual(reports.claim_report_job().attempts, 2)
+
+    def test_failed_render_is_retried_then_reported_once(self):
+        self.request()
+        broken = mock.Mock(side_effect=RuntimeError('reportlab exploded'))
+        with mock.patch.dict(reports.RENDERERS, {'patient': broken}), \
+                mock.patch.object(reports.logger, 'exception'):
+            self.assertFalse(reports.run_report_job(reports.claim_report_job()))
+            job = ReportJob.objects.get(key=self.key)
+            self.assertEqual(job.status, 'queued')
+            self.assertGreater(job.lease_until, timezone.now())
+
+            ReportJob.objects.filter(id=job.id).update(lease_until=timezone.now(), attempts=reports.MAX_ATTEMPTS - 1)
+            self.assertFalse(reports.run_report_job(reports.claim_report_job()))
+        self.assertEqual(ReportJob.objects.get(key=self.key).status, 'failed')
+
+        self.assertEqual(self.request(), (None, 'reportlab exploded'))
+        # The next request queues it again
+        self.assertEqual(self.request(), (None, None))
+        self.assertEqual(ReportJob.objects.get(key=self.key).status, 'queued')
+
+    def test_deleted_object_is_not_retried(self):
+        reports.request_report('patient-gone', 'patient', 999999)
+        with mock.patch.object(reports.logger, 'exception'):
+            self.assertFalse(reports.run_report_job(reports.claim_report_job()))
+        job = ReportJob.objects.get(key='patient-gone')
+        self.assertEqual((job.status, job.attempts), ('failed', 1))
+
+    def test_reaped_pdf_is_rendered_again(self):
+        self.request()
+        reports.run_report_job(reports.claim_report_job())
+        path, _ = self.request()
+        path.unlink()
+
+        self.assertEqual(self.request(), (None, None))
+        self.assertEqual(ReportJob.objects.get(key=self.key).status, 'queued')
+
+
+# ============================================
+# Inference admission for scan details and uploads
+# ============================================
+
+@override_settings(
+    INFERENCE_CONCURRENCY=1, INFERENCE_QUEUE_SIZE=0, INFERENCE_QUEUE_TIMEOUT=0,
+    INFERENCE_USER_SHARE=1, RESPONSE_CACHE_ENABLED=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class InferenceAdmissionTests(TestCase):
+    def setUp(self):
+        use_temp_media(self)
+        use_temp_setting(self, 'INFERENCE_LOCK_DIR')
+        admission._admission = None
+        self.addCleanup(setattr, admission, '_admission', None)
+
+        self.dentist = make_user('dentist')
+        self.xray, _ = make_scan(make_patient(self.dentist))
+        self.client = APIClient()
+        self.client.force_authenticate(self.dentist)
+        self.url = f"/api/predictions/scans/{self.xray.id}/"
+
+        detector = mock.patch('predictions.views.CariesDetector')
+        self.detector = detector.start()
+        self.addCleanup(detector.stop)
+        self.detector.return_value.predict.return_value = {
+            'success': True, 'attention_heatmap': 'aGVhdG1hcA==',
+            'recommendations': {'severity': 'None'},
+        }
+
+    def saturate(self):
+        """Hold the only inference slot, as another user's upload would"""
+        slot = admission.get_admission().acquire('someone-else')
+        self.addCleanup(slot.close)
+        return slot
+
+    def test_details_include_explainability_when_a_slot_is_free(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('explainability', response.data)
+        self.assertIn('recommendations', response.data)
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'HIT')
+
+    def test_details_degrade_instead_of_429_when_saturated(self):
+        slot = self.saturate()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.data['prediction'])
+        self.assertIn('image_url', response.data['xray'])
+        self.assertNotIn('explainability', response.data)
+        self.assertNotIn('recommendations', response.data)
+        self.assertEqual(response['Cache-Control'], 'no-store')
+        self.detector.return_value.predict.assert_not_called()
+
+        # The degraded page was not cached: once free, the heatmap comes back
+        slot.close()
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn('explainability', response.data)
+
+    def test_user_with_upload_in_flight_can_open_scans(self):
+        # per-user share of 1 slot: the user's own upload holds it
+        slot = admission.get_admission().acquire(self.dentist.id)
+        self.addCleanup(slot.close)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_upload_is_rejected_when_saturated(self):
+        self.saturate()
+        image = io.BytesIO()
+        PILImage.new('RGB', (64, 64)).save(image, 'PNG')
+        upload = ContentFile(image.getvalue(), name='film.png')
+        response = self.client.post('/api/predictions/upload-predict/', {
+            'patient_id': self.xray.patient_id, 'image': upload
+        }, format='multipart')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(XRayImage.objects.count(), 1)
+
+
+# ============================================
+# Media cleanup
+# ============================================
+
+class PruneEmptyDirsTests(TestCase):
+    def test_removes_empty_branches_bottom_up(self):
+        root = Path(use_temp_media(self)) / 'xrays'
+        (root / '2024/01/02').mkdir(parents=True)
+        (root / '2024/01/03').mkdir(parents=True)
+        (root / '2024/02/01').mkdir(parents=True)
+        (root / '2024/02/01/scan.png').write_bytes(CONTENT)
+
+        with mock.patch('predictions.cleanup.os.walk', wraps=os.walk) as walk:
+            cleanup._prune_empty_dirs(root)
+        walk.assert_called_once_with(root, topdown=False)
+
+        self.assertTrue(root.is_dir())
+        self.assertFalse((root / '2024/01').exists())
+        self.assertTrue((root / '2024/02/01/scan.png').exists())
+
+
+
+def age(path, seconds):
+    """Backdate `path`'s modification time by `seconds`"""
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+class ReapMediaTests(TestCase):
+    def setUp(self):
+        self.media = Path(use_temp_media(self))
+        self.patient = make_patient(make_user('dentist'))
+
+    def orphan(self, name, seconds=7200):
+        path = self.media / 'xrays' / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(CONTENT)
+        age(path, seconds)
+        return path
+
+    def test_deletes_old_unreferenced_files_only(self):
+        xray, _ = make_scan(self.patient)
+        kept = Path(xray.image.path)
+        age(kept, 7200)
+        old = self.orphan('2024/01/02/lost.png')
+        fresh = self.orphan('2024/01/03/uploading.png', seconds=10)
+
+        stats = cleanup.reap_media(grace=3600, batch_size=1, max_rate=0)
+
+        self.assertEqual(stats, {'scanned': 3, 'orphaned': 1, 'removed': 1, 'bytes': len(CONTENT)})
+        self.assertTrue(kept.exists())
+        self.assertTrue(fresh.exists())
+        self.assertFalse(old.exists())
+        self.assertFalse((self.media / 'xrays/2024/01/02').exists())
+
+    def test_dry_run_deletes_nothing(self):
+        old = self.orphan('2024/01/02/lost.png')
+        out = io.StringIO()
+        call_command('reap_media', '--dry-run', '--media-only', stdout=out)
+        self.assertTrue(old.exists())
+        self.assertIn('xrays/2024/01/02/lost.png', out.getvalue())
+        self.assertIn('would delete 1 orphaned', out.getvalue())
+
+    def test_reaps_stale_reports_jobs_and_index_generations(self):
+        reports_dir = Path(use_temp_setting(self, 'REPORT_CACHE_DIR'))
+        index = Path(use_temp_setting(self, 'EMBEDDING_INDEX_DIR'))
+        stale_pdf, fresh_pdf, temp = reports_dir / 'a.pdf', reports_dir / 'b.pdf', reports_dir / 'c.tmp'
+        for path in (stale_pdf, fresh_pdf, temp):
+            path.write_bytes(CONTENT)
+        age(stale_pdf, 8 * 86400)
+        age(temp, 7200)
+        for generation in ('gen-1', 'gen-2'):
+            (index / generation).mkdir()
+            (index / generation / 'vectors.npy').write_bytes(CONTENT)
+            age(index / generation, 7200)
+        (index / 'CURRENT').write_text('gen-2')
+
+        old = timezone.now() - timedelta(days=8)
+        ReportJob.objects.create(key='old', kind='scan', object_id=1, status='completed', finished_at=old)
+        ReportJob.objects.create(key='failed', kind='scan', object_id=2, status='failed', finished_at=old)
+        ReportJob.objects.create(key='recent', kind='scan', object_id=3, status='completed',
+                                 finished_at=timezone.now())
+        ReportJob.objects.create(key='queued', kind='scan', object_id=4)
+
+        stats = cleanup.reap_derivatives(report_max_age=7 * 86400, grace=3600)
+
+        self.assertEqual(stats, {'reports': 2, 'report_jobs': 2, 'index_generations': 1,
+                                 'bytes': 3 * len(CONTENT)})
+        self.assertEqual(sorted(p.name for p in reports_dir.iterdir()), ['b.pdf'])
+        self.assertEqual(sorted(ReportJob.objects.values_list('key', flat=True)), ['queued', 'recent'])
+        self.assertFalse((index / 'gen-1').exists())
+        self.assertTrue((index / 'gen-2').exists())
+
+
+class BulkDeletionTests(TestCase):
+    def setUp(self):
+        use_temp_media(self)
+        use_temp_setting(self, 'REPORT_CACHE_DIR')
+        self.dentist = make_user('dentist')
+        self.patients = [make_patient(self.dentist, f'P-{i}') for i in range(3)]
+        self.files = [Path(make_scan(patient)[0].image.path) for patient in self.patients]
+        self.client = APIClient()
+        self.client.force_authenticate(self.dentist)
+
+    def queue(self):
+        return cleanup.queue_bulk_delete(self.dentist, [p.id for p in self.patients])
+
+    def expire_lease(self, job):
+        PatientDeletion.objects.filter(id=job.id).update(lease_until=timezone.now())
+
+    def test_api_queues_and_worker_deletes(self):
+        theirs = make_patient(make_user('other'), 'P-9')
+        response = self.client.post('/api/predictions/patient-deletions/', {
+            'patient_ids': [p.id for p in self.patients] + [theirs.id],
+        }, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['total'], 3)
+        self.assertEqual(response.data['not_found'], [theirs.id])
+        # Nothing is deleted inline
+        self.assertEqual(Patient.objects.count(), 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('run_patient_deletions', stdout=io.StringIO())
+
+        self.assertEqual(list(Patient.objects.all()), [theirs])
+        self.assertFalse(any(path.exists() for path in self.files))
+        status_url = f"/api/predictions/patient-deletions/{response.data['job_id']}/"
+        job = self.client.get(status_url).data
+        self.assertEqual((job['status'], job['deleted'], job['attempts']), ('completed', 3, 1))
+        self.assertIsNotNone(job['finished_at'])
+
+        other = APIClient()
+        other.force_authenticate(theirs.created_by)
+        self.assertEqual(other.get(status_url).status_code, 404)
+
+    def test_lease_hides_claimed_job_until_it_runs_out(self):
+        job = self.queue()
+        self.assertEqual(cleanup.claim_bulk_delete().id, job.id)
+        # Another worker finds nothing while the lease holds
+        self.assertIsNone(cleanup.claim_bulk_delete())
+
+        # The first worker died: the job comes back and resumes with what is left
+        self.patients[0].delete()
+        self.expire_lease(job)
+        job = cleanup.claim_bulk_delete()
+        self.assertEqual(job.attempts, 2)
+        self.assertTrue(cleanup.run_bulk_delete(job))
+        self.assertEqual((job.status, job.deleted), ('completed', 2))
+        self.assertFalse(Patient.objects.exists())
+
+    @mock.patch('predictions.cleanup.DELETE_CHUNK', 1)
+    def test_failure_keeps_progress_and_backs_off(self):
+        job = self.queue()
+        failing = mock.patch('predictions.cleanup.delete_patients',
+                             side_effect=[1, RuntimeError('disk gone')])
+        with failing, self.assertLogs('tunzadent.cleanup', 'ERROR'):
+            self.assertFalse(cleanup.run_bulk_delete(cleanup.claim_bulk_delete()))
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.deleted, job.last_error), ('queued', 1, 'disk gone'))
+        self.assertGreater(job.lease_until, timezone.now() + timedelta(seconds=cleanup.BASE_RETRY_SECONDS - 5))
+        self.assertIsNone(cleanup.claim_bulk_delete())
+
+    def test_gives_up_after_max_attempts(self):
+        job = self.queue()
+        PatientDeletion.objects.filter(id=job.id).update(attempts=cleanup.MAX_ATTEMPTS - 1)
+        with mock.patch('predictions.cleanup.delete_patients', side_effect=RuntimeError('boom')), \
+                self.assertLogs('tunzadent.cleanup', 'ERROR'):
+            self.assertFalse(cleanup.run_bulk_delete(cleanup.claim_bulk_delete()))
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', cleanup.MAX_ATTEMPTS))
+        self.assertIsNotNone(job.finished_at)
+        self.expire_lease(job)
+        self.assertIsNone(cleanup.claim_bulk_delete())
+
+
+# ============================================
+# Server-Timing and slow-request tracing
+# ============================================
+
+@override_settings(SERVER_TIMING_ENABLED=True, SLOW_REQUEST_THRESHOLD_MS=60000)
+class ServerTimingTests(TestCase):
+    def run_view(self, view):
+        return ServerTimingMiddleware(view)(RequestFactory().get('/api/predictions/stats/'))
+
+    def metrics(self, response):
+        return dict(
+            (part.split(';')[0], part.split(';', 1)[1] if ';' in part else '')
+            for part in response['Server-Timing'].split(', ')
+        )
+
+    def test_header_reports_queries_spans_size_and_total(self):
+        def view(request):
+            User.objects.count()
+            User.objects.exists()
+            for _ in range(2):
+                with span('inference'):
+                    time.sleep(0.005)
+            return HttpResponse(b'x' * 123)
+
+        metrics = self.metrics(self.run_view(view))
+        self.assertIn('desc="2 queries"', metrics['db'])
+        # Repeated spans accumulate
+        self.assertGreaterEqual(float(metrics['inference'].split('=')[1]), 10)
+        self.assertEqual(metrics['resp'], 'desc="123 bytes"')
+        self.assertIn('total', metrics)
+
+    def test_streamed_response_is_sized_only_from_content_length(self):
+        metrics = self.metrics(self.run_view(lambda r: StreamingHttpResponse(iter([b'abc']))))
+        self.assertNotIn('resp', metrics)
+
+        def sized(request):
+            response = StreamingHttpResponse(iter([b'abc']))
+            response['Content-Length'] = '3'
+            return response
+        self.assertEqual(self.metrics(self.run_view(sized))['resp'], 'desc="3 bytes"')
+
+    def test_span_outside_a_request_is_a_no_op(self):
+        self.assertIsNone(current_trace())
+        with span('inference'):
+            pass
+        self.assertIsNone(current_trace())
+
+    def test_endpoint_response_carries_header(self):
+        client = APIClient()
+        client.force_authenticate(make_user('dentist'))
+        response = client.get('/api/predictions/stats/')
+        metrics = self.metrics(response)
+        self.assertIn('render', metrics)
+        self.assertEqual(metrics['resp'], f'desc="{len(response.content)} bytes"')
+
+    @override_settings(SERVER_TIMING_ENABLED=False)
+    def test_header_can_be_disabled(self):
+        self.assertFalse(self.run_view(lambda r: HttpResponse()).has_header('Server-Timing'))
+
+    @override_settings(SLOW_REQUEST_THRESHOLD_MS=0, SLOW_REQUEST_MAX_QUERIES=1)
+    def test_slow_request_is_logged_with_slowest_queries(self):
+        def view(request):
+            User.objects.count()
+            User.objects.exists()
+            return HttpResponse(b'ok')
+
+        with self.assertLogs('tunzadent.slow_requests', 'WARNING') as logs:
+            self.run_view(view)
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry['event'], 'slow_request')
+        self.assertEqual(entry['query_count'], 2)
+        self.assertEqual(len(entry['queries']), 1)
+        self.assertEqual(entry['response_bytes'], 2)
+
+
+# ============================================
+# Cross-request response cache
+# ============================================
+
+@override_settings(
+    RESPONSE_CACHE_ENABLED=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        use_temp_media(self)
+        self.dentist = make_user('dentist')
+        self.patient = make_patient(self.dentist)
+        self.xray, self.prediction = make_scan(self.patient)
+        self.client = APIClient()
+        self.client.force_authenticate(self.dentist)
+
+    def stats(self):
+        return self.client.get('/api/predictions/stats/')
+
+    def test_repeat_read_is_served_from_cache(self):
+        self.assertEqual(self.stats()['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.stats()
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+    def test_write_invalidates_only_once_committed(self):
+        before = self.stats().data
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.prediction.has_caries = True
+            self.prediction.save()
+            # Not committed yet: readers still get the old entry
+            self.assertEqual(self.stats()['X-Cache'], 'HIT')
+        for callback in callbacks:
+            callback()
+
+        response = self.stats()
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertNotEqual(response.data, before)
+
+    def test_rolled_back_write_keeps_cache(self):
+        self.stats()
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    make_scan(self.patient)
+                    raise RuntimeError('rollback')
+            except RuntimeError:
+                pass
+        self.assertEqual(self.stats()['X-Cache'], 'HIT')
+
+    def test_patient_rename_invalidates_scan_list(self):
+        url = f"/api/predictions/patients/{self.patient.id}/scans/"
+        self.client.get(url)
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.patient.first_name = 'Renamed'
+            self.patient.save()
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+
+    def test_bulk_writes_invalidate_through_invalidate_scans(self):
+        self.stats()
+        with self.captureOnCommitCallbacks(execute=True):
+            Prediction.objects.filter(id=self.prediction.id).update(has_caries=True)
+            invalidate_scans([(self.xray.id, self.patient.id, self.dentist.id)])
+        self.assertEqual(self.stats()['X-Cache'], 'MISS')
+
+    def test_entries_are_per_user(self):
+        self.stats()
+        other = APIClient()
+        other.force_authenticate(make_user('other'))
+        response = other.get('/api/predictions/stats/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['total_predictions'], 0)
+
+
+# ============================================
+# Bulk dentist review
+# ============================================
+
+@override_settings(
+    RESPONSE_CACHE_ENABLED=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class BulkReviewTests(TestCase):
+    def setUp(self):
+        use_temp_media(self)
+        self.dentist = make_user('dentist')
+        self.patient = make_patient(self.dentist)
+        self.client = APIClient()
+        self.client.force_authenticate(self.dentist)
+
+    def review(self, reviews):
+        return self.client.post('/api/predictions/reviews/bulk/', {'reviews': reviews}, format='json')
+
+    def test_outcome_per_item(self):
+        _, mine = make_scan(self.patient)
+        _, pending = make_scan(self.patient, status='pending')
+        _, theirs = make_scan(make_patient(make_user('other'), 'P-2'))
+
+        response = self.review([
+            {'prediction_id': mine.id, 'dentist_diagnosis': True, 'dentist_notes': 'Occlusal'},
+            {'prediction_id': mine.id, 'dentist_diagnosis': False},
+            {'prediction_id': pending.id, 'dentist_diagnosis': True},
+            {'prediction_id': theirs.id, 'dentist_diagnosis': True},
+            {'dentist_diagnosis': True},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual(response.data['failed'], 4)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['updated', 'duplicate', 'not_completed', 'not_found', 'invalid']
+        )
+        # The model said no caries, the dentist says yes
+        self.assertFalse(response.data['results'][0]['agrees_with_model'])
+
+        mine.refresh_from_db()
+        self.assertTrue(mine.reviewed)
+        self.assertEqual(mine.reviewed_by, self.dentist)
+        self.assertTrue(mine.dentist_diagnosis)
+        self.assertEqual(mine.dentist_notes, 'Occlusal')
+        self.assertIsNotNone(mine.reviewed_at)
+        theirs.refresh_from_db()
+        self.assertFalse(theirs.reviewed)
+
+    def test_batch_is_saved_in_constant_queries(self):
+        ids = [make_scan(self.patient)[1].id for _ in range(5)]
+        # Ownership lookup, then the atomic bulk update
+        with self.assertNumQueries(4):
+            self.review([{'prediction_id': i, 'dentist_diagnosis': True} for i in ids])
+        self.assertEqual(Prediction.objects.filter(id__in=ids, reviewed=True).count(), 5)
+
+    def test_invalidates_cached_scan_list(self):
+        _, prediction = make_scan(self.patient)
+        url = f"/api/predictions/patients/{self.patient.id}/scans/"
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.review([{'prediction_id': prediction.id, 'dentist_diagnosis': True}])
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+
+    def test_rejects_malformed_body(self):
+        self.assertEqual(self.review([]).status_code, 400)
+        self.assertEqual(self.review({'prediction_id': 1}).status_code, 400)
+        with mock.patch('predictions.views.MAX_BULK_REVIEWS', 2):
+            response = self.review([{'prediction_id': i, 'dentist_diagnosis': True} for i in range(3)])
+        self.assertEqual(response.status_code, 400)
+
+
+# ============================================
+# Prediction history export
+# ============================================
+
+@mock.patch('predictions.views.EXPORT_PAGE_ROWS', 2)
+class ExportTests(TestCase):
+    def setUp(self):
+        use_temp_media(self)
+        self.dentist = make_user('dentist')
+        self.patient = make_patient(self.dentist)
+        self.scans = [make_scan(self.patient)[0] for _ in range(5)]
+        make_scan(make_patient(make_user('other'), 'P-2'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.dentist)
+
+    def export(self, export_format, **params):
+        response = self.client.get(f'/api/predictions/export/{export_format}/', params)
+        if response.status_code != 200:
+            return response, None
+        with CaptureQueriesContext(connection) as queries:
+            body = b''.join(response.streaming_content).decode()
+        self.page_queries = len(queries)
+        return response, body
+
+    def test_csv_pages_through_every_row_once(self):
+        response, body = self.export('csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('attachment;', response['Content-Disposition'])
+        rows = list(csv.DictReader(io.StringIO(body)))
+        self.assertEqual([int(row['scan_id']) for row in rows], [xray.id for xray in self.scans])
+        self.assertEqual(rows[0]['patient_id'], 'P-1')
+        self.assertEqual(rows[0]['status'], 'completed')
+        # Pages of 2, 2 and 1, then an empty page ends the export
+        self.assertEqual(self.page_queries, 4)
+
+    def test_ndjson_rows(self):
+        response, body = self.export('ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([row['scan_id'] for row in rows], [xray.id for xray in self.scans])
+        self.assertEqual(rows[0]['confidence_score'], 0.9)
+        self.assertIsNone(rows[0]['reviewed_at'])
+        datetime.fromisoformat(rows[0]['uploaded_at'])
+
+    def test_filters(self):
+        Prediction.objects.filter(xray=self.scans[0]).update(status='failed')
+        _, body = self.export('ndjson', status='failed')
+        self.assertEqual([json.loads(line)['scan_id'] for line in body.splitlines()], [self.scans[0].id])
+
+        future = (date.today() + timedelta(days=2)).isoformat()
+        _, body = self.export('ndjson', **{'from': future})
+        self.assertEqual(body, '')
+
+    def test_rejects_bad_parameters(self):
+        self.assertEqual(self.export('xml')[0].status_code, 400)
+        self.assertEqual(self.export('csv', to='yesterday')[0].status_code, 400)
+        self.assertEqual(self.export('csv', status='unknown')[0].status_code, 400)
+
+
+# ============================================
+# Worker and thread planning
+# ============================================
+
+GIB = 2 ** 30
+
+
+class CpuPlanTests(SimpleTestCase):
+    """make_plan against a fake /sys and /proc: 8 logical CPUs on 4 hyperthreaded cores"""
+
+    def host(self, files=(), cpus=range(8)):
+        sysfs = {'/proc/meminfo': f"MemTotal:       {16 * GIB // 1024} kB"}
+        for cpu in cpus:
+            topology = f'/sys/devices/system/cpu/cpu{cpu}/topology'
+            sysfs[f'{topology}/physical_package_id'] = '0'
+            sysfs[f'{topology}/core_id'] = str(cpu % 4)
+        sysfs.update(files)
+        for target, patched in (('_read', sysfs.get), ('allowed_cpus', lambda: list(cpus))):
+            patcher = mock.patch.object(cpu_plan, target, side_effect=patched)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_physical_cores_group_siblings(self):
+        self.host()
+        self.assertEqual(cpu_plan.physical_cores(range(8)), [[0, 4], [1, 5], [2, 6], [3, 7]])
+
+    def test_unlimited_host_splits_cores_between_running_inferences(self):
+        self.host()
+        plan = cpu_plan.make_plan(concurrency=2)
+        self.assertEqual(plan.host['usable'], 4)
+        self.assertEqual((plan.workers, plan.running, plan.intra_threads, plan.interop_threads), (3, 2, 2, 1))
+        self.assertEqual(plan.slots, [[0, 1, 4, 5], [2, 3, 6, 7]])
+        # The worker past the last slot stays unpinned
+        self.assertIsNone(plan.cpus_for(2))
+        self.assertIsNone(plan.cpus_for(None))
+
+    def test_cgroup_v2_quota_limits_usable_cores(self):
+        self.host({'/sys/fs/cgroup/cpu.max': '200000 100000'})
+        plan = cpu_plan.make_plan(concurrency=4)
+        self.assertEqual(plan.host['quota'], 2.0)
+        self.assertEqual(plan.host['usable'], 2)
+        self.assertEqual((plan.workers, plan.running, plan.intra_threads), (3, 2, 1))
+        self.assertEqual(plan.slots, [[0, 4], [1, 5]])
+
+    def test_fractional_cgroup_v1_quota_rounds_down(self):
+        self.host({
+            '/sys/fs/cgroup/cpu/cpu.cfs_quota_us': '150000',
+            '/sys/fs/cgroup/cpu/cpu.cfs_period_us': '100000',
+        })
+        plan = cpu_plan.make_plan(concurrency=2)
+        self.assertEqual(plan.host['quota'], 1.5)
+        self.assertEqual((plan.host['usable'], plan.workers, plan.running, plan.intra_threads), (1, 2, 1, 1))
+
+    def test_unlimited_quota_is_ignored(self):
+        self.host({'/sys/fs/cgroup/cpu.max': 'max 100000'})
+        self.assertIsNone(cpu_plan.cgroup_cpu_quota())
+        self.assertEqual(cpu_plan.make_plan().host['usable'], 4)
+
+    def test_memory_limit_caps_workers(self):
+        self.host({'/sys/fs/cgroup/memory.max': str(2 * GIB)})
+        plan = cpu_plan.make_plan(concurrency=2)
+        self.assertEqual(plan.host['memory'], 2 * GIB)
+        self.assertEqual((plan.workers, plan.running, plan.intra_threads), (1, 1, 4))
+        self.assertIn('limited by memory', plan.describe())
+
+    def test_unlimited_memory_falls_back_to_host_total(self):
+        self.host({'/sys/fs/cgroup/memory/memory.limit_in_bytes': str(1 << 62)})
+        self.assertEqual(cpu_plan.memory_limit(), 16 * GIB)
+
+    def test_inference_server_gets_every_usable_core(self):
+        self.host({'/sys/fs/cgroup/cpu.max': '300000 100000'})
+        plan = cpu_plan.make_plan(concurrency=2, server_mode=True)
+        self.assertEqual((plan.workers, plan.intra_threads, plan.server_threads), (7, 1, 3))
+        self.assertEqual(plan.slots, [])
+
+    def test_overrides(self):
+        self.host()
+        plan = cpu_plan.make_plan(concurrency=2, workers=5, threads=1, pin=False)
+        self.assertEqual((plan.workers, plan.running, plan.intra_threads), (5, 2, 1))
+        self.assertEqual(plan.slots, [])
+        self.assertIn('WEB_CONCURRENCY', plan.describe())
+        self.assertIn('TORCH_THREADS', plan.describe())
@@ -0,0 +1,73 @@
+"""
+Token merging (ToMe, Bolya et al. 2023) for the ViT encoder.
+
+Between the attention and MLP halves of a block, the r most similar pairs
+of patch tokens are averaged into one, so later blocks process fewer
+tokens. Similarity is measured on the attention keys. The CLS token is
+never merged. Each token carries a size (how many patches it stands for)
+which weights later averages and the attention softmax, and optionally a
+source map back to the original patches so the CLS attention can still be
+drawn as a full patch-grid heatmap.
+"""
+import torch
+
+
+def parse_schedule(spec, depth):
+    """
+    Per-block merge counts from a setting value: '' or '0' (off), '8'
+    (8 tokens per block), or a comma-separated list, one entry per block
+    (missing entries are 0).
+    """
+    spec = str(spec or '').strip()
+    if not spec:
+        return None
+    values = [int(v) for v in spec.split(',') if v.strip()]
+    if len(values) == 1:
+        values = values * depth
+    values = (values + [0] * depth)[:depth]
+    return values if any(values) else None
+
+
+def bipartite_soft_matching(metric, r):
+    """
+    Return a merge(x, mode) function that folds the r most similar tokens of
+    set A (even positions) into their best match in set B (odd positions).
+    Position 0 (CLS) is in A and is protected.
+    """
+    tokens = metric.shape[1]
+    r = min(r, (tokens - 1) // 2)
+    if r <= 0:
+        return lambda x, mode='sum': x
+
+    with torch.no_grad():
+        metric = metric / metric.norm(dim=-1, keepdim=True)
+        a, b = metric[..., ::2, :], metric[..., 1::2, :]
+        scores = a @ b.transpose(-1, -2)
+        scores[..., 0, :] = -float('inf')
+
+        node_max, node_idx = scores.max(dim=-1)
+        edge_idx = node_max.argsort(dim=-1, descending=True)[..., None]
+        unmerged_idx = edge_idx[..., r:, :]
+        src_idx = edge_idx[..., :r, :]
+        dst_idx = node_idx[..., None].gather(dim=-2, index=src_idx)
+        # Keep A tokens in their original order so CLS stays at position 0
+        unmerged_idx = unmerged_idx.sort(dim=1)[0]
+
+    def merge(x, mode='sum'):
+        src, dst = x[..., ::2, :], x[..., 1::2, :]
+        n, t1, c = src.shape
+        unmerged = src.gather(dim=-2, index=unmerged_idx.expand(n, t1 - r, c))
+        src = src.gather(dim=-2, index=src_idx.expand(n, r, c))
+        dst = dst.scatter_reduce(-2, dst_idx.expand(n, r, c), src, reduce=mode)
+        return torch.cat([unmerged, dst], dim=1)
+
+    return merge
+
+
+def merge_tokens(merge, x, size, source=None):
+    """Size-weighted average merge of tokens x (B, N, C) with sizes (B, N, 1)."""
+    x = merge(x * size, mode='sum')
+    size = merge(size, mode='sum')
+    if source is not None:
+        source = merge(source, mode='sum')
+    return x / size, size, source
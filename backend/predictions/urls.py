@@ -28,4 +28,28 @@ urlpatterns = [
     # Includes prediction, attention heatmap, and recommendations
     # GET /api/predictions/scans/<scan_id>/
     path('scans/<int:scan_id>/', views.get_scan_details, name='scan-details'),
+
+    # Bulk Review: Record dentist verdicts for many predictions in one request
+    # POST /api/predictions/reviews/bulk/
+    path('reviews/bulk/', views.bulk_review_predictions, name='bulk-review'),
+
+    # Bulk Patient Deletion: queued for the run_patient_deletions worker (202), then poll the job
+    # POST /api/predictions/patient-deletions/
+    # GET /api/predictions/patient-deletions/<job_id>/
+    path('patient-deletions/', views.bulk_delete_patients, name='bulk-delete-patients'),
+    path('patient-deletions/<int:job_id>/', views.patient_deletion_status, name='patient-deletion-status'),
+
+    # Export: Stream full scan/prediction history (filters: from, to, status)
+    # GET /api/predictions/export/csv/ or /api/predictions/export/ndjson/
+    path('export/<str:export_format>/', views.export_predictions, name='export-predictions'),
+
+    # PDF Reports: rendered in the background, 202 until ready, then the PDF
+    # GET /api/predictions/scans/<scan_id>/report/
+    # GET /api/predictions/patients/<patient_id>/report/
+    path('scans/<int:scan_id>/report/', views.scan_report, name='scan-report'),
+    path('patients/<int:patient_id>/report/', views.patient_report, name='patient-report'),
+
+    # Similar Cases: the dentist's scans closest to this one by model embedding
+    # GET /api/predictions/scans/<scan_id>/similar/?limit=10&reviewed=true
+    path('scans/<int:scan_id>/similar/', views.similar_scans, name='similar-scans'),
 ]
\ No newline at end of file
@@ -0,0 +1,90 @@
+"""
+Pre-ingest checks for uploaded radiographs.
+
+Runs before anything is stored or written to the database. Pillow's
+Image.open only parses the file header, so format, dimensions and mode are
+known without decoding a single pixel. A non-image, a corrupt header, an
+unsupported format, or a file over the byte or pixel limits is rejected
+here instead of costing a media write, two inserts and a failed inference.
+The pixel limit also guards against decompression bombs: small files that
+claim to be enormous images.
+"""
+import os
+import warnings
+
+from django.conf import settings
+from PIL import Image, UnidentifiedImageError
+from rest_framework import status
+
+# Pillow format name -> extension the stored file gets
+SUPPORTED_FORMATS = {
+    'JPEG': 'jpg',
+    'PNG': 'png',
+    'BMP': 'bmp',
+    'TIFF': 'tif',
+    'WEBP': 'webp',
+}
+# Modes that convert('RGB') handles for inference
+SUPPORTED_MODES = {
+    '1', 'L', 'LA', 'P', 'PA', 'RGB', 'RGBA', 'RGBX', 'CMYK', 'YCbCr',
+    'I', 'I;16', 'I;16B', 'I;16L', 'F',
+}
+MIN_IMAGE_SIDE = 32
+
+
+class InvalidImage(Exception):
+    def __init__(self, reason, status_code=status.HTTP_400_BAD_REQUEST):
+        super().__init__(reason)
+        self.reason = reason
+        self.status_code = status_code
+
+
+def probe_image(upload):
+    """
+    Check an uploaded file from its header alone and return
+    {'format', 'width', 'height', 'mode'}. Raises InvalidImage. The file is
+    rewound afterwards, and its name gets the extension of the detected
+    format.
+    """
+    max_bytes = getattr(settings, 'UPLOAD_MAX_BYTES', 25 * 1024 * 1024)
+    max_pixels = getattr(settings, 'UPLOAD_MAX_PIXELS', 40_000_000)
+
+    if upload.size > max_bytes:
+        raise InvalidImage(f"Image file is larger than {max_bytes // (1024 * 1024)} MB",
+                           status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    try:
+        with warnings.catch_warnings():
+            # Pillow warns above its own bomb threshold; our limit applies instead
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            with Image.open(upload) as image:
+                info = {
+                    'format': image.format,
+                    'width': image.width,
+                    'height': image.height,
+                    'mode': image.mode,
+                }
+    except Image.DecompressionBombError:
+        raise InvalidImage(f"Image has more than {max_pixels:,} pixels",
+                           status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        raise InvalidImage('File is not a readable image')
+    finally:
+        upload.seek(0)
+
+    if info['format'] not in SUPPORTED_FORMATS:
+        raise InvalidImage(f"Unsupported image format: {info['format']}",
+                           status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+    if info['mode'] not in SUPPORTED_MODES:
+        raise InvalidImage(f"Unsupported image mode: {info['mode']}",
+                           status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+    if info['width'] * info['height'] > max_pixels:
+        raise InvalidImage(f"Image has more than {max_pixels:,} pixels",
+                           status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    if min(info['width'], info['height']) < MIN_IMAGE_SIDE:
+        raise InvalidImage(f"Image is smaller than {MIN_IMAGE_SIDE}x{MIN_IMAGE_SIDE} pixels")
+
+    # Store under the real format's extension, whatever the client called it
+    stem = os.path.splitext(os.path.basename(upload.name or ''))[0] or 'xray'
+    upload.name = f"{stem}.{SUPPORTED_FORMATS[info['format']]}"
+    return info
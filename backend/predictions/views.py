@@ -4,9 +4,54 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
-from .models import Patient, XRayImage, Prediction
-from .serializers import PatientSerializer, XRayImageSerializer, PredictionSerializer
+from django.db import transaction
+from django.http import FileResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+import csv
+import json
+from .models import Patient, PatientDeletion, XRayImage, Prediction
+from .serializers import PatientSerializer, XRayImageSerializer, PredictionSerializer, PredictionReviewSerializer
 from .ml_inference import CariesDetector
+from .admission import get_admission, inference_slot
+from .validation import InvalidImage, probe_image
+from . import reports
+from .embeddings import similar_predictions
+from .media import signed_media_url
+from .cleanup import delete_patients, queue_bulk_delete
+from .cache import cached_response, invalidate_scans, patient_version_key, scan_version_key, stats_version_key
+
+MAX_BULK_REVIEWS = 1000
+MAX_BULK_DELETES = 1000
+MAX_SIMILAR_SCANS = 50
+
+# Columns of the prediction history export, in output order
+EXPORT_FIELDS = [
+    ('scan_id', 'id'),
+    ('uploaded_at', 'uploaded_at'),
+    ('image_type', 'image_type'),
+    ('tooth_region', 'tooth_region'),
+    ('notes', 'notes'),
+    ('patient_id', 'patient__patient_id'),
+    ('patient_first_name', 'patient__first_name'),
+    ('patient_last_name', 'patient__last_name'),
+    ('prediction_id', 'prediction__id'),
+    ('status', 'prediction__status'),
+    ('has_caries', 'prediction__has_caries'),
+    ('confidence_score', 'prediction__confidence_score'),
+    ('confidence_has_caries', 'prediction__confidence_has_caries'),
+    ('confidence_no_caries', 'prediction__confidence_no_caries'),
+    ('model_version', 'prediction__model_version'),
+    ('processing_time_ms', 'prediction__processing_time_ms'),
+    ('reviewed', 'prediction__reviewed'),
+    ('dentist_diagnosis', 'prediction__dentist_diagnosis'),
+    ('dentist_notes', 'prediction__dentist_notes'),
+    ('reviewed_at', 'prediction__reviewed_at'),
+    ('predicted_at', 'prediction__created_at'),
+]
+EXPORT_CHUNK_ROWS = 500
+EXPORT_PAGE_ROWS = 2000
+
 
 class PatientViewSet(viewsets.ModelViewSet):
     serializer_class = PatientSerializer
@@ -23,7 +68,8 @@ class PatientViewSet(viewsets.ModelViewSet):
 
     def perform_destroy(self, instance):
         xray_count = instance.xrays.count()
-        instance.delete()
+        # Also removes the radiographs and cached reports once committed
+        delete_patients([instance])
         print(f"Deleted patient {instance.patient_id} with {xray_count} X-rays")
 
 
@@ -33,6 +79,11 @@ def upload_and_predict(request):
     """
     Upload X-ray image and get AI prediction with attention visualization
     Supports both single and bulk upload workflows
+
+    Non-images and oversized images are rejected from their header alone
+    (400/413/415) before anything is stored. Only then is an inference slot
+    taken: when all slots and the short wait queue are busy, responds 429
+    with Retry-After, still before anything is stored.
     """
     
     # Validate required fields
@@ -44,6 +95,12 @@ def upload_and_predict(request):
             {'error': 'patient_id and image are required'},
             status=status.HTTP_400_BAD_REQUEST
         )
+
+    # Header-only checks before anything is stored
+    try:
+        probe_image(image)
+    except InvalidImage as e:
+        return Response({'error': e.reason}, status=e.status_code)
     
     # Get patient
     patient = get_object_or_404(
@@ -52,38 +109,46 @@ def upload_and_predict(request):
         created_by=request.user
     )
     
-    # Save X-ray image
-    xray = XRayImage.objects.create(
-        patient=patient,
-        uploaded_by=request.user,
-        image=image,
-        image_type=request.data.get('image_type', 'bitewing'),
-        tooth_region=request.data.get('tooth_region', ''),
-        notes=request.data.get('notes', '')
-    )
-    
-    # Create prediction entry
-    prediction = Prediction.objects.create(
-        xray=xray,
-        status='processing',
-        has_caries=False,
-        confidence_score=0.0,
-        predicted_class=0,
-        confidence_no_caries=0.0,
-        confidence_has_caries=0.0,
-        processing_time_ms=0.0
-    )
+    # Valid upload: wait for an inference slot before storing it, so a 429
+    # leaves nothing behind. It is released right after the forward pass.
+    slot = inference_slot(request.user.id)
+    try:
+        # Save X-ray image
+        xray = XRayImage.objects.create(
+            patient=patient,
+            uploaded_by=request.user,
+            image=image,
+            image_type=request.data.get('image_type', 'bitewing'),
+            tooth_region=request.data.get('tooth_region', ''),
+            notes=request.data.get('notes', '')
+        )
+
+        # Create prediction entry
+        prediction = Prediction.objects.create(
+            xray=xray,
+            status='processing',
+            has_caries=False,
+            confidence_score=0.0,
+            predicted_class=0,
+            confidence_no_caries=0.0,
+            confidence_has_caries=0.0,
+            processing_time_ms=0.0
+        )
+    except BaseException:
+        slot.close()
+        raise
     
     # Run AI inference with attention and recommendations
     try:
-        detector = CariesDetector()
-        
-        # Get prediction with attention heatmap and recommendations
-        result = detector.predict(
-            xray.image.path,
-            return_attention=True,
-            return_recommendations=True
-        )
+        with slot:
+            detector = CariesDetector()
+
+            # Get prediction with attention heatmap and recommendations
+            result = detector.predict(
+                xray.image.path,
+                return_attention=True,
+                return_recommendations=True
+            )
         
         if result['success']:
             # Update prediction with results
@@ -94,6 +159,8 @@ def upload_and_predict(request):
             prediction.predicted_class = result['predicted_class']
             prediction.processing_time_ms = result['processing_time_ms']
             prediction.model_version = result.get('model_version', 'MAE-ViT-v2.0')
+            prediction.embedding = result.get('embedding')
+            prediction.embedding_version = result.get('embedding_version', '')
             prediction.status = 'completed'
             prediction.save()
             
@@ -107,7 +174,7 @@ def upload_and_predict(request):
                     'image_type': xray.image_type,
                     'tooth_region': xray.tooth_region,
                     'notes': xray.notes,
-                    'image_url': request.build_absolute_uri(xray.image.url)
+                    'image_url': signed_media_url(xray.image, request)
                 },
                 'prediction': {
                     'id': prediction.id,
@@ -123,6 +190,7 @@ def upload_and_predict(request):
                 },
                 'explainability': {
                     'attention_heatmap': result.get('attention_heatmap'),
+                    'tiles': result.get('tiles'),
                     'visualization_type': 'attention_rollout',
                     'description': 'Heatmap shows areas the AI focused on when making the prediction. Warmer colors (red/yellow) indicate higher attention, cooler colors (blue) indicate lower attention.'
                 },
@@ -141,7 +209,7 @@ def upload_and_predict(request):
                 {
                     'error': 'Prediction failed',
                     'details': result.get('error', 'Unknown error'),
-                    'xray': XRayImageSerializer(xray).data,
+                    'xray': XRayImageSerializer(xray, context={'request': request}).data,
                     'prediction': PredictionSerializer(prediction).data
                 },
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -156,7 +224,7 @@ def upload_and_predict(request):
             {
                 'error': 'Prediction processing failed',
                 'details': str(e),
-                'xray': XRayImageSerializer(xray).data,
+                'xray': XRayImageSerializer(xray, context={'request': request}).data,
                 'prediction': PredictionSerializer(prediction).data
             },
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -165,6 +233,7 @@ def upload_and_predict(request):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@cached_response('stats', lambda request: [stats_version_key(request.user.id)])
 def prediction_stats(request):
     """
     Get simplified prediction statistics for the dashboard
@@ -201,6 +270,7 @@ def prediction_stats(request):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@cached_response('patient_scans', lambda request, patient_id: [patient_version_key(patient_id)])
 def get_patient_scans(request, patient_id):
     """Get all scans for a specific patient with prediction results"""
     try:
@@ -240,7 +310,7 @@ def get_patient_scans(request, patient_id):
                 'image_type': scan.image_type,
                 'tooth_region': scan.tooth_region,
                 'notes': scan.notes,
-                'image_url': request.build_absolute_uri(scan.image.url) if scan.image else None,
+                'image_url': signed_media_url(scan.image, request),
                 'prediction': prediction_data
             }
             
@@ -274,6 +344,7 @@ def get_patient_scans(request, patient_id):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@cached_response('scan_details', lambda request, scan_id: [scan_version_key(scan_id)])
 def get_scan_details(request, scan_id):
     """
     Get detailed information about a specific scan with attention visualization
@@ -291,6 +362,7 @@ def get_scan_details(request, scan_id):
         prediction_data = None
         attention_heatmap = None
         recommendations = None
+        degraded = False
         
         try:
             prediction = Prediction.objects.get(xray=scan, status='completed')
@@ -306,29 +378,34 @@ def get_scan_details(request, scan_id):
                 'created_at': prediction.created_at.isoformat()
             }
             
-            # Re-generate attention and recommendations for this scan
-            try:
-                detector = CariesDetector()
-                result = detector.predict(
-                    scan.image.path,
-                    return_attention=True,
-                    return_recommendations=True
-                )
-                
-                if result['success']:
-                    attention_heatmap = result.get('attention_heatmap')
-                    recommendations = result.get('recommendations')
-            except Exception as e:
-                print(f"Error generating attention/recommendations: {e}")
-                # Continue without attention/recommendations
+            # Re-generate attention and recommendations for this scan if an
+            # inference slot is free right now. They are optional: when
+            # saturated, the page is served without them and not cached.
+            slot = get_admission().try_acquire(request.user.id)
+            if slot is None:
+                degraded = True
+            else:
+                with slot:
+                    try:
+                        detector = CariesDetector()
+                        result = detector.predict(
+                            scan.image.path,
+                            return_attention=True,
+                            return_recommendations=True
+                        )
+
+                        if result['success']:
+                            attention_heatmap = result.get('attention_heatmap')
+                            recommendations = result.get('recommendations')
+                    except Exception as e:
+                        print(f"Error generating attention/recommendations: {e}")
+                        # Continue without attention/recommendations
             
         except Prediction.DoesNotExist:
             prediction_data = None
         
-        # Build absolute URL for image
-        image_url = None
-        if scan.image:
-            image_url = request.build_absolute_uri(scan.image.url)
+        # Signed, short-lived image URL
+        image_url = signed_media_url(scan.image, request)
         
         response_data = {
             'xray': {
@@ -356,7 +433,11 @@ def get_scan_details(request, scan_id):
         if recommendations:
             response_data['recommendations'] = recommendations
         
-        return Response(response_data)
+        response = Response(response_data)
+        if degraded:
+            # Served without the heatmap; let the next request try again
+            response['Cache-Control'] = 'no-store'
+        return response
         
     except XRayImage.DoesNotExist:
         return Response(
@@ -367,4 +448,360 @@ def get_scan_details(request, scan_id):
         return Response(
             {'error': f'Failed to load scan details: {str(e)}'},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
\ No newline at end of file
+        )
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def bulk_review_predictions(request):
+    """
+    Record dentist verdicts for many predictions at once.
+
+    Body: {"reviews": [{"prediction_id": 1, "dentist_diagnosis": true,
+                        "dentist_notes": "..."}, ...]}
+    Valid items are saved together; every item gets its own outcome.
+    """
+    reviews = request.data.get('reviews')
+    if not isinstance(reviews, list) or not reviews:
+        return Response(
+            {'error': 'reviews must be a non-empty list'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if len(reviews) > MAX_BULK_REVIEWS:
+        return Response(
+            {'error': f'At most {MAX_BULK_REVIEWS} reviews per request'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    results = [None] * len(reviews)
+    verdicts = {}
+    for index, item in enumerate(reviews):
+        serializer = PredictionReviewSerializer(data=item)
+        if not serializer.is_valid():
+            results[index] = {'status': 'invalid', 'errors': serializer.errors}
+            continue
+        prediction_id = serializer.validated_data['prediction_id']
+        if prediction_id in verdicts:
+            results[index] = {'prediction_id': prediction_id, 'status': 'duplicate'}
+            continue
+        verdicts[prediction_id] = (index, serializer.validated_data)
+
+    # Ownership check for the whole batch in one query
+    owned = {
+        prediction.id: prediction
+        for prediction in Prediction.objects.filter(
+            id__in=verdicts.keys(),
+            xray__uploaded_by=request.user
+        ).select_related('xray')
+    }
+
+    now = timezone.now()
+    to_update = []
+    for prediction_id, (index, data) in verdicts.items():
+        prediction = owned.get(prediction_id)
+        if prediction is None:
+            results[index] = {'prediction_id': prediction_id, 'status': 'not_found'}
+            continue
+        if prediction.status != 'completed':
+            results[index] = {'prediction_id': prediction_id, 'status': 'not_completed'}
+            continue
+        prediction.reviewed = True
+        prediction.reviewed_by = request.user
+        prediction.dentist_diagnosis = data['dentist_diagnosis']
+        prediction.dentist_notes = data['dentist_notes']
+        prediction.reviewed_at = now
+        prediction.updated_at = now
+        to_update.append(prediction)
+        results[index] = {
+            'prediction_id': prediction_id,
+            'status': 'updated',
+            'agrees_with_model': prediction.has_caries == prediction.dentist_diagnosis,
+        }
+
+    with transaction.atomic():
+        Prediction.objects.bulk_update(
+            to_update,
+            ['reviewed', 'reviewed_by', 'dentist_diagnosis', 'dentist_notes',
+             'reviewed_at', 'updated_at'],
+            batch_size=200
+        )
+        # bulk_update skips model signals, so invalidate cached reads here
+        invalidate_scans(
+            (p.xray_id, p.xray.patient_id, p.xray.uploaded_by_id) for p in to_update
+        )
+
+    return Response({
+        'updated': len(to_update),
+        'failed': len(reviews) - len(to_update),
+        'results': results,
+    })
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def bulk_delete_patients(request):
+    """
+    Delete many patients, with their scans, predictions and files, in the background.
+
+    Body: {"patient_ids": [1, 2, ...]} (database ids)
+    Answers 202 with a job to poll at patient-deletions/<job_id>/; the
+    run_patient_deletions worker carries it out.
+    Ids that are not the user's patients are listed under not_found.
+    """
+    patient_ids = request.data.get('patient_ids')
+    if (not isinstance(patient_ids, list) or not patient_ids
+            or not all(isinstance(i, int) and not isinstance(i, bool) for i in patient_ids)):
+        return Response(
+            {'error': 'patient_ids must be a non-empty list of integers'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if len(patient_ids) > MAX_BULK_DELETES:
+        return Response(
+            {'error': f'At most {MAX_BULK_DELETES} patients per request'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    owned = list(
+        Patient.objects.filter(id__in=patient_ids, created_by=request.user)
+        .order_by('id').values_list('id', flat=True)
+    )
+    if not owned:
+        return Response({'error': 'No matching patients'}, status=status.HTTP_404_NOT_FOUND)
+
+    job = queue_bulk_delete(request.user, owned)
+    return Response({
+        'job_id': job.id,
+        'status': job.status,
+        'total': len(owned),
+        'not_found': sorted(set(patient_ids) - set(owned)),
+    }, status=status.HTTP_202_ACCEPTED)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def patient_deletion_status(request, job_id):
+    """Progress of a bulk patient deletion: queued, running, completed or failed."""
+    job = PatientDeletion.objects.filter(id=job_id, requested_by=request.user).first()
+    if job is None:
+        return Response({'error': 'Deletion job not found'}, status=status.HTTP_404_NOT_FOUND)
+    return Response({
+        'job_id': job.id,
+        'status': job.status,
+        'total': len(job.patient_ids),
+        'deleted': job.deleted,
+        'attempts': job.attempts,
+        'error': job.last_error or None,
+        'created_at': job.created_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    })
+
+
+
+class _Echo:
+    """File-like object whose write() just returns the value, for csv.writer"""
+    def write(self, value):
+        return value
+
+
+def _export_rows(scans):
+    """
+    Export rows of `scans` in id order, read in keyset pages. Each page is a
+    separate bounded query: MySQL drivers buffer a whole result set client
+    side, so a single .iterator() query would hold the entire export.
+    """
+    columns = [column for column, _ in EXPORT_FIELDS]
+    fields = [field for _, field in EXPORT_FIELDS]
+    last_id = 0
+    while True:
+        page = list(scans.filter(id__gt=last_id).order_by('id').values_list(*fields)[:EXPORT_PAGE_ROWS])
+        if not page:
+            return
+        for values in page:
+            row = dict(zip(columns, values))
+            for column in ('uploaded_at', 'reviewed_at', 'predicted_at'):
+                if row[column] is not None:
+                    row[column] = row[column].isoformat()
+            yield row
+        last_id = page[-1][0]
+
+
+def _stream_csv(scans):
+    writer = csv.writer(_Echo())
+    columns = [column for column, _ in EXPORT_FIELDS]
+    chunk = [writer.writerow(columns)]
+    for row in _export_rows(scans):
+        chunk.append(writer.writerow([row[column] for column in columns]))
+        if len(chunk) >= EXPORT_CHUNK_ROWS:
+            yield ''.join(chunk)
+            chunk = []
+    yield ''.join(chunk)
+
+
+def _stream_ndjson(scans):
+    chunk = []
+    for row in _export_rows(scans):
+        chunk.append(json.dumps(row) + '\n')
+        if len(chunk) >= EXPORT_CHUNK_ROWS:
+            yield ''.join(chunk)
+            chunk = []
+    yield ''.join(chunk)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_predictions(request, export_format):
+    """
+    Stream the user's full scan and prediction history as CSV or NDJSON.
+
+    Query params: from / to (YYYY-MM-DD, upload date, inclusive) and
+    status (a prediction status). Patient, X-ray and prediction columns come
+    from one joined query, read in keyset pages of EXPORT_PAGE_ROWS, so
+    memory stays flat however long the history is.
+    """
+    streams = {
+        'csv': (_stream_csv, 'text/csv'),
+        'ndjson': (_stream_ndjson, 'application/x-ndjson'),
+    }
+    if export_format not in streams:
+        return Response(
+            {'error': 'Export format must be csv or ndjson'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    scans = XRayImage.objects.filter(uploaded_by=request.user)
+
+    for param, lookup in (('from', 'uploaded_at__date__gte'), ('to', 'uploaded_at__date__lte')):
+        value = request.query_params.get(param)
+        if value:
+            parsed = parse_date(value)
+            if parsed is None:
+                return Response(
+                    {'error': f'{param} must be a date in YYYY-MM-DD format'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            scans = scans.filter(**{lookup: parsed})
+
+    status_filter = request.query_params.get('status')
+    if status_filter:
+        valid_statuses = [choice for choice, _ in Prediction._meta.get_field('status').choices]
+        if status_filter not in valid_statuses:
+            return Response(
+                {'error': f"status must be one of: {', '.join(valid_statuses)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        scans = scans.filter(prediction__status=status_filter)
+
+    stream, content_type = streams[export_format]
+    response = StreamingHttpResponse(stream(scans), content_type=content_type)
+    filename = f"tunzadent_export_{timezone.now():%Y%m%d}.{export_format}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+
+def _report_response(request, key, kind, obj_id, filename):
+    """Serve a cached report with ETag revalidation, or queue it and answer 202"""
+    etag = f'"{key}"'
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    path, error = reports.request_report(key, kind, obj_id)
+    if error:
+        return Response(
+            {'error': f'Report generation failed: {error}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    if path is None:
+        response = Response(
+            {'status': 'rendering', 'message': 'Report is being generated, retry shortly'},
+            status=status.HTTP_202_ACCEPTED
+        )
+        response['Retry-After'] = '2'
+        return response
+
+    response = FileResponse(open(path, 'rb'), content_type='application/pdf', filename=filename)
+    response['ETag'] = etag
+    # Content is immutable per key, but the key changes on review, so revalidate
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def scan_report(request, scan_id):
+    """Get the PDF clinical report for a scan (202 while it renders)"""
+    prediction = get_object_or_404(
+        Prediction.objects.select_related('xray__patient'),
+        xray_id=scan_id,
+        xray__uploaded_by=request.user,
+        status='completed'
+    )
+    return _report_response(
+        request, reports.scan_report_key(prediction), 'scan',
+        prediction.id, f"scan_{scan_id}_report.pdf"
+    )
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def patient_report(request, patient_id):
+    """Get the PDF scan-history report for a patient (202 while it renders)"""
+    patient = get_object_or_404(Patient, id=patient_id, created_by=request.user)
+    return _report_response(
+        request, reports.patient_report_key(patient), 'patient',
+        patient.id, f"patient_{patient.patient_id}_report.pdf"
+    )
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def similar_scans(request, scan_id):
+    """
+    Get the dentist's previous scans that look most like this one.
+    Query params: limit (default 10), reviewed (default true: only
+    dentist-reviewed scans).
+    """
+    prediction = get_object_or_404(
+        Prediction,
+        xray_id=scan_id,
+        xray__uploaded_by=request.user,
+        status='completed'
+    )
+    if not prediction.embedding:
+        return Response(
+            {'error': 'No embedding stored for this scan; it predates similar-case search'},
+            status=status.HTTP_409_CONFLICT
+        )
+
+    try:
+        limit = min(max(int(request.query_params.get('limit', 10)), 1), MAX_SIMILAR_SCANS)
+    except ValueError:
+        return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    reviewed_only = request.query_params.get('reviewed', 'true').lower() != 'false'
+
+    matches = similar_predictions(prediction, request.user.id, limit=limit, reviewed_only=reviewed_only)
+    results = []
+    for match, similarity in matches:
+        xray = match.xray
+        results.append({
+            'scan_id': xray.id,
+            'similarity': round(similarity, 4),
+            'patient_id': xray.patient.id,
+            'patient_name': f"{xray.patient.first_name} {xray.patient.last_name}",
+            'uploaded_at': xray.uploaded_at.isoformat(),
+            'image_type': xray.image_type,
+            'tooth_region': xray.tooth_region,
+            'image_url': signed_media_url(xray.image, request),
+            'prediction': {
+                'id': match.id,
+                'has_caries': match.has_caries,
+                'confidence_score': float(match.confidence_score),
+                'reviewed': match.reviewed,
+                'dentist_diagnosis': match.dentist_diagnosis,
+                'dentist_notes': match.dentist_notes,
+            }
+        })
+
+    return Response({'scan_id': scan_id, 'count': len(results), 'results': results})
@@ -0,0 +1,281 @@
+"""
+Worker and thread planning from the host's CPU topology.
+
+Every gunicorn worker runs the model with PyTorch's default of one
+intra-op thread per logical CPU, so four workers on a four-core box can
+run sixteen threads that fight over the same cores. The planner looks at
+what this container can actually use:
+- the CPUs in its affinity mask, grouped into physical cores
+- the cgroup CPU quota
+- the cgroup or host memory limit
+It then chooses:
+- how many workers to run
+- how many intra-op and inter-op threads each one gets
+- which cores each one is pinned to
+
+Threads are budgeted against INFERENCE_CONCURRENCY, the number of forward
+passes admission control lets run at once on a host. The usable cores are
+split into that many slots. With the inference server (INFERENCE_SERVER_SOCKET),
+the server gets every core and web workers get one thread.
+
+gunicorn.conf.py applies the plan. `manage.py cpu_plan --measure` prints it
+with the single-request and saturated throughput measured on this host.
+"""
+import math
+import multiprocessing
+import os
+import time
+from pathlib import Path
+
+# Resident memory of a worker that loads the model (ViT-B weights plus the
+# torch runtime), and of one that leaves it to the inference server
+WORKER_MEMORY_MB = 900
+LIGHT_WORKER_MEMORY_MB = 250
+# Fraction of the memory limit workers may use; the rest is headroom
+MEMORY_BUDGET = 0.8
+
+
+# ============================================
+# Host inspection
+# ============================================
+
+def _read(path):
+    try:
+        return Path(path).read_text().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_quota():
+    """CPUs allowed by the cgroup quota (may be fractional), or None if unlimited."""
+    value = _read('/sys/fs/cgroup/cpu.max')  # v2: "<quota> <period>" or "max <period>"
+    if value:
+        quota, _, period = value.partition(' ')
+        if quota != 'max':
+            return int(quota) / int(period or 100000)
+        return None
+    quota = _read('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')  # v1
+    period = _read('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def memory_limit():
+    """Bytes of memory available to this container: cgroup limit or host total."""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        value = _read(path)
+        # v1 reports "unlimited" as a huge number
+        if value and value != 'max' and int(value) < 1 << 60:
+            return int(value)
+    meminfo = _read('/proc/meminfo') or ''
+    for line in meminfo.splitlines():
+        if line.startswith('MemTotal:'):
+            return int(line.split()[1]) * 1024
+    return None
+
+
+def allowed_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def physical_cores(cpus):
+    """Group logical CPUs into physical cores: [[cpu, sibling, ...], ...]."""
+    cores = {}
+    for cpu in cpus:
+        topology = f'/sys/devices/system/cpu/cpu{cpu}/topology'
+        package = _read(f'{topology}/physical_package_id')
+        core = _read(f'{topology}/core_id')
+        key = (package, core) if core is not None else ('cpu', cpu)
+        cores.setdefault(key, []).append(cpu)
+    return sorted(cores.values())
+
+
+# ============================================
+# Plan
+# ============================================
+
+class CpuPlan:
+    """Worker count, per-worker threads and core pinning for one host."""
+
+    def __init__(self, workers, running, intra_threads, interop_threads, slots, server_threads, host, notes):
+        self.workers = workers
+        # Forward passes that can run at the same time
+        self.running = running
+        self.intra_threads = intra_threads
+        self.interop_threads = interop_threads
+        # CPU sets to pin workers to, one per slot; empty when not pinning
+        self.slots = slots
+        self.server_threads = server_threads
+        self.host = host
+        self.notes = notes
+
+    def cpus_for(self, slot):
+        """CPUs for the worker in `slot`; None (unpinned) past the last slot."""
+        if slot is None or slot >= len(self.slots):
+            return None
+        return self.slots[slot]
+
+    def describe(self):
+        host = self.host
+        quota = f"{host['quota']:g}" if host['quota'] else 'none'
+        memory = f"{host['memory'] / 2**30:.1f} GiB" if host['memory'] else 'unknown'
+        pinning = ' '.join(','.join(map(str, s)) for s in self.slots) if self.slots else 'off'
+        lines = [
+            f"CPU plan: {self.workers} workers x {self.intra_threads} intra-op / "
+            f"{self.interop_threads} inter-op threads",
+            f"  host: {len(host['cpus'])} logical CPUs, {host['cores']} physical cores, "
+            f"cgroup quota {quota}, memory {memory} -> {host['usable']} usable cores",
+            f"  pinning: {pinning}",
+        ]
+        if self.server_threads:
+            lines.append(f"  inference server: {self.server_threads} threads")
+        lines.extend(f"  {note}" for note in self.notes)
+        return '\n'.join(lines)
+
+
+def make_plan(concurrency=2, workers=0, threads=0, worker_memory_mb=0,
+              server_mode=False, pin=True):
+    """
+    Plan for this host. `workers` and `threads` override the automatic
+    choice when non-zero; `concurrency` is INFERENCE_CONCURRENCY.
+    """
+    cpus = allowed_cpus()
+    cores = physical_cores(cpus)
+    quota = cgroup_cpu_quota()
+    memory = memory_limit()
+    usable = len(cores)
+    if quota:
+        usable = min(usable, max(1, math.floor(quota)))
+    host = {'cpus': cpus, 'cores': len(cores), 'quota': quota, 'memory': memory, 'usable': usable}
+    notes = []
+
+    worker_mb = worker_memory_mb or (LIGHT_WORKER_MEMORY_MB if server_mode else WORKER_MEMORY_MB)
+    budget_mb = memory * MEMORY_BUDGET / 2**20 if memory else None
+    if server_mode and budget_mb:
+        budget_mb -= WORKER_MEMORY_MB  # the server's copy of the model
+
+    if workers:
+        notes.append(f"worker count fixed at {workers} (WEB_CONCURRENCY)")
+    else:
+        # Enough workers to keep every inference slot busy plus one for
+        # everything else; light workers can follow the usual 2n+1
+        workers = 2 * usable + 1 if server_mode else min(concurrency, usable) + 1
+        if budget_mb is not None and budget_mb // worker_mb < workers:
+            workers = int(max(1, budget_mb // worker_mb))
+            notes.append(f"worker count limited by memory ({worker_mb} MB each)")
+
+    if server_mode:
+        # The server runs one forward at a time
+        return CpuPlan(workers, 1, 1, 1, [], threads or usable, host, notes)
+
+    # Forward passes that can run at once, each on its own share of cores
+    running = max(1, min(workers, concurrency, usable))
+    intra = threads or max(1, usable // running)
+    if threads:
+        notes.append(f"intra-op threads fixed at {threads} (TORCH_THREADS)")
+
+    slots = []
+    if pin:
+        # Slots of `intra` physical cores, with their hyperthread siblings.
+        # Workers past the last slot are left unpinned rather than stacked on
+        # a slot another busy worker already uses.
+        slots = [sorted(cpu for core in cores[i * intra:(i + 1) * intra] for cpu in core)
+                 for i in range(usable // intra)]
+        if workers > len(slots):
+            notes.append(f"{workers - len(slots)} worker(s) beyond the {len(slots)} slot(s) are not pinned")
+
+    # The encoder is a straight chain of blocks: nothing for inter-op threads to overlap
+    return CpuPlan(workers, running, intra, 1, slots, 0, host, notes)
+
+
+def plan_from_settings():
+    from django.conf import settings
+    return make_plan(
+        concurrency=getattr(settings, 'INFERENCE_CONCURRENCY', 2),
+        workers=getattr(settings, 'WEB_CONCURRENCY', 0),
+        threads=getattr(settings, 'TORCH_THREADS', 0),
+        worker_memory_mb=getattr(settings, 'WORKER_MEMORY_MB', 0),
+        server_mode=bool(getattr(settings, 'INFERENCE_SERVER_SOCKET', '')),
+        pin=getattr(settings, 'CPU_AFFINITY', True),
+    )
+
+
+def apply(plan, slot=None, server=False):
+    """Set this process's torch threads and CPU affinity from the plan."""
+    import torch
+
+    torch.set_num_threads(plan.server_threads if server else plan.intra_threads)
+    try:
+        torch.set_num_interop_threads(plan.interop_threads)
+    except RuntimeError:
+        # Only settable before the first parallel op; keep the default
+        pass
+    cpus = plan.cpus_for(slot)
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+
+
+# ============================================
+# Measurement
+# ============================================
+
+def _bench_process(model_path, threads, cpus, seconds, barrier, results):
+    """Spawned process: forward passes on one synthetic image until time is up."""
+    import torch
+    from predictions.ml_inference import CariesClassifier
+
+    torch.set_num_threads(threads)
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    model = CariesClassifier(model_path)
+    image = torch.randn(1, 3, 224, 224)
+    with torch.inference_mode():
+        model(image)
+        # Start together so the saturated run really overlaps
+        barrier.wait()
+        count, started = 0, time.perf_counter()
+        while time.perf_counter() - started < seconds:
+            model(image)
+            count += 1
+    results.put((count, time.perf_counter() - started))
+
+
+def _run(model_path, specs, seconds):
+    """Run one bench process per (threads, cpus) spec at once; total images/s and mean ms."""
+    context = multiprocessing.get_context('spawn')
+    barrier, queue = context.Barrier(len(specs)), context.Queue()
+    processes = [context.Process(target=_bench_process, args=(model_path, t, c, seconds, barrier, queue))
+                 for t, c in specs]
+    for process in processes:
+        process.start()
+    results = [queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+    throughput = sum(count / elapsed for count, elapsed in results)
+    latency = sum(elapsed / count for count, elapsed in results) / len(results) * 1000
+    return throughput, latency
+
+
+def measure(plan, model_path, seconds=5.0):
+    """
+    Single-request and saturated throughput under `plan`: one worker alone,
+    then as many workers as can run inference at once, all busy.
+    Returns {'single': (images/s, ms), 'saturated': (images/s, ms), 'running': n}.
+    """
+    if plan.server_threads:
+        # One forward at a time: saturated is the same as single
+        single = _run(model_path, [(plan.server_threads, None)], seconds)
+        return {'single': single, 'saturated': single, 'running': 1}
+    single = _run(model_path, [(plan.intra_threads, plan.cpus_for(0))], seconds)
+    saturated = _run(model_path, [(plan.intra_threads, plan.cpus_for(i)) for i in range(plan.running)], seconds)
+    return {'single': single, 'saturated': saturated, 'running': plan.running}
+
+
+def describe_measurement(results):
+    single, saturated = results['single'], results['saturated']
+    return (f"  measured: single request {single[1]:.0f} ms ({single[0]:.2f} images/s), "
+            f"saturated with {results['running']} running {saturated[1]:.0f} ms "
+            f"({saturated[0]:.2f} images/s)")
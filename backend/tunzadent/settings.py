@@ -4,6 +4,7 @@ Django settings for tunzadent project.
 from pathlib import Path
 from decouple import config
 import os
+import tempfile
 
 # PyMySQL as drop-in replacement for mysqlclient (no native libs needed)
 import pymysql
@@ -37,6 +38,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'tunzadent.tracing.ServerTimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -68,20 +70,29 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'tunzadent.wsgi.application'
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.mysql',
-        'NAME': config('DB_NAME'),
-        'USER': config('DB_USER'),
-        'PASSWORD': config('DB_PASSWORD'),
-        'HOST': config('DB_HOST'),
-        'PORT': config('DB_PORT', default='3306'),
-        'OPTIONS': {
-            'charset': 'utf8mb4',
-            'connect_timeout': 10,
-        },
+# DB_ENGINE=sqlite gives a local stand-in for load tests and benchmarks
+if config('DB_ENGINE', default='mysql') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config('DB_NAME', default=str(BASE_DIR / 'db.sqlite3')),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.mysql',
+            'NAME': config('DB_NAME'),
+            'USER': config('DB_USER'),
+            'PASSWORD': config('DB_PASSWORD'),
+            'HOST': config('DB_HOST'),
+            'PORT': config('DB_PORT', default='3306'),
+            'OPTIONS': {
+                'charset': 'utf8mb4',
+                'connect_timeout': 10,
+            },
+        }
     }
-}
 
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -103,11 +114,14 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.CachedJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
+    # Reverse proxies in front of the app; used to find the client IP for throttling.
+    # 0 trusts only REMOTE_ADDR; X-Forwarded-For is client-controlled without a proxy
+    'NUM_PROXIES': config('NUM_PROXIES', default=0, cast=int),
 }
 
 from datetime import timedelta
@@ -117,6 +131,22 @@ SIMPLE_JWT = {
     'ROTATE_REFRESH_TOKENS': True,
 }
 
+# Per-process cache of authenticated users (see accounts/authentication.py)
+AUTH_USER_CACHE_ENABLED = config('AUTH_USER_CACHE_ENABLED', default=True, cast=bool)
+AUTH_USER_CACHE_SIZE = config('AUTH_USER_CACHE_SIZE', default=1024, cast=int)
+AUTH_USER_CACHE_TTL = config('AUTH_USER_CACHE_TTL', default=60, cast=int)
+
+# Brute-force throttling of login/2FA/verify-email (see accounts/throttling.py)
+AUTH_THROTTLE_ENABLED = config('AUTH_THROTTLE_ENABLED', default=True, cast=bool)
+AUTH_THROTTLE_WINDOW = config('AUTH_THROTTLE_WINDOW', default=300, cast=int)
+AUTH_THROTTLE_IP_LIMIT = config('AUTH_THROTTLE_IP_LIMIT', default=20, cast=int)
+AUTH_THROTTLE_ACCOUNT_LIMIT = config('AUTH_THROTTLE_ACCOUNT_LIMIT', default=5, cast=int)
+AUTH_LOCKOUT_BASE = config('AUTH_LOCKOUT_BASE', default=60, cast=int)
+AUTH_LOCKOUT_MAX = config('AUTH_LOCKOUT_MAX', default=3600, cast=int)
+
+# Lifetime of the signed token that stands in for the password during 2FA steps
+TWO_FA_CHALLENGE_MAX_AGE = config('TWO_FA_CHALLENGE_MAX_AGE', default=300, cast=int)
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
     "http://127.0.0.1:3000",
@@ -124,6 +154,7 @@ CORS_ALLOWED_ORIGINS = [
 ]
 CORS_ALLOW_ALL_ORIGINS = True  # For demo/exhibition; restrict in production
 CORS_ALLOW_CREDENTIALS = True
+CORS_EXPOSE_HEADERS = ['Retry-After', 'Server-Timing']
 
 CSRF_TRUSTED_ORIGINS = [
     "https://tunzadent.vercel.app",
@@ -132,6 +163,14 @@ CSRF_TRUSTED_ORIGINS = [
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Signed media links are valid for one to two windows of this many seconds;
+# keep it well above RESPONSE_CACHE_TIMEOUT so cached responses hold live links
+MEDIA_URL_TTL = config('MEDIA_URL_TTL', default=3600, cast=int)
+MEDIA_CACHE_MAX_AGE = config('MEDIA_CACHE_MAX_AGE', default=31536000, cast=int)
+# Hand file transfers to the front proxy: '' (stream from Django), 'nginx'
+# (X-Accel-Redirect to MEDIA_ACCEL_PREFIX) or 'sendfile' (X-Sendfile)
+MEDIA_ACCEL = config('MEDIA_ACCEL', default='')
+MEDIA_ACCEL_PREFIX = config('MEDIA_ACCEL_PREFIX', default='/protected-media/')
 
 AUTH_USER_MODEL = 'accounts.User'
 
@@ -139,17 +178,107 @@ EMAIL_BACKEND = config(
     'EMAIL_BACKEND',
     default='django.core.mail.backends.smtp.EmailBackend'
 )
-EMAIL_HOST = 'smtp.gmail.com'
-EMAIL_PORT = 587
-EMAIL_USE_TLS = True
+EMAIL_HOST = config('EMAIL_HOST', default='smtp.gmail.com')
+EMAIL_PORT = config('EMAIL_PORT', default=587, cast=int)
+EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=True, cast=bool)
+# Per-connection socket timeout for the outbox worker's SMTP connection
+EMAIL_TIMEOUT = config('EMAIL_TIMEOUT', default=10, cast=int)
 EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
 DEFAULT_FROM_EMAIL = 'noreply@tunzadent.com'
 FRONTEND_URL = config('FRONTEND_URL', default='https://tunzadent.vercel.app')
 
+# Cache: file-based by default so every worker on a host shares it (and its
+# invalidations). Point CACHE_BACKEND/CACHE_LOCATION at e.g.
+# django.core.cache.backends.redis.RedisCache for a cache shared across hosts.
+CACHE_BACKEND = config('CACHE_BACKEND', default='django.core.cache.backends.filebased.FileBasedCache')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': config('CACHE_LOCATION', default=os.path.join(tempfile.gettempdir(), 'tunzadent-cache')),
+    }
+}
+if CACHE_BACKEND.endswith(('FileBasedCache', 'LocMemCache')):
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=5000, cast=int)}
+
+RESPONSE_CACHE_ENABLED = config('RESPONSE_CACHE_ENABLED', default=True, cast=bool)
+RESPONSE_CACHE_TIMEOUT = config('RESPONSE_CACHE_TIMEOUT', default=300, cast=int)
+
+# PDF reports: rendered by the render_reports worker, cached on disk
+REPORT_CACHE_DIR = config('REPORT_CACHE_DIR', default=os.path.join(tempfile.gettempdir(), 'tunzadent-reports'))
+
+# Request tracing: Server-Timing header plus a structured log entry for slow requests
+SERVER_TIMING_ENABLED = config('SERVER_TIMING_ENABLED', default=True, cast=bool)
+SLOW_REQUEST_THRESHOLD_MS = config('SLOW_REQUEST_THRESHOLD_MS', default=1000, cast=float)
+SLOW_REQUEST_MAX_QUERIES = config('SLOW_REQUEST_MAX_QUERIES', default=10, cast=int)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'tunzadent': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# Upload limits, checked from the image header before anything is stored
+UPLOAD_MAX_BYTES = config('UPLOAD_MAX_BYTES', default=25 * 1024 * 1024, cast=int)
+UPLOAD_MAX_PIXELS = config('UPLOAD_MAX_PIXELS', default=40_000_000, cast=int)
+
+# Inference admission control (shared by all workers on a host via file locks)
+INFERENCE_CONCURRENCY = config('INFERENCE_CONCURRENCY', default=2, cast=int)
+INFERENCE_QUEUE_SIZE = config('INFERENCE_QUEUE_SIZE', default=4, cast=int)
+INFERENCE_QUEUE_TIMEOUT = config('INFERENCE_QUEUE_TIMEOUT', default=2.0, cast=float)
+INFERENCE_USER_SHARE = config('INFERENCE_USER_SHARE', default=0.5, cast=float)
+
+# Worker/thread planning (see tunzadent/cpu_plan.py and gunicorn.conf.py);
+# 0 = derive from the CPU quota, physical cores and memory
+WEB_CONCURRENCY = config('WEB_CONCURRENCY', default=0, cast=int)
+TORCH_THREADS = config('TORCH_THREADS', default=0, cast=int)  # intra-op threads per worker
+WORKER_MEMORY_MB = config('WORKER_MEMORY_MB', default=0, cast=int)
+CPU_AFFINITY = config('CPU_AFFINITY', default=True, cast=bool)  # pin workers to their cores
+CPU_PLAN_MEASURE = config('CPU_PLAN_MEASURE', default=False, cast=bool)  # benchmark the plan at startup
+
+# Model precision on CPU: 'auto' (bf16 if the CPU has native support and it
+# measures faster at startup), 'bf16' or 'fp32'
+INFERENCE_PRECISION = config('INFERENCE_PRECISION', default='auto')
+
+# Two-stage inference: low-resolution first pass, full pass only for uncertain films
+INFERENCE_CASCADE = config('INFERENCE_CASCADE', default=False, cast=bool)
+CASCADE_FAST_SIZE = config('CASCADE_FAST_SIZE', default=112, cast=int)
+CASCADE_FAST_DEPTH = config('CASCADE_FAST_DEPTH', default=0, cast=int)  # 0 = all blocks
+CASCADE_ACCEPT_CARIES = config('CASCADE_ACCEPT_CARIES', default=0.90, cast=float)
+CASCADE_ACCEPT_HEALTHY = config('CASCADE_ACCEPT_HEALTHY', default=0.85, cast=float)
+
+# ToMe token merging on the full pass: tokens merged per block, e.g. '8' or
+# a comma-separated per-block list; empty disables it
+INFERENCE_TOKEN_MERGE = config('INFERENCE_TOKEN_MERGE', default='')
+
+# Tiled inference for large films: overlapping 224px tiles scored in one batch
+# instead of squashing the whole film into one 224x224 square
+INFERENCE_TILING = config('INFERENCE_TILING', default=False, cast=bool)
+TILE_SHORT_SIDE = config('TILE_SHORT_SIDE', default=448, cast=int)  # film short side before tiling
+TILE_OVERLAP = config('TILE_OVERLAP', default=0.25, cast=float)
+TILE_MAX = config('TILE_MAX', default=24, cast=int)
+TILE_AGGREGATION = config('TILE_AGGREGATION', default='max')  # 'max' or 'mean'
+
+# Out-of-process inference: when set, web workers send tensors to the
+# `manage.py inference_server` process listening on this Unix socket instead
+# of loading the model themselves
+INFERENCE_SERVER_SOCKET = config('INFERENCE_SERVER_SOCKET', default='')
+INFERENCE_SERVER_TIMEOUT = config('INFERENCE_SERVER_TIMEOUT', default=60.0, cast=float)  # per forward pass
+INFERENCE_SERVER_WAIT = config('INFERENCE_SERVER_WAIT', default=30.0, cast=float)  # for the server at startup
+
+# Memory-mapped similar-case index, rebuilt by `manage.py build_embedding_index`
+EMBEDDING_INDEX_DIR = config('EMBEDDING_INDEX_DIR', default=os.path.join(tempfile.gettempdir(), 'tunzadent-embeddings'))
+
 # Hugging Face model config - set HF_MODEL_REPO in Railway env vars
 HF_MODEL_REPO = config('HF_MODEL_REPO', default='')
 HF_TOKEN = config('HF_TOKEN', default='')
+# Local checkpoint path; override to point at a synthetic checkpoint for load tests
+MODEL_PATH = config('MODEL_PATH', default=str(BASE_DIR / 'ml_models' / 'best_caries_classifier_v2.pth'))
 
 if not DEBUG:
     SECURE_SSL_REDIRECT = config('SECURE_SSL_REDIRECT', default=False, cast=bool)
@@ -0,0 +1,154 @@
+"""
+Per-request timing: SQL, inference stages and rendering.
+
+ServerTimingMiddleware opens a RequestTrace for each request. Code anywhere
+below the view can add to it with `span('name')`; outside a request (shell,
+benchmarks, management commands) span() is a no-op.
+"""
+import json
+import logging
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('tunzadent.slow_requests')
+
+_current_trace = ContextVar('request_trace', default=None)
+
+# Cap on recorded statements so a runaway N+1 can't grow the trace unbounded
+MAX_RECORDED_QUERIES = 200
+
+
+class RequestTrace:
+    """Accumulated timings for a single request."""
+
+    def __init__(self):
+        self.spans = {}
+        self.query_count = 0
+        self.query_time_ms = 0.0
+        self.queries = []
+
+    def add(self, name, duration_ms):
+        self.spans[name] = self.spans.get(name, 0.0) + duration_ms
+
+    def record_query(self, sql, duration_ms):
+        self.query_count += 1
+        self.query_time_ms += duration_ms
+        if len(self.queries) < MAX_RECORDED_QUERIES:
+            self.queries.append((duration_ms, sql))
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name):
+    """Time the enclosed block into the active request trace, if any."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, (time.perf_counter() - start) * 1000)
+
+
+class ServerTimingMiddleware:
+    """
+    Emit Server-Timing headers and log slow requests.
+
+    Settings:
+    - SERVER_TIMING_ENABLED: add the Server-Timing header (default True)
+    - SLOW_REQUEST_THRESHOLD_MS: log requests slower than this (default 1000)
+    - SLOW_REQUEST_MAX_QUERIES: how many of the slowest queries to log
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.header_enabled = getattr(settings, 'SERVER_TIMING_ENABLED', True)
+        self.threshold_ms = getattr(settings, 'SLOW_REQUEST_THRESHOLD_MS', 1000)
+        self.max_logged_queries = getattr(settings, 'SLOW_REQUEST_MAX_QUERIES', 10)
+
+    def __call__(self, request):
+        trace = RequestTrace()
+        token = _current_trace.set(trace)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(self._query_wrapper(trace)))
+                response = self.get_response(request)
+        finally:
+            _current_trace.reset(token)
+        total_ms = (time.perf_counter() - start) * 1000
+
+        size = self._response_size(response)
+        if self.header_enabled:
+            response['Server-Timing'] = self._header(trace, total_ms, size)
+        if total_ms >= self.threshold_ms:
+            self._log_slow_request(request, response, trace, total_ms, size)
+        return response
+
+    def process_template_response(self, request, response):
+        # Called right before DRF/TemplateResponse rendering; time the render
+        trace = _current_trace.get()
+        if trace is not None:
+            render_start = time.perf_counter()
+            response.add_post_render_callback(
+                lambda r: trace.add('render', (time.perf_counter() - render_start) * 1000)
+            )
+        return response
+
+    @staticmethod
+    def _query_wrapper(trace):
+        def wrapper(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                trace.record_query(sql, (time.perf_counter() - start) * 1000)
+        return wrapper
+
+    @staticmethod
+    def _response_size(response):
+        # Streamed bodies (exports, media) are only sized when Content-Length is set
+        if not response.streaming:
+            return len(response.content)
+        length = response.get('Content-Length')
+        return int(length) if length and length.isdigit() else None
+
+    @staticmethod
+    def _header(trace, total_ms, size=None):
+        metrics = [f'db;dur={trace.query_time_ms:.1f};desc="{trace.query_count} queries"']
+        for name, duration in trace.spans.items():
+            metrics.append(f'{name};dur={duration:.1f}')
+        if size is not None:
+            metrics.append(f'resp;desc="{size} bytes"')
+        metrics.append(f'total;dur={total_ms:.1f}')
+        return ', '.join(metrics)
+
+    def _log_slow_request(self, request, response, trace, total_ms, size):
+        slowest = sorted(trace.queries, key=lambda q: q[0], reverse=True)
+        entry = {
+            'event': 'slow_request',
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'user_id': getattr(getattr(request, 'user', None), 'id', None),
+            'total_ms': round(total_ms, 1),
+            'db_ms': round(trace.query_time_ms, 1),
+            'query_count': trace.query_count,
+            'spans_ms': {name: round(d, 1) for name, d in trace.spans.items()},
+            'response_bytes': size,
+            'queries': [
+                {'ms': round(duration, 2), 'sql': sql}
+                for duration, sql in slowest[:self.max_logged_queries]
+            ],
+        }
+        logger.warning(json.dumps(entry))
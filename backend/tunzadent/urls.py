@@ -1,8 +1,8 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
 from django.http import JsonResponse
+from predictions.media import serve_media
 
 def health_check(request):
     return JsonResponse({'status': 'ok', 'service': 'tunzadent-backend'})
@@ -14,5 +14,7 @@ urlpatterns = [
     path('health/', health_check, name='health'),
 ]
 
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# Uploaded radiographs, only through signed links (predictions/media.py)
+urlpatterns += [
+    re_path(rf"^{settings.MEDIA_URL.lstrip('/')}(?P<path>.+)$", serve_media, name='media'),
+]
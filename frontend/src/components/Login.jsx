@@ -25,18 +25,16 @@ const Login = () => {
       if (response.requires_2fa_setup) {
         toast.success('Please set up two-factor authentication to continue');
         navigate('/setup-2fa', {
-          state: {
-            username: formData.username,
-            password: formData.password,
-            user_id: response.user_id
-          }
+          state: { challenge_token: response.challenge_token }
         });
         return;
       }
       
       if (response.requires_2fa) {
         setRequires2FA(true);
-        setPendingLogin({ username: formData.username, password: formData.password });
+        setPendingLogin({ username: formData.username });
+        // Later attempts send the signed challenge instead of re-checking the password
+        setFormData(prev => ({ ...prev, challenge_token: response.challenge_token }));
         toast.success('Enter your two-factor authentication code');
         return;
       }
@@ -8,7 +8,7 @@ export default function Setup2FA() {
   const navigate = useNavigate();
   const location = useLocation();
   const { updateUser } = useAuth();
-  const { username, password, user_id } = location.state || {};
+  const { challenge_token } = location.state || {};
 
   const [qrCode, setQrCode] = useState('');
   const [secret, setSecret] = useState('');
@@ -20,11 +20,7 @@ export default function Setup2FA() {
 
   const fetchQRCode = useCallback(async () => {
     try {
-      const response = await authService.setup2FA({
-        username,
-        password,
-        user_id
-      });
+      const response = await authService.setup2FA({ challenge_token });
 
       setQrCode(response.data.qr_code);
       setSecret(response.data.secret);
@@ -33,17 +29,17 @@ export default function Setup2FA() {
       toast.error('Failed to generate 2FA setup');
       navigate('/login');
     }
-  }, [username, password, user_id, navigate]);
+  }, [challenge_token, navigate]);
 
   useEffect(() => {
-    if (!username || !password || !user_id) {
+    if (!challenge_token) {
       toast.error('Invalid session. Please login again.');
       navigate('/login');
       return;
     }
     
     fetchQRCode();
-  }, [fetchQRCode, username, password, user_id, navigate]);
+  }, [fetchQRCode, challenge_token, navigate]);
 
   const handleVerify = async (e) => {
     e.preventDefault();
@@ -57,9 +53,7 @@ export default function Setup2FA() {
 
     try {
       const response = await authService.complete2FA({
-        username,
-        password,
-        user_id,
+        challenge_token,
         token
       });
 
@@ -91,12 +91,24 @@ export const patientService = {
   delete: (id) => api.delete(`/predictions/patients/${id}/`), 
 };
 
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
 // Prediction services
 export const predictionService = {
-  uploadAndPredict: (formData) => 
-    api.post('/predictions/upload-predict/', formData, {
-      headers: { 'Content-Type': 'multipart/form-data' },
-    }),
+  // The server sheds load with 429 + Retry-After when inference is saturated
+  uploadAndPredict: async (formData, retries = 3) => {
+    for (let attempt = 0; ; attempt++) {
+      try {
+        return await api.post('/predictions/upload-predict/', formData, {
+          headers: { 'Content-Type': 'multipart/form-data' },
+        });
+      } catch (error) {
+        if (error.response?.status !== 429 || attempt >= retries) throw error;
+        const retryAfter = parseInt(error.response.headers['retry-after'], 10) || 2;
+        await sleep(retryAfter * 1000);
+      }
+    }
+  },
   getStats: () => api.get('/predictions/stats/'),
   getPatientScans: (patientId) => api.get(`/predictions/patients/${patientId}/scans/`), 
   getScanDetails: (scanId) => api.get(`/predictions/scans/${scanId}/`)